@@ -0,0 +1,290 @@
+"""Generates synthetic documents, with data to go with them, for benchmarking.
+
+Documents are written as AST yaml (in JSON, its flow-style subset), or with
+format=markup as native markup, laid out as maxdoc expects to be run on
+them:
+
+    <dpath>/index.mdoc        the document (index.mdm in markup)
+    <dpath>/parts/*.mdoc      included files (*.mdm)
+    <dpath>/data/*.yaml       books and authors
+    <dpath>/../templates      (a link to the templates, for the html renderer)
+"""
+
+import argparse
+import json
+import os
+import random
+
+
+DEFAULTS = {
+    # headings nested inside each section, and headings per heading
+    'depth': 3,
+    'width': 3,
+    # paragraphs directly under each heading
+    'paragraphs': 2,
+    # files included per file, and how many levels of files include others
+    'fanout': 10,
+    'include_levels': 2,
+    # fraction of include sites wrapped in a prune_heading_levels region
+    'prune_fraction': 0.25,
+    'prune_max_level': 1,
+    # references to DB records per paragraph
+    'book_refs': 1,
+    'author_refs': 1,
+    # env_var references per paragraph, each followed by more text (the
+    # variable is ENV_VAR, which must be set when building)
+    'env_refs': 0,
+    # rows in the data files
+    'books': 1000,
+    'authors': 1000,
+    'seed': 0,
+    # yaml or markup
+    'format': 'yaml',
+}
+
+# the environment variable that env_var references name
+ENV_VAR = 'MAXDOC_BENCH_VAR'
+
+# format -> extension of the files written
+EXTENSIONS = {'yaml': '.mdoc', 'markup': '.mdm'}
+
+PRESETS = {
+    'small': {},
+    'medium': {'fanout': 20, 'depth': 4, 'books': 10000, 'authors': 10000},
+    'large': {'fanout': 40, 'depth': 4, 'width': 4, 'books': 100000,
+              'authors': 100000},
+}
+
+
+def _text(rng):
+    return {'NODE_TYPE': 'Text', 'body': 'word ' * rng.randint(5, 30)}
+
+
+def _paragraph(rng, params):
+    children = [_text(rng)]
+    for _ in range(params['env_refs']):
+        children.append({
+            'NODE_TYPE': 'AST_TRANSFORMATION',
+            'TRANSFORMATION': 'env_var',
+            'body': ENV_VAR,
+        })
+        children.append(_text(rng))
+    for _ in range(params['book_refs']):
+        children.append({
+            'NODE_TYPE': 'Book',
+            'id': 'book{}'.format(rng.randrange(params['books'])),
+        })
+        children.append(_text(rng))
+    for _ in range(params['author_refs']):
+        children.append({
+            'NODE_TYPE': 'Author',
+            'id': 'author{}'.format(rng.randrange(params['authors'])),
+        })
+        children.append(_text(rng))
+    return {'NODE_TYPE': 'Para', 'CHILDREN': children}
+
+
+def _section(rng, params, depth, title):
+    children = [_paragraph(rng, params) for _ in range(params['paragraphs'])]
+    if depth > 1:
+        children.extend(
+            _section(rng, params, depth - 1, "{}.{}".format(title, i + 1))
+            for i in range(params['width'])
+        )
+    return {'NODE_TYPE': 'Head', 'title': title, 'CHILDREN': children}
+
+
+def _include(rng, params, fname):
+    node = {
+        'NODE_TYPE': 'AST_TRANSFORMATION',
+        'TRANSFORMATION': 'include_ast',
+        'path': fname,
+    }
+    if rng.random() < params['prune_fraction']:
+        node = {
+            'NODE_TYPE': 'AST_TRANSFORMATION',
+            'TRANSFORMATION': 'prune_heading_levels',
+            'max_level': params['prune_max_level'],
+            'CHILDREN': [node],
+        }
+    return node
+
+
+def _write_ast(fpath, ast):
+    with open(fpath, 'w') as fp:
+        json.dump(ast, fp, indent=1)
+
+
+_MARKUP_COMMANDS = {
+    'Document': 'document', 'Head': 'head', 'Emph': 'em', 'Strong': 'strong',
+    'include_ast': 'include', 'prune_heading_levels': 'prune',
+}
+_MARKUP_BLOCKS = {'document', 'head', 'include', 'prune'}
+_MARKUP_ESCAPES = str.maketrans({'\\': '\\\\', '{': '\\{', '}': '\\}'})
+
+
+def _markup(node, out):
+    if isinstance(node, list):
+        for child in node:
+            _markup(child, out)
+        return
+
+    node_type = node['NODE_TYPE']
+    if node_type == 'Text':
+        out.append(node['body'].translate(_MARKUP_ESCAPES))
+        return
+
+    if node_type == 'Para':
+        out.append('\n')
+        _markup(node.get('CHILDREN', []), out)
+        out.append('\n\n')
+        return
+
+    if node_type == 'AST_TRANSFORMATION':
+        node_type = node['TRANSFORMATION']
+    if node_type == 'env_var':
+        out.append('\\env{' + node['body'] + '}')
+        return
+    name = _MARKUP_COMMANDS.get(node_type, node_type)
+
+    fields = [
+        "{}={}".format(k, json.dumps(v) if isinstance(v, str) else v)
+        for k, v in node.items()
+        if k not in ('NODE_TYPE', 'TRANSFORMATION', 'CHILDREN')
+    ]
+    out.append('\\' + name)
+    if fields:
+        out.append('[{}]'.format(', '.join(fields)))
+    if node.get('CHILDREN'):
+        out.append('{')
+        _markup(node['CHILDREN'], out)
+        out.append('}')
+    if name in _MARKUP_BLOCKS:
+        out.append('\n')
+
+
+def _write_markup(fpath, ast):
+    out = []
+    _markup(ast, out)
+    with open(fpath, 'w') as fp:
+        fp.write(''.join(out))
+
+
+def _write_rows(fpath, rows):
+    with open(fpath, 'w') as fp:
+        for row in rows:
+            fp.write("- " + "\n  ".join(
+                "{}: {}".format(k, json.dumps(v)) for k, v in row.items()
+            ) + "\n")
+
+
+def generate(dpath, **params):
+    """Writes a document generated from params (see DEFAULTS) to dpath.
+
+    Returns:
+        The number of files written.
+    """
+    params = dict(DEFAULTS, **params)
+    rng = random.Random(params['seed'])
+
+    os.makedirs(os.path.join(dpath, 'parts'), exist_ok=True)
+    os.makedirs(os.path.join(dpath, 'data'), exist_ok=True)
+
+    templates = os.path.join(os.path.dirname(os.path.abspath(dpath)),
+                             'templates')
+    if not os.path.exists(templates):
+        os.symlink(
+            os.path.join(os.path.dirname(os.path.dirname(
+                os.path.abspath(__file__))), 'templates'),
+            templates
+        )
+
+    extension = EXTENSIONS[params['format']]
+    write = _write_markup if params['format'] == 'markup' else _write_ast
+
+    files = 0
+    counter = [0]
+
+    def includes(level):
+        """Writes fanout included files (each including more, down to
+        include_levels), returning the nodes that include them."""
+        nodes = []
+        for _ in range(params['fanout']):
+            counter[0] += 1
+            fname = os.path.join(
+                'parts', 'part{}{}'.format(counter[0], extension)
+            )
+
+            children = [_section(rng, params, params['depth'],
+                                 "Part {}".format(counter[0]))]
+            if level < params['include_levels']:
+                children.extend(includes(level + 1))
+
+            write(os.path.join(dpath, fname), children)
+            nodes.append(_include(rng, params, fname))
+        return nodes
+
+    doc = {
+        'NODE_TYPE': 'Document',
+        'title': 'Synthetic benchmark document',
+        'CHILDREN': [_section(rng, params, params['depth'], "Introduction")]
+                    + includes(1),
+    }
+    write(os.path.join(dpath, 'index' + extension), doc)
+    files += counter[0] + 1
+
+    _write_rows(os.path.join(dpath, 'data', 'books.yaml'), (
+        {
+            'id': 'book{}'.format(i),
+            'title': 'Book number {}'.format(i),
+            'url': 'https://example.com/books/{}'.format(i),
+        }
+        for i in range(params['books'])
+    ))
+    _write_rows(os.path.join(dpath, 'data', 'authors.yaml'), (
+        {
+            'id': 'author{}'.format(i),
+            'pen_name': 'Author {}'.format(i),
+            'url': 'https://example.com/authors/{}'.format(i),
+        }
+        for i in range(params['authors'])
+    ))
+    files += 2
+
+    return files
+
+
+def index_name(params):
+    """Returns the name of the document generate() writes for params."""
+    return 'index' + EXTENSIONS[params.get('format', DEFAULTS['format'])]
+
+
+def parse_params(pairs, preset='small'):
+    """Returns generator parameters from a preset name plus a list of
+    "name=value" overrides."""
+    params = dict(DEFAULTS, **PRESETS[preset])
+    for pair in pairs or []:
+        k, _, v = pair.partition('=')
+        if k not in DEFAULTS:
+            raise ValueError("Unknown document parameter: {}".format(k))
+        params[k] = type(DEFAULTS[k])(v)
+    return params
+
+
+def main(argv=None):
+    argparser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    argparser.add_argument('--preset', choices=sorted(PRESETS),
+                           default='small')
+    argparser.add_argument(
+        '-p', '--param', action='append', metavar='NAME=VALUE',
+        help="Override a document parameter: {}".format(", ".join(DEFAULTS))
+    )
+    argparser.add_argument('dpath')
+    args = argparser.parse_args(argv)
+
+    files = generate(args.dpath, **parse_params(args.param, args.preset))
+    print("Wrote {} files to {}".format(files, args.dpath))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,112 @@
+"""Compares how fast documents are parsed as AST yaml and as native markup.
+
+The same synthetic document is generated in both formats, and every file
+of it is loaded (without the AST cache) in each, reporting throughput in
+MB/s of source and in nodes per second:
+
+    python -m benchmarks.parse --preset medium
+"""
+
+import argparse
+import glob
+import os
+import sys
+import tempfile
+import time
+
+from . import generate
+
+
+def _count_nodes(ast_node):
+    from maxdoc.ast import NodeField
+
+    count = 0
+    stack = [ast_node]
+    while stack:
+        node = stack.pop()
+        count += 1
+        stack.extend(node[NodeField.CHILDREN])
+    return count
+
+
+def _load_all(fpaths):
+    from maxdoc.ast import load_ast
+
+    return [load_ast(fpath, top_level=False) for fpath in fpaths]
+
+
+def run(params, repeat=3):
+    """Generates params' document in each format, and times parsing it.
+
+    Returns:
+        A dict of format -> results.
+    """
+    results = {}
+
+    with tempfile.TemporaryDirectory(prefix='maxdoc-bench-') as tmp:
+        for fmt in generate.EXTENSIONS:
+            dpath = os.path.join(tmp, fmt)
+            generate.generate(dpath, **dict(params, format=fmt))
+
+            extension = generate.EXTENSIONS[fmt]
+            fpaths = [os.path.join(dpath, 'index' + extension)] + sorted(
+                glob.glob(os.path.join(dpath, 'parts', '*' + extension))
+            )
+            size = sum(os.path.getsize(fpath) for fpath in fpaths)
+
+            times = []
+            for _ in range(repeat):
+                started = time.perf_counter()
+                asts = _load_all(fpaths)
+                times.append(time.perf_counter() - started)
+
+            seconds = min(times)
+            nodes = sum(_count_nodes(ast) for ast in asts)
+            results[fmt] = {
+                'files': len(fpaths),
+                'bytes': size,
+                'nodes': nodes,
+                'seconds': seconds,
+                'mb_per_second': size / seconds / 1e6,
+                'nodes_per_second': nodes / seconds,
+            }
+
+    return results
+
+
+def summary(results):
+    lines = ["{:<8} {:>6} {:>10} {:>9} {:>9} {:>8} {:>12}".format(
+        "format", "files", "MB", "nodes", "time (s)", "MB/s", "nodes/s"
+    )]
+    for fmt, r in results.items():
+        lines.append(
+            "{:<8} {:>6} {:>10.2f} {:>9} {:>9.3f} {:>8.2f} {:>12.0f}".format(
+                fmt, r['files'], r['bytes'] / 1e6, r['nodes'], r['seconds'],
+                r['mb_per_second'], r['nodes_per_second']
+            )
+        )
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    argparser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    argparser.add_argument(
+        '--preset', choices=sorted(generate.PRESETS), default='small'
+    )
+    argparser.add_argument(
+        '-p', '--param', action='append', metavar='NAME=VALUE',
+        help="Override a document parameter: {}".format(
+            ", ".join(generate.DEFAULTS)
+        )
+    )
+    argparser.add_argument('--repeat', type=int, default=3,
+                           help="Timed loads per format (the fastest is kept)")
+    args = argparser.parse_args(argv)
+
+    print(summary(run(generate.parse_params(args.param, args.preset),
+                      repeat=args.repeat)))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,258 @@
+"""Times each stage of a maxdoc build of a synthetic document.
+
+Each stage (gathering, loading, transforming, prefetching DB records,
+optimizing the AST, with --optimize-ast, and rendering) is timed
+separately, over several fresh builds, and then measured for peak memory
+in one more traced build. Results are written as JSON, which can be
+compared with the results of another revision:
+
+    python -m benchmarks.run --preset medium -o new.json --compare old.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from . import generate
+
+
+STAGES = ('gather', 'load', 'transform', 'prefetch', 'optimize', 'render')
+
+
+def _revision():
+    try:
+        return subprocess.check_output(
+            ['git', 'describe', '--always', '--dirty'],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=subprocess.DEVNULL, universal_newlines=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _build(renderer_name, measure, index='index.mdoc', optimize=False):
+    """Runs one fresh build of index (in the current directory), calling
+    measure(stage, fn) to run each stage.
+
+    Args:
+        optimize: Whether to optimize the AST before rendering (otherwise,
+                  the optimize stage does nothing).
+    """
+    # imported here, so that import time isn't counted as part of a stage
+    from maxdoc.ast import load_ast, transform_ast
+    from maxdoc.ast.optimize import optimize_ast
+    from maxdoc.config import get_config
+    from maxdoc.data import gather_all
+    from maxdoc.db import init_db
+    from maxdoc.gatherers import ALL_GATHERERS
+    from maxdoc.renderers import ALL_RENDERERS
+    from maxdoc.renderers.records import RecordMap
+
+    config = get_config([
+        'maxdoc', '--no-ast-cache', '--renderer', renderer_name,
+        index, os.devnull
+    ])
+    db_engine, DBSession = init_db()
+    db_session = DBSession()
+
+    renderer = ALL_RENDERERS[renderer_name]
+    # start from cold, as a new process would
+    renderer.reload()
+
+    measure('gather', lambda: gather_all(ALL_GATHERERS, config, db_session))
+    ast = measure('load', lambda: load_ast(config.input_doc))
+    ast = measure('transform', lambda: transform_ast(config, db_session, ast))
+
+    config.db_records = RecordMap()
+    missing = measure(
+        'prefetch', lambda: config.db_records.prefetch(db_session, ast)
+    )
+    if missing:
+        raise RuntimeError("Missing DB records: {!r}".format(missing[:5]))
+
+    measure('optimize', lambda: optimize_ast([renderer], ast) if optimize
+            else None)
+    measure('render', lambda: renderer.render(config, db_session, ast))
+    config.out_fp.close()
+    db_session.close()
+
+
+def run(params, renderer_name='html', repeat=3, optimize=False):
+    """Generates a document from params and benchmarks building it.
+
+    Returns:
+        The results, as a JSON-serialisable dict.
+    """
+    timings = {stage: {'wall': [], 'cpu': []} for stage in STAGES}
+    peaks = {}
+
+    def timed(stage, fn):
+        wall = time.perf_counter()
+        cpu = time.process_time()
+        result = fn()
+        timings[stage]['wall'].append(time.perf_counter() - wall)
+        timings[stage]['cpu'].append(time.process_time() - cpu)
+        return result
+
+    def traced(stage, fn):
+        # peak of the memory allocated while the stage ran
+        tracemalloc.start()
+        try:
+            result = fn()
+            peaks[stage] = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+        return result
+
+    old_cwd = os.getcwd()
+    with tempfile.TemporaryDirectory(prefix='maxdoc-bench-') as tmp:
+        dpath = os.path.join(tmp, 'doc')
+        started = time.perf_counter()
+        files = generate.generate(dpath, **params)
+        generated = time.perf_counter() - started
+
+        os.chdir(dpath)
+        os.environ.setdefault(generate.ENV_VAR, 'value')
+        try:
+            index = generate.index_name(params)
+            for _ in range(repeat):
+                _build(renderer_name, timed, index, optimize)
+            _build(renderer_name, traced, index, optimize)
+        finally:
+            os.chdir(old_cwd)
+
+    return {
+        'revision': _revision(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'renderer': renderer_name,
+        'optimize_ast': optimize,
+        'params': params,
+        'files': files,
+        'generate_seconds': generated,
+        'repeat': repeat,
+        'stages': {
+            stage: {
+                'wall': statistics.median(timings[stage]['wall']),
+                'wall_min': min(timings[stage]['wall']),
+                'cpu': statistics.median(timings[stage]['cpu']),
+                'peak_alloc_bytes': peaks[stage],
+            }
+            for stage in STAGES
+        },
+        'total_wall': sum(
+            statistics.median(timings[stage]['wall']) for stage in STAGES
+        ),
+        # KiB on Linux
+        'max_rss': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    }
+
+
+def summary(results):
+    lines = ["{:<10} {:>10} {:>10} {:>12}".format(
+        "stage", "wall (s)", "cpu (s)", "peak (MiB)"
+    )]
+    for stage, r in results['stages'].items():
+        lines.append("{:<10} {:>10.3f} {:>10.3f} {:>12.1f}".format(
+            stage, r['wall'], r['cpu'], r['peak_alloc_bytes'] / 2 ** 20
+        ))
+    lines.append("{:<10} {:>10.3f}".format("total", results['total_wall']))
+    return "\n".join(lines)
+
+
+def compare(old, new, threshold):
+    """Returns a report comparing old and new results, and the stages that
+    got slower by more than threshold (a ratio)."""
+    lines = ["{} -> {}".format(old.get('revision'), new.get('revision'))]
+    if old.get('params') != new.get('params'):
+        lines.append("WARNING: the documents' parameters differ")
+
+    regressions = []
+    for stage, r in new['stages'].items():
+        if stage not in old['stages']:
+            continue
+
+        # the fastest run is the least disturbed by whatever else the
+        # machine was doing
+        old_r = old['stages'][stage]
+        ratio = (r['wall_min'] / old_r['wall_min'] if old_r['wall_min']
+                 else float('inf'))
+        mem_ratio = (r['peak_alloc_bytes'] / old_r['peak_alloc_bytes']
+                     if old_r['peak_alloc_bytes'] else float('inf'))
+
+        flag = ""
+        if ratio > threshold:
+            regressions.append(stage)
+            flag = "  SLOWER"
+
+        lines.append(
+            "{:<10} {:>8.3f}s -> {:>8.3f}s  x{:.2f}  memory x{:.2f}{}".format(
+                stage, old_r['wall_min'], r['wall_min'], ratio, mem_ratio, flag
+            )
+        )
+
+    return "\n".join(lines), regressions
+
+
+def main(argv=None):
+    argparser = argparse.ArgumentParser(
+        description=__doc__.splitlines()[0],
+    )
+    argparser.add_argument(
+        '--preset', choices=sorted(generate.PRESETS), default='small'
+    )
+    argparser.add_argument(
+        '-p', '--param', action='append', metavar='NAME=VALUE',
+        help="Override a document parameter: {}".format(
+            ", ".join(generate.DEFAULTS)
+        )
+    )
+    argparser.add_argument('--renderer', default='html')
+    argparser.add_argument('--optimize-ast', default=False,
+                           action="store_true",
+                           help="Optimize the AST before rendering")
+    argparser.add_argument('--repeat', type=int, default=3,
+                           help="Timed builds per stage (the median is kept)")
+    argparser.add_argument('-o', '--output', help="Write results JSON here")
+    argparser.add_argument(
+        '--compare', metavar='RESULTS_JSON',
+        help="Compare with earlier results, failing if any stage is slower"
+    )
+    argparser.add_argument(
+        '--threshold', type=float, default=1.25,
+        help="How much slower (as a ratio) a stage may get before --compare "
+             "fails"
+    )
+    args = argparser.parse_args(argv)
+
+    results = run(generate.parse_params(args.param, args.preset),
+                  renderer_name=args.renderer, repeat=args.repeat,
+                  optimize=args.optimize_ast)
+
+    print(summary(results))
+
+    if args.output:
+        with open(args.output, 'w') as fp:
+            json.dump(results, fp, indent=2, sort_keys=True)
+
+    if args.compare:
+        with open(args.compare) as fp:
+            report, regressions = compare(json.load(fp), results,
+                                          args.threshold)
+        print(report)
+        if regressions:
+            return 1
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
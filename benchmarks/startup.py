@@ -0,0 +1,205 @@
+"""Times how long bin/maxdoc takes to start up, and what it imports.
+
+A tiny document (with no DB records in it) is built, in a fresh process,
+with each renderer, and so is one that refers to a DB record, reporting
+the fastest of several runs:
+
+    python -m benchmarks.startup
+
+It also lists the heaviest imports that `import maxdoc.tui` makes (from
+`python -X importtime`), and which of the heavy optional packages each
+build loaded. With --max-ms, it fails if any build takes longer than that,
+or if a build of a document without DB records loads SQLAlchemy, so that
+import cost regressions are caught.
+"""
+
+import argparse
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import time
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# packages that building a document shouldn't load unless it needs them
+HEAVY_MODULES = ('sqlalchemy', 'jinja2', 'yaml')
+
+DOCUMENTS = {
+    'plain': "\\document[title=\"Startup\"]{\n    Hello, world.\n}\n",
+    'db': "\\document[title=\"Startup\"]{\n    Read \\Book[id=b1].\n}\n",
+}
+
+DATA = {
+    'books.yaml': "- id: b1\n  title: A Book\n",
+    'authors.yaml': "- id: a1\n  pen_name: An Author\n",
+}
+
+# runs a build as bin/maxdoc would, then reports which heavy packages it
+# loaded
+_BUILD_SCRIPT = """
+import sys
+from maxdoc import main
+rc = main(sys.argv[1:])
+print(' '.join(m for m in {heavy!r} if m in sys.modules))
+sys.exit(rc)
+"""
+
+
+def _env():
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(
+        [ROOT] + [p for p in [env.get('PYTHONPATH')] if p]
+    )
+    return env
+
+
+def _write_inputs(dpath):
+    """Writes the documents and their data to dpath/doc, next to the
+    templates (which the html renderer looks for in ../templates).
+
+    Returns:
+        The directory to build in.
+    """
+    os.symlink(os.path.join(ROOT, 'templates'),
+               os.path.join(dpath, 'templates'))
+
+    dpath = os.path.join(dpath, 'doc')
+    os.makedirs(os.path.join(dpath, 'data'))
+    for fname, content in DATA.items():
+        with open(os.path.join(dpath, 'data', fname), 'w') as fp:
+            fp.write(content)
+
+    for name, content in DOCUMENTS.items():
+        with open(os.path.join(dpath, name + '.mdm'), 'w') as fp:
+            fp.write(content)
+
+    return dpath
+
+
+def time_build(dpath, document, renderer, repeat):
+    """Builds document with renderer repeat times, each in a new process.
+
+    Returns:
+        (the fastest run's wall time in seconds, the heavy packages loaded)
+    """
+    script = _BUILD_SCRIPT.format(heavy=HEAVY_MODULES)
+    argv = [
+        sys.executable, '-c', script, 'maxdoc', '--no-ast-cache',
+        '--renderer', renderer, document + '.mdm', os.path.join(dpath, 'out')
+    ]
+
+    times = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        proc = subprocess.run(
+            argv, cwd=dpath, env=_env(), check=True,
+            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+            universal_newlines=True
+        )
+        times.append(time.perf_counter() - started)
+
+    return min(times), proc.stdout.split()
+
+
+def import_times(module='maxdoc.tui', top=10):
+    """Returns the top modules by cumulative import time (in seconds) of
+    importing module, as (seconds, name)."""
+    proc = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', 'import ' + module],
+        env=_env(), check=True, stderr=subprocess.PIPE,
+        universal_newlines=True
+    )
+
+    times = {}
+    for line in proc.stderr.splitlines():
+        match = re.match(r'import time:\s+\d+ \|\s+(\d+) \|\s*(\S+)', line)
+        if match:
+            name = match.group(2)
+            times[name] = max(times.get(name, 0), int(match.group(1)) / 1e6)
+
+    return sorted(((s, name) for name, s in times.items()), reverse=True)[:top]
+
+
+def run(renderers=('utf8', 'html'), repeat=5):
+    results = {'builds': [], 'imports': import_times()}
+
+    with tempfile.TemporaryDirectory(prefix='maxdoc-bench-') as tmp:
+        dpath = _write_inputs(tmp)
+        for document in DOCUMENTS:
+            for renderer in renderers:
+                seconds, loaded = time_build(dpath, document, renderer, repeat)
+                results['builds'].append({
+                    'document': document,
+                    'renderer': renderer,
+                    'seconds': seconds,
+                    'loaded': loaded,
+                })
+
+    return results
+
+
+def summary(results):
+    lines = ["{:<10} {:<10} {:>9}  {}".format(
+        "document", "renderer", "time (ms)", "loaded"
+    )]
+    for r in results['builds']:
+        lines.append("{:<10} {:<10} {:>9.1f}  {}".format(
+            r['document'], r['renderer'], r['seconds'] * 1000,
+            ", ".join(r['loaded']) or "-"
+        ))
+
+    lines.append("")
+    lines.append("Heaviest imports of maxdoc.tui (cumulative ms):")
+    for seconds, name in results['imports']:
+        lines.append("    {:>8.1f}  {}".format(seconds * 1000, name))
+
+    return "\n".join(lines)
+
+
+def regressions(results, max_ms):
+    problems = []
+    for r in results['builds']:
+        if r['seconds'] * 1000 > max_ms:
+            problems.append("{document} with {renderer}: {ms:.1f}ms".format(
+                ms=r['seconds'] * 1000, **r
+            ))
+        if r['document'] == 'plain' and 'sqlalchemy' in r['loaded']:
+            problems.append(
+                "{document} with {renderer}: loaded sqlalchemy".format(**r)
+            )
+    return problems
+
+
+def main(argv=None):
+    argparser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    argparser.add_argument(
+        '-r', '--renderer', action='append', dest='renderers',
+        help="A renderer to build with (by default, utf8 and html)"
+    )
+    argparser.add_argument('--repeat', type=int, default=5,
+                           help="Timed builds of each (the fastest is kept)")
+    argparser.add_argument(
+        '--max-ms', type=float,
+        help="Fail if any build takes longer than this, or if a document "
+             "without DB records loads SQLAlchemy"
+    )
+    args = argparser.parse_args(argv)
+
+    results = run(args.renderers or ('utf8', 'html'), repeat=args.repeat)
+    print(summary(results))
+
+    if args.max_ms is not None:
+        problems = regressions(results, args.max_ms)
+        if problems:
+            print("\nRegressions:\n    " + "\n    ".join(problems),
+                  file=sys.stderr)
+            return 1
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1 +1,8 @@
-from .tui import main
\ No newline at end of file
+__version__ = '0.1.0'
+
+
+def main(args):
+    # the command line interface is only imported when run, so that importing
+    # maxdoc (for its version, say) stays cheap
+    from .tui import main
+    return main(args)
@@ -1,2 +1,3 @@
 from .ast import *
-from .transforms import transform_ast
\ No newline at end of file
+from .outline import Outline, OutlineEntry
+from .transforms import transform_ast
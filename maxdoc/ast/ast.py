@@ -1,14 +1,21 @@
 import abc
 import enum
-import json  # TODO: use yaml only?
 import logging
-import yaml
+import os
 
 from .exceptions import ASTError
 
 
 logger = logging.getLogger(__name__)
 
+# extensions of files in native markup (see markup.py); any other file is
+# taken to be AST yaml
+MARKUP_EXTENSIONS = ('.mdm',)
+
+# extensions of AST dumps (see dump.py) other than yaml ones, which are AST
+# yaml
+DUMP_EXTENSIONS = ('.json', '.mdast')
+
 
 class ASTLoadError(ASTError):
     pass
@@ -31,9 +38,51 @@ class NodeField(enum.Enum):
     AST_TRANSFORMATION = '_ast_transformation_'
 
 
+# Alternative spellings accepted in AST yaml files, on top of the enum member
+# names themselves.
+_AST_YAML_KEY_ALIASES = {
+    'TRANSFORMATION': NodeField.AST_TRANSFORMATION,
+}
+
+# (AST_TRANSFORMATION, AST_LIST and so on)
+_AST_YAML_NODE_TYPE_ALIASES = {'AST_' + t.name: t for t in NodeType}
+
+# the most characters of a node that repr() shows
+REPR_LIMIT = 200
+
+
+def node_type_to_ast_yaml(node_type):
+    """Returns how node_type is written in AST yaml."""
+    if isinstance(node_type, NodeType):
+        return 'AST_' + node_type.name
+    return node_type
+
+
+def _short_repr(v):
+    if isinstance(v, ASTNode):
+        return "<{} {!r}>".format(
+            v.__class__.__name__, v.get(NodeField.NODE_TYPE)
+        )
+    elif isinstance(v, list):
+        return "[{} items]".format(len(v))
+    elif isinstance(v, str) and len(v) > REPR_LIMIT:
+        v = v[:REPR_LIMIT]
+    return repr(v)
+
+
+class ASTNode(metaclass=abc.ABCMeta):
+    """Anything that can be walked, transformed and rendered as an AST node.
+
+    Node is the general-purpose implementation; table.NodeView is a compact,
+    array-backed alternative. Use isinstance(x, ASTNode) rather than checking
+    for either concrete class.
+    """
+    pass
+
+
 class Node(dict):
     def __init__(self, items=None, **kwargs):
-        items = items or []
+        items = dict(items or {})
         items.update(kwargs)
 
         if NodeField.CHILDREN not in items:
@@ -43,14 +92,29 @@ class Node(dict):
 
 
     def _replace_child(self, old_child, new_child):
-        idx = self[NodeField.CHILDREN].index(old_child)
-        self[NodeField.CHILDREN].remove(old_child)
-        self[NodeField.CHILDREN].insert(idx, new_child)
+        """Returns the node that now occupies old_child's place."""
+        children = self[NodeField.CHILDREN]
+        for idx, child in enumerate(children):
+            if child is old_child:
+                children[idx] = new_child
+                if isinstance(new_child, Node):
+                    new_child[NodeField.PARENT] = self
+                return new_child
+
+        raise ASTError("{!r} is not a child of this node".format(old_child))
+
+    def _set_children(self, children):
+        """Makes children, which may include nodes taken from elsewhere in
+        the tree, this node's children, in place of its current ones."""
+        for child in children:
+            if isinstance(child, Node):
+                child[NodeField.PARENT] = self
+        self[NodeField.CHILDREN] = children
 
-    def parents():
+    def parents(self):
         p = self
         while True:
-            p = p[NodeField.PARENT]
+            p = p.get(NodeField.PARENT)
             if p is None:
                 break
             yield p
@@ -61,11 +125,11 @@ class Node(dict):
 
         try:
             return self.__dict__[k]
-        except KeyError as e:
+        except KeyError:
             if k in self:
                 return self[k]
             else:
-                raise e
+                raise AttributeError(k)
 
     def __setattr__(self, k, v):
         try:
@@ -75,7 +139,8 @@ class Node(dict):
 
     @classmethod
     def from_ast_yaml(cls, yaml_node):
-        if isinstance(yaml_node, (str, int, float, bool)):
+        if isinstance(yaml_node,
+                      (str, int, float, bool, NodeType, type(None))):
             return yaml_node
 
         elif isinstance(yaml_node, list):
@@ -85,20 +150,29 @@ class Node(dict):
             if NodeField.NODE_TYPE.name not in yaml_node:
                 yaml_node[NodeField.NODE_TYPE.name] = NodeType.DICT
 
-            return cls({
-                cls._key_from_ast_yaml(k): cls.from_ast_yaml(v)
-                for k, v in yaml_node.items()
-            })
+            fields = {}
+            for k, v in yaml_node.items():
+                k = cls._key_from_ast_yaml(k)
+                fields[k] = cls._value_from_ast_yaml(k, v)
+
+            return cls(fields)
 
         else:
-            raise ASTError("Don't know how to load AST Yaml value {!r}".format(yaml_node)) 
+            raise ASTError("Don't know how to load AST Yaml value "
+                           "{!r}".format(yaml_node))
+
+    @classmethod
+    def _value_from_ast_yaml(cls, k, v):
+        if k is NodeField.NODE_TYPE:
+            return _AST_YAML_NODE_TYPE_ALIASES.get(v, v)
+
+        return cls.from_ast_yaml(v)
 
     @classmethod
     def _value_to_ast_yaml(cls, v):
-        if isinstance(v, cls):
-            return cls.to_ast_yaml(v)
-        else:
-            return yaml.dump(v)
+        if isinstance(v, NodeType):
+            return node_type_to_ast_yaml(v)
+        return v
 
     @classmethod
     def _key_to_ast_yaml(cls, k):
@@ -108,22 +182,26 @@ class Node(dict):
 
     @classmethod
     def _key_from_ast_yaml(cls, k):
-        if k == 'title':
-            import pudb; pudb.set_trace()
-
         try:
             return NodeField.__members__[k]
         except KeyError:
-            #print("Couldn't find {!r} in {!r}".format(k, NodeField.__members__))
-            assert isinstance(k, str)
-            return k
+            try:
+                return _AST_YAML_KEY_ALIASES[k]
+            except KeyError:
+                assert isinstance(k, str)
+                return k
 
     @classmethod
     def to_ast_yaml(cls, ast_node):
+        """Returns ast_node's subtree as plain data, as loaded from AST yaml.
+
+        This builds the whole subtree in memory; see dump.dump_ast() to
+        write large ASTs out.
+        """
         if isinstance(ast_node, list):
             return [cls.to_ast_yaml(i) for i in ast_node]
 
-        elif isinstance(ast_node, Node):
+        elif isinstance(ast_node, ASTNode):
             # treat other nodes as dictionaries to dump, with awareness of child
             # AST Nodes
             return {
@@ -135,8 +213,35 @@ class Node(dict):
             return cls._value_to_ast_yaml(ast_node)
 
     def __repr__(self):
-        simplified_ast = self.__class__.to_ast_yaml(self)
-        return json.dumps(simplified_ast, indent=4)
+        # bounded, however big the node's fields or subtree, since nodes turn
+        # up in log messages and exceptions
+        parts = ["<{} {!r}".format(
+            self.__class__.__name__, self.get(NodeField.NODE_TYPE)
+        )]
+        size = len(parts[0])
+        for k, v in self.items():
+            if k in (NodeField.NODE_TYPE, NodeField.PARENT,
+                     NodeField.CHILDREN):
+                continue
+            part = " {}={}".format(
+                k.name if isinstance(k, NodeField) else k, _short_repr(v)
+            )
+            parts.append(part)
+            size += len(part)
+            if size > REPR_LIMIT:
+                break
+
+        children = self.get(NodeField.CHILDREN)
+        if children:
+            parts.append(" ({} children)".format(len(children)))
+
+        r = "".join(parts)
+        if len(r) > REPR_LIMIT:
+            r = r[:REPR_LIMIT - 3] + "..."
+        return r + ">"
+
+
+ASTNode.register(Node)
 
 
 class ASTVisitor:
@@ -152,52 +257,179 @@ class ASTParentPopulator(ASTVisitor):
         ast_node[NodeField.PARENT] = parents[-1] if parents else None
 
 
+def _iter_children(children):
+    """Iterates over a children list, tolerating removal of the child most
+    recently yielded (from a visitor's post_visit, say)."""
+    if not isinstance(children, list):
+        # table.ChildList is already removal-safe
+        return iter(children)
+
+    return _iter_list_children(children)
+
+
+def _iter_list_children(children):
+    idx = 0
+    while idx < len(children):
+        child = children[idx]
+        yield child
+        if idx < len(children) and children[idx] is child:
+            idx += 1
+
+
 class ASTWalker:
     def walk(self, ast_visitor, ast_node, parents=None, context=None, indent=1, dump_ast_walk=False):
-        logger.debug("Visiting: {!r} (parents={!r})".format(
-                     ast_node if not isinstance(ast_node, Node)
-                     else ast_node.__dict__, parents)
-        )
+        """Visits ast_node and all of its descendants, depth first.
 
-        assert isinstance(ast_node, Node)
+        The walk uses an explicit stack, so document depth is only limited by
+        memory. A single parents list is shared by every visit and updated in
+        place; visitors that want to keep it must take a copy.
+        """
+        assert isinstance(ast_node, ASTNode)
 
-        parents = parents or []
-        context = context or {}
+        parents = list(parents) if parents else []
+        context = {} if context is None else context
+        debug = logger.isEnabledFor(logging.DEBUG)
 
-        ast_visitor.pre_visit(ast_node, parents, context)
+        pre_visit = ast_visitor.pre_visit
+        post_visit = ast_visitor.post_visit
 
-        children = [c for c in ast_node[NodeField.CHILDREN]]
-        for child in children:
-            self.walk(ast_visitor, child, parents=parents + [ast_node],
-                      context=context, indent=indent+1,
-                      dump_ast_walk=dump_ast_walk)
+        if debug:
+            self._log_visit("Visiting", ast_node, indent)
+        pre_visit(ast_node, parents, context)
+
+        parents.append(ast_node)
+        pending = [_iter_children(ast_node[NodeField.CHILDREN])]
+
+        while pending:
+            child = next(pending[-1], None)
+
+            if child is None:
+                pending.pop()
+                node = parents.pop()
+                if debug:
+                    self._log_visit("Resuming", node, indent + len(pending))
+                post_visit(node, parents, context)
+                continue
 
+            if debug:
+                self._log_visit("Visiting", child, indent + len(pending))
+            pre_visit(child, parents, context)
+
+            parents.append(child)
+            pending.append(_iter_children(child[NodeField.CHILDREN]))
+
+    def _log_visit(self, action, ast_node, indent):
         logger.debug(
-            "Resuming:",
-            ast_node if not isinstance(ast_node, Node)
-                     else ast_node.__dict__
+            "%s%s: %r", "  " * indent, action,
+            ast_node.get(NodeField.NODE_TYPE)
         )
 
-        ast_visitor.post_visit(ast_node, parents, context)
+
+def _parse_ast_yaml(text):
+    # imported here, as documents in other formats, or already in the AST
+    # cache, never need it
+    import yaml
+
+    # libyaml's loader is several times faster than the pure-python one
+    loader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+    yaml_doc = yaml.load(text, Loader=loader)
+
+    if isinstance(yaml_doc, list):
+        # a document that is just a sequence of nodes
+        yaml_doc = {
+            NodeField.NODE_TYPE.name: NodeType.LIST,
+            NodeField.CHILDREN.name: yaml_doc,
+        }
+
+    return yaml_doc
+
+
+def _compile_ast_yaml(text):
+    from .table import NodeTable
+    return NodeTable.from_ast_yaml(_parse_ast_yaml(text))
+
+
+def _computes_heading_levels(ast_node):
+    return (ast_node[NodeField.NODE_TYPE] == NodeType.TRANSFORMATION
+            and ast_node.get(NodeField.AST_TRANSFORMATION)
+                == 'compute_heading_levels')
+
+
+def _computes_heading_levels_yaml(doc):
+    return (isinstance(doc, dict)
+            and doc.get(NodeField.AST_TRANSFORMATION.name)
+                == 'compute_heading_levels')
 
 
-def load_ast_yaml(fpath, top_level=True):
+def load_ast_yaml(fpath, top_level=True, compact=False, cache=None):
+    """
+    Args:
+        top_level: Wrap the document in a compute_heading_levels
+                   transformation, unless it already is (as yaml dumps of
+                   whole transformed documents are).
+        compact: Load into a table.NodeTable and return a view of its root,
+                 instead of building a tree of Node dicts.
+        cache: A cache.ASTCache to load the compiled AST from, if it has
+               already seen this file's content.
+    """
+    if cache is not None:
+        table = cache.load(fpath, _compile_ast_yaml)
+
+        if top_level and not _computes_heading_levels(table.root):
+            # decorate document with transformation functions
+            table.wrap_root(
+                NodeType.TRANSFORMATION,
+                [(NodeField.AST_TRANSFORMATION, 'compute_heading_levels')]
+            )
+
+        # to_node() sets parents as it goes, so no populating walk
+        return table.root if compact else table.root.to_node()
+
     with open(fpath) as fp:
-        yaml_doc = yaml.load(fp.read())
-        ast = Node.from_ast_yaml(yaml_doc)
+        yaml_doc = _parse_ast_yaml(fp.read())
+
+    return ast_from_yaml_doc(
+        yaml_doc, top_level and not _computes_heading_levels_yaml(yaml_doc),
+        compact
+    )
 
-    # make sure all non-root nodes have parents
-    walker = ASTWalker()
-    walker.walk(ASTParentPopulator(), ast)
 
+def ast_from_yaml_doc(yaml_doc, top_level=True, compact=False):
+    """Builds an AST from loaded AST yaml data (or the same data from any
+    other source), as load_ast_yaml() does."""
     if top_level:
         # decorate document with transformation functions
-        new_ast = Node({
-            NodeField.NODE_TYPE: 'AST_TRANSFORM',
-            NodeField.AST_TRANSFORMATION: 'compute_heading_levels',
-            NodeField.CHILDREN: [ast],
-        })
-        ast[NodeField.PARENT] = new_ast
-        ast = new_ast
+        yaml_doc = {
+            NodeField.NODE_TYPE.name: NodeType.TRANSFORMATION,
+            NodeField.AST_TRANSFORMATION.name: 'compute_heading_levels',
+            NodeField.CHILDREN.name: [yaml_doc],
+        }
+
+    if compact:
+        # parent links are implicit in the table, so no populating walk
+        from .table import NodeTable
+        return NodeTable.from_ast_yaml(yaml_doc).root
+
+    ast = Node.from_ast_yaml(yaml_doc)
+
+    # make sure all non-root nodes have parents
+    walker = ASTWalker()
+    walker.walk(ASTParentPopulator(), ast)
 
     return ast
+
+
+def load_ast(fpath, top_level=True, compact=False, cache=None):
+    """Loads fpath as native markup, an AST dump or AST yaml, according to
+    its extension. Arguments are as for load_ast_yaml()."""
+    ext = os.path.splitext(fpath)[1]
+    if ext in MARKUP_EXTENSIONS:
+        from .markup import load_markup
+        return load_markup(fpath, top_level, compact, cache)
+
+    if ext in DUMP_EXTENSIONS:
+        # dumps are quick to load as they are, so aren't cached
+        from .dump import load_ast_dump
+        return load_ast_dump(fpath, top_level, compact)
+
+    return load_ast_yaml(fpath, top_level, compact, cache)
@@ -0,0 +1,106 @@
+"""On-disk cache of compiled ASTs.
+
+Parsing AST yaml is the slowest part of loading a document, so the result is
+kept as a serialised table.NodeTable, keyed by a hash of the source file's
+content, the maxdoc version and COMPILE_REVISION. Unchanged files are then
+loaded without touching yaml at all.
+
+The cache is on by default, in $XDG_CACHE_HOME/maxdoc/ast (~/.cache/maxdoc/ast
+if that isn't set); --ast-cache-dir moves it, and --no-ast-cache turns it
+off. Entries are never reused once stale, so the directory can be deleted at
+any time.
+"""
+
+import hashlib
+import logging
+import os
+import tempfile
+
+from .. import __version__
+from ..paths import user_cache_dir
+from .table import NodeTable
+
+
+logger = logging.getLogger(__name__)
+
+# Bump this whenever what a file compiles to changes (how markup or AST yaml
+# is parsed, or how NodeTables are serialised), so that entries compiled by
+# older code, even of the same maxdoc version, are no longer used.
+COMPILE_REVISION = 1
+
+
+def default_cache_dir():
+    return user_cache_dir('ast')
+
+
+class ASTCache:
+    def __init__(self, cache_dir):
+        self._cache_dir = cache_dir
+        self.hits = 0
+        self.misses = 0
+
+    def _cache_path(self, content, fmt=None):
+        key = hashlib.sha256()
+        key.update(__version__.encode('utf-8'))
+        key.update(b'\0')
+        key.update(str(COMPILE_REVISION).encode('utf-8'))
+        key.update(b'\0')
+        if fmt is not None:
+            key.update(fmt.encode('utf-8'))
+            key.update(b'\0')
+        key.update(content)
+        return os.path.join(self._cache_dir, key.hexdigest() + '.ast')
+
+    def load(self, fpath, compile_ast, fmt=None):
+        """Returns a NodeTable for fpath.
+
+        Args:
+            compile_ast: Called with the file's text on a cache miss, to
+                         build the table.
+            fmt: The name of the file's format, if not AST yaml.
+        """
+        with open(fpath, 'rb') as fp:
+            content = fp.read()
+
+        cache_path = self._cache_path(content, fmt)
+
+        try:
+            with open(cache_path, 'rb') as fp:
+                table = NodeTable.from_bytes(fp.read())
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as e:
+            logger.warning(
+                "Ignoring unreadable AST cache entry {}: {}".format(
+                    cache_path, e
+                )
+            )
+        else:
+            self.hits += 1
+            return table
+
+        self.misses += 1
+        table = compile_ast(content.decode('utf-8'))
+        self._store(cache_path, table, fpath)
+        return table
+
+    def _store(self, cache_path, table, fpath):
+        try:
+            data = table.to_bytes()
+        except ValueError as e:
+            logger.info("Not caching AST for {}: {}".format(fpath, e))
+            return
+
+        try:
+            os.makedirs(self._cache_dir, exist_ok=True)
+
+            # write-then-rename, so concurrent builds never see partial files
+            fd, tmp_path = tempfile.mkstemp(dir=self._cache_dir, suffix='.tmp')
+            with os.fdopen(fd, 'wb') as fp:
+                fp.write(data)
+            os.replace(tmp_path, cache_path)
+
+        except OSError as e:
+            logger.warning(
+                "Couldn't write AST cache entry for {}: {}".format(fpath, e)
+            )
@@ -0,0 +1,449 @@
+"""Dumping (transformed) ASTs to files, and loading them back.
+
+Dumps are written a node at a time, in a single walk of the tree, so that
+dumping takes memory proportional to the tree's depth, not its size. There
+are three formats:
+
+    json    The same shape as AST yaml, one node per line.
+    yaml    AST yaml, just as a hand-written document would be.
+    binary  Batches of marshalled node records, in document order. The
+            most compact, and the fastest to write and to load.
+
+A dump of a transformed AST keeps its transformation nodes, but includes,
+environment variables and so on have already been replaced by their
+content, so a loaded dump can be rendered without redoing them. Only the
+heading levels and outline are recomputed, when it's transformed again.
+"""
+
+import abc
+import json
+import marshal
+import os
+import re
+import sys
+
+from .ast import (ASTError, ASTLoadError, ASTNode, Node, NodeField, NodeType,
+                  _computes_heading_levels, _computes_heading_levels_yaml,
+                  ast_from_yaml_doc, node_type_to_ast_yaml)
+from .table import NO_NODE, NodeTable, _SERIAL_ENUMS
+
+
+FORMATS = ('json', 'yaml', 'binary')
+
+# the formats of dumps that load_ast() loads with load_ast_dump(), by
+# extension; yaml dumps are AST yaml, and load as any other AST yaml does
+EXTENSION_FORMATS = {
+    '.json': 'json',
+    '.mdast': 'binary',
+}
+
+# how much output to collect before writing it out
+WRITE_SIZE = 64 * 1024
+
+# nodes per marshalled batch, in binary dumps
+BATCH_SIZE = 4096
+
+_BINARY_HEADER = ('maxdoc-ast-dump', 1)
+
+_SKIPPED_FIELDS = (NodeField.NODE_TYPE, NodeField.PARENT, NodeField.CHILDREN)
+
+# characters that json doesn't escape, but yaml doesn't allow in a document
+# (even quoted), or takes as line breaks
+_YAML_UNESCAPED_RE = re.compile(
+    '[\x7f-\x9f\u2028\u2029\ud800-\udfff\ufffe\uffff]'
+)
+_YAML_BARE_KEY_RE = re.compile(r'[A-Za-z_][A-Za-z0-9_-]*$')
+# keys that yaml would read as something other than strings, if bare
+_YAML_RESERVED_WORDS = frozenset((
+    'y', 'n', 'yes', 'no', 'on', 'off', 'true', 'false', 'null',
+))
+
+
+def dump_format(fpath):
+    """Returns the format to dump to fpath in, going by its extension."""
+    return EXTENSION_FORMATS.get(os.path.splitext(fpath)[1], 'yaml')
+
+
+def _fields(ast_node):
+    """Returns ast_node's fields, other than its type, parent and
+    children."""
+    return [(k, v) for k, v in ast_node.items() if k not in _SKIPPED_FIELDS]
+
+
+def _as_node(ast_node):
+    if isinstance(ast_node, list):
+        return Node({NodeField.NODE_TYPE: NodeType.LIST,
+                     NodeField.CHILDREN: ast_node})
+    return ast_node
+
+
+class _TextDumper(metaclass=abc.ABCMeta):
+    """Writes an AST as nested mappings, one node per line."""
+
+    def __init__(self, fp):
+        self._fp = fp
+        self._out = []
+        self._size = 0
+
+    def _write(self, s):
+        self._out.append(s)
+        self._size += len(s)
+        if self._size >= WRITE_SIZE:
+            self._flush()
+
+    def _flush(self):
+        self._fp.write(''.join(self._out))
+        self._out = []
+        self._size = 0
+
+    @abc.abstractmethod
+    def key(self, k):
+        """Returns field name k, written as a key."""
+
+    @abc.abstractmethod
+    def string(self, s):
+        """Returns s, written as a string value."""
+
+    @abc.abstractmethod
+    def number(self, v):
+        """Returns v, an int or float, written as a number."""
+
+    def value(self, v):
+        # (true, false and null are spelt the same in json and yaml)
+        if isinstance(v, str):
+            return self.string(v)
+        elif v is None:
+            return 'null'
+        elif v is True:
+            return 'true'
+        elif v is False:
+            return 'false'
+        elif isinstance(v, (int, float)):
+            return self.number(v)
+        elif isinstance(v, NodeType):
+            return self.string(node_type_to_ast_yaml(v))
+        elif isinstance(v, list):
+            return '[' + ', '.join(self.value(i) for i in v) + ']'
+        elif isinstance(v, ASTNode):
+            # nodes in fields (from mappings in AST yaml) are small, so are
+            # written out whole
+            items = [(NodeField.NODE_TYPE, v[NodeField.NODE_TYPE])]
+            items.extend(_fields(v))
+            children = list(v[NodeField.CHILDREN])
+            if children:
+                items.append((NodeField.CHILDREN, children))
+            return '{' + ', '.join(
+                self.key(k) + ': ' + self.value(i) for k, i in items
+            ) + '}'
+
+        raise ASTError("Can't dump AST field value {!r}".format(v))
+
+    def dump(self, ast_node):
+        key = self.key
+        value = self.value
+        write = self._write
+
+        node_type_key = key(NodeField.NODE_TYPE) + ': '
+        children_key = key(NodeField.CHILDREN) + ': ['
+
+        # (node, or None to close the list of children at that depth, depth,
+        # whether it's the first of its siblings)
+        stack = [(_as_node(ast_node), 0, True)]
+        while stack:
+            node, depth, first = stack.pop()
+
+            if node is None:
+                write('\n' + '  ' * depth + ']}')
+                continue
+
+            parts = [
+                '' if depth == 0 else '\n' if first else ',\n',
+                '  ' * depth, '{', node_type_key,
+                value(node[NodeField.NODE_TYPE])
+            ]
+            for k, v in _fields(node):
+                parts.append(', ')
+                parts.append(key(k))
+                parts.append(': ')
+                parts.append(value(v))
+
+            children = list(node[NodeField.CHILDREN])
+            if children:
+                parts.append(', ')
+                parts.append(children_key)
+                stack.append((None, depth, False))
+                for idx in range(len(children) - 1, -1, -1):
+                    stack.append((children[idx], depth + 1, idx == 0))
+            else:
+                parts.append('}')
+
+            write(''.join(parts))
+
+        write('\n')
+        self._flush()
+
+
+class _JSONDumper(_TextDumper):
+    string = staticmethod(json.encoder.encode_basestring)
+
+    def key(self, k):
+        return self.string(k.name if isinstance(k, NodeField) else k)
+
+    def number(self, v):
+        return json.dumps(v)
+
+
+class _YAMLDumper(_TextDumper):
+    def string(self, s):
+        # json's escapes are all valid in yaml's double-quoted strings
+        s = json.encoder.encode_basestring(s)
+        if _YAML_UNESCAPED_RE.search(s):
+            s = _YAML_UNESCAPED_RE.sub(
+                lambda m: '\\u{:04x}'.format(ord(m.group())), s
+            )
+        return s
+
+    def key(self, k):
+        if isinstance(k, NodeField):
+            return k.name
+        if (_YAML_BARE_KEY_RE.match(k)
+            and k.lower() not in _YAML_RESERVED_WORDS
+        ):
+            return k
+        return self.string(k)
+
+    def number(self, v):
+        if isinstance(v, int):
+            return str(v)
+        if v != v:
+            return '.nan'
+        if v in (float('inf'), float('-inf')):
+            return '.inf' if v > 0 else '-.inf'
+
+        # yaml only takes floats with a point, and a signed exponent
+        s = repr(v)
+        mantissa, e, exponent = s.partition('e')
+        if '.' not in mantissa:
+            mantissa += '.0'
+        if e and exponent[0] not in '+-':
+            exponent = '+' + exponent
+        return mantissa + e + exponent
+
+
+# -- binary -----------------------------------------------------------------
+
+_PLAIN_TYPES = frozenset((str, int, float, bool, type(None)))
+
+
+def _encode(v):
+    if type(v) in _PLAIN_TYPES:
+        return v
+    elif isinstance(v, (NodeField, NodeType)):
+        return (v.__class__.__name__, v.name)
+    elif isinstance(v, list):
+        return [_encode(i) for i in v]
+    elif isinstance(v, ASTNode):
+        # mappings never occur as field values otherwise (AST yaml loads them
+        # as nodes), so they can stand for nodes
+        encoded = {_encode(k): _encode(i) for k, i in _fields(v)}
+        encoded[_encode(NodeField.NODE_TYPE)] = _encode(v[NodeField.NODE_TYPE])
+        children = list(v[NodeField.CHILDREN])
+        if children:
+            encoded[_encode(NodeField.CHILDREN)] = _encode(children)
+        return encoded
+    elif isinstance(v, (str, int, float)):
+        # (subclasses)
+        return v
+
+    raise ASTError("Can't dump AST field value {!r}".format(v))
+
+
+def _decode(v):
+    if isinstance(v, tuple):
+        enum_name, member_name = v
+        return _SERIAL_ENUMS[enum_name][member_name]
+    elif isinstance(v, list):
+        return [_decode(i) for i in v]
+    elif isinstance(v, dict):
+        return Node({_decode(k): _decode(i) for k, i in v.items()})
+    return v
+
+
+def _dump_binary(ast_node, fp):
+    out = [marshal.dumps(_BINARY_HEADER)]
+    size = 0
+
+    # each node is (type, flat fields, number of children), in pre-order
+    batch = []
+    stack = [_as_node(ast_node)]
+    while stack:
+        node = stack.pop()
+        children = list(node[NodeField.CHILDREN])
+
+        flat = []
+        for k, v in node.items():
+            if k not in _SKIPPED_FIELDS:
+                flat.append(k if type(k) is str else _encode(k))
+                flat.append(v if type(v) in _PLAIN_TYPES else _encode(v))
+        batch.append((_encode(node[NodeField.NODE_TYPE]), tuple(flat),
+                      len(children)))
+
+        if len(batch) == BATCH_SIZE:
+            data = marshal.dumps(batch)
+            out.append(data)
+            size += len(data)
+            batch = []
+            if size >= WRITE_SIZE:
+                fp.write(b''.join(out))
+                out = []
+                size = 0
+
+        stack.extend(reversed(children))
+
+    if batch:
+        out.append(marshal.dumps(batch))
+    fp.write(b''.join(out))
+
+
+def _load_binary(fp, name, compact):
+    try:
+        header = marshal.load(fp)
+    except (EOFError, ValueError, TypeError):
+        header = None
+    if header != _BINARY_HEADER:
+        raise ASTLoadError("{}: not a binary AST dump".format(name))
+
+    table = NodeTable() if compact else None
+    root = None
+
+    # (parent, children still to come)
+    pending = []
+    while True:
+        try:
+            batch = marshal.load(fp)
+        except EOFError:
+            break
+        except (ValueError, TypeError) as e:
+            raise ASTLoadError("{}: corrupt AST dump".format(name)) from e
+
+        for node_type, flat, n_children in batch:
+            if root is not None and not pending:
+                raise ASTLoadError("{}: corrupt AST dump".format(name))
+
+            node_type = _decode(node_type)
+            fields = [
+                (k if type(k) is str else _decode(k),
+                 v if type(v) in _PLAIN_TYPES else _decode(v))
+                for k, v in zip(flat[::2], flat[1::2])
+            ]
+
+            if pending:
+                parent, remaining = pending[-1]
+                if remaining == 1:
+                    pending.pop()
+                else:
+                    pending[-1] = parent, remaining - 1
+            else:
+                parent = NO_NODE if compact else None
+
+            if compact:
+                node = table.add_node(node_type, fields, parent=parent)
+            else:
+                node = Node(fields)
+                node[NodeField.NODE_TYPE] = node_type
+                node[NodeField.PARENT] = parent
+                if parent is not None:
+                    parent[NodeField.CHILDREN].append(node)
+
+            if root is None:
+                root = node
+            if n_children:
+                pending.append((node, n_children))
+
+    if root is None or pending:
+        raise ASTLoadError("{}: truncated AST dump".format(name))
+
+    return table.root if compact else root
+
+
+# -- public -------------------------------------------------------------------
+
+def dump_ast(ast_node, fp, fmt='yaml'):
+    """Writes ast_node's subtree to fp, which must be a binary file for the
+    binary format, and a text file otherwise."""
+    if fmt == 'binary':
+        _dump_binary(ast_node, fp)
+    elif fmt == 'json':
+        _JSONDumper(fp).dump(ast_node)
+    elif fmt == 'yaml':
+        _YAMLDumper(fp).dump(ast_node)
+    else:
+        raise ValueError("Unknown AST dump format: {}".format(fmt))
+
+
+def dump_ast_file(ast_node, fpath, fmt=None):
+    """Dumps ast_node's subtree to fpath (or stderr, for -), in fmt, or the
+    format its extension suggests."""
+    if fmt is None:
+        fmt = dump_format(fpath)
+
+    if fpath == '-':
+        stream = sys.stderr.buffer if fmt == 'binary' else sys.stderr
+        dump_ast(ast_node, stream, fmt)
+        return
+
+    if fmt == 'binary':
+        with open(fpath, 'wb') as fp:
+            dump_ast(ast_node, fp, fmt)
+    else:
+        with open(fpath, 'w', encoding='utf-8') as fp:
+            dump_ast(ast_node, fp, fmt)
+
+
+def load_ast_dump(fpath, top_level=True, compact=False):
+    """Loads a json or binary dump, as load_ast_yaml() does AST yaml.
+
+    If top_level, the document is wrapped in a compute_heading_levels
+    transformation, unless it already is (as dumps of whole transformed
+    documents are).
+    """
+    fmt = EXTENSION_FORMATS.get(os.path.splitext(fpath)[1])
+
+    if fmt == 'binary':
+        with open(fpath, 'rb') as fp:
+            ast = _load_binary(fp, fpath, compact)
+
+        if top_level and not _computes_heading_levels(ast):
+            if compact:
+                table = ast._table
+                table.wrap_root(
+                    NodeType.TRANSFORMATION,
+                    [(NodeField.AST_TRANSFORMATION, 'compute_heading_levels')]
+                )
+                return table.root
+
+            ast = Node({
+                NodeField.NODE_TYPE: NodeType.TRANSFORMATION,
+                NodeField.AST_TRANSFORMATION: 'compute_heading_levels',
+                NodeField.PARENT: None,
+                NodeField.CHILDREN: [ast],
+            })
+            ast[NodeField.CHILDREN][0][NodeField.PARENT] = ast
+
+        return ast
+
+    with open(fpath, encoding='utf-8') as fp:
+        try:
+            doc = json.load(fp)
+        except ValueError as e:
+            raise ASTLoadError("{}: {}".format(fpath, e)) from e
+
+    if isinstance(doc, list):
+        doc = {
+            NodeField.NODE_TYPE.name: node_type_to_ast_yaml(NodeType.LIST),
+            NodeField.CHILDREN.name: doc,
+        }
+
+    return ast_from_yaml_doc(
+        doc, top_level and not _computes_heading_levels_yaml(doc), compact
+    )
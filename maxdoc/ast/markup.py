@@ -0,0 +1,405 @@
+r"""Parser for MaxDoc's native markup.
+
+Markup is plain text, in paragraphs separated by blank lines, with commands
+for anything else:
+
+    \document[title="A Warm Greeting"]{
+        Hello \env{USER}, you \em{really} should read \Book[id=gplv2].
+
+        \head[title="A heading"]{
+            \include[path=subtopic.mdm]
+
+            Text under the heading.
+        }
+    }
+
+A command is \name, then optionally [key=value, ...] fields (values being
+numbers, bare words, or "quoted strings"), then optionally {content}. Block
+commands (headings, includes, ...) sit between paragraphs, and their
+content is more paragraphs; inline commands (emphasis, DB references, ...)
+sit within paragraphs, and their content is text. Names not listed in
+COMMANDS are taken as node types, of inline nodes. \\, \{ and \} stand for
+\, { and }.
+
+The parser works in a single pass over the text, building Nodes as it
+goes, and can be fed its input a chunk at a time.
+"""
+
+import re
+
+from .ast import ASTLoadError, Node, NodeField, NodeType
+
+
+# how much of a file to read at a time
+CHUNK_SIZE = 64 * 1024
+
+_BLOCK = 'block'
+_INLINE = 'inline'
+
+# name -> (node type, fields, whether it's a block, the field its content
+# goes in as text, if it doesn't hold child nodes)
+COMMANDS = {
+    'document': ('Document', (), True, None),
+    'head': ('Head', (), True, None),
+    'para': ('Para', (), True, None),
+    'toc': ('Toc', (), True, None),
+    'include': (NodeType.TRANSFORMATION,
+                ((NodeField.AST_TRANSFORMATION, 'include_ast'),), True, None),
+    'prune': (NodeType.TRANSFORMATION,
+              ((NodeField.AST_TRANSFORMATION, 'prune_heading_levels'),),
+              True, None),
+    'em': ('Emph', (), False, None),
+    'strong': ('Strong', (), False, None),
+    'sub': ('Sub', (), False, None),
+    'sup': ('Sup', (), False, None),
+    'env': (NodeType.TRANSFORMATION,
+            ((NodeField.AST_TRANSFORMATION, 'env_var'),), False, 'body'),
+}
+
+_TOKEN_RE = re.compile(r'''
+    (?P<text>[^\\{}\n]+)
+  | (?P<parbreak>\n(?:[ \t]*\n)+)
+  | (?P<newline>\n)
+  | \\(?P<command>[A-Za-z_][A-Za-z0-9_]*)
+    (?:\[(?P<fields>(?:[^\]"]|"(?:[^"\\]|\\.)*")*)\])?
+    (?P<opens>\{)?
+  | \\(?P<escape>[^A-Za-z_])
+  | (?P<open>\{)
+  | (?P<close>\})
+''', re.VERBOSE | re.DOTALL)
+
+_FIELD_RE = re.compile(r'''
+    \s*(?P<key>[A-Za-z_][\w-]*)\s*=\s*
+    (?:"(?P<quoted>(?:[^"\\]|\\.)*)"|(?P<bare>[^\s,"]+))
+    \s*(?:,|$)
+''', re.VERBOSE | re.DOTALL)
+
+_INT_RE = re.compile(r'-?[0-9]+$')
+_UNESCAPE_RE = re.compile(r'\\(.)', re.DOTALL)
+
+
+class _Frame:
+    """A node whose content is being parsed."""
+
+    __slots__ = ('node', 'kind', 'raw_field', 'para', 'text', 'newline',
+                 'name', 'line')
+
+    def __init__(self, node, kind, raw_field=None, name=None, line=None):
+        self.node = node
+        self.kind = kind
+        self.raw_field = raw_field
+        # for blocks, the paragraph being parsed, if any
+        self.para = None
+        # text not yet made into a node
+        self.text = []
+        # whether the last thing seen was a line break
+        self.newline = False
+        self.name = name
+        self.line = line
+
+
+class MarkupParser:
+    """Parses markup fed to it in pieces of any size.
+
+        parser = MarkupParser('doc.mdm')
+        for chunk in chunks:
+            parser.feed(chunk)
+        ast = parser.close()
+    """
+
+    def __init__(self, name='<markup>'):
+        self.name = name
+        self._buffer = ''
+        self._line = 1
+
+        root = Node({NodeField.NODE_TYPE: NodeType.LIST,
+                     NodeField.PARENT: None})
+        self._stack = [_Frame(root, _BLOCK)]
+
+    def _error(self, message, line=None):
+        return ASTLoadError("{}:{}: {}".format(
+            self.name, self._line if line is None else line, message
+        ))
+
+    def feed(self, text):
+        self._parse(self._buffer + text if self._buffer else text, False)
+
+    def close(self):
+        """Returns the parsed AST: the document's only node, if it's a
+        \\document, or else a list node of its top-level nodes."""
+        self._parse(self._buffer, True)
+
+        if len(self._stack) > 1:
+            frame = self._stack[-1]
+            raise self._error(
+                "\\{}{{ is never closed".format(frame.name), frame.line
+            )
+
+        frame = self._stack[0]
+        self._end_para(frame)
+
+        root = frame.node
+        children = root[NodeField.CHILDREN]
+        if (len(children) == 1
+            and children[0][NodeField.NODE_TYPE] == COMMANDS['document'][0]
+        ):
+            root = children[0]
+            root[NodeField.PARENT] = None
+        return root
+
+    def _parse(self, text, at_eof):
+        stack = self._stack
+        frame = stack[-1]
+        end = len(text)
+        if not at_eof:
+            # whitespace at the end might turn out to be part of a blank line,
+            # or trailing whitespace to strip, depending on what comes next
+            end = len(text.rstrip(' \t\n'))
+        pos = 0
+
+        for match in _TOKEN_RE.finditer(text, 0, end):
+            if match.start() != pos:
+                # only a lone \ at the end can't be matched
+                break
+
+            kind = match.lastgroup
+            if kind in ('fields', 'opens'):
+                kind = 'command'
+
+            # anything but text, at the end of what we have, might go on into
+            # the next piece
+            if not at_eof and match.end() == end and kind != 'text':
+                break
+            pos = match.end()
+
+            if kind == 'text':
+                self._add_text(frame, match.group())
+
+            elif kind == 'newline':
+                self._line += 1
+                self._add_newline(frame)
+
+            elif kind == 'parbreak':
+                self._line += match.group().count('\n')
+                if frame.kind is _BLOCK:
+                    self._end_para(frame)
+                else:
+                    self._add_newline(frame)
+
+            elif kind == 'command':
+                if text.startswith('[', pos) and match.group('fields') is None:
+                    if not at_eof:
+                        pos = match.start()
+                        break
+                    raise self._error("Unterminated [fields] of \\{}".format(
+                        match.group('command')
+                    ))
+
+                frame = self._command(frame, match)
+                if match.group('fields'):
+                    self._line += match.group('fields').count('\n')
+
+            elif kind == 'escape':
+                self._add_text(frame, match.group('escape'))
+                if match.group('escape') == '\n':
+                    self._line += 1
+
+            elif kind == 'close':
+                if len(stack) == 1:
+                    raise self._error("Unmatched }")
+                self._end_frame(frame)
+                stack.pop()
+                frame = stack[-1]
+
+            else:
+                raise self._error(
+                    "Unescaped {; write \\{ for a literal brace"
+                )
+
+        self._buffer = text[pos:]
+        if at_eof and self._buffer:
+            raise self._error("Can't parse {!r}".format(self._buffer[:20]))
+
+    # -- building nodes ---------------------------------------------------
+
+    def _add_text(self, frame, text):
+        if frame.kind is _BLOCK and frame.para is None:
+            text = text.lstrip()
+            if not text:
+                return
+            self._start_para(frame)
+
+        if frame.newline:
+            # (the rest of the indentation may still be to come)
+            text = text.lstrip()
+            if not text:
+                return
+            frame.newline = False
+        frame.text.append(text)
+
+    def _add_newline(self, frame):
+        if frame.kind is _BLOCK and frame.para is None:
+            return
+
+        if frame.text:
+            frame.text[-1] = frame.text[-1].rstrip()
+        frame.text.append(' ')
+        frame.newline = True
+
+    def _flush_text(self, frame, strip=False):
+        """Makes the frame's pending text into a Text node."""
+        body = ''.join(frame.text)
+        frame.text = []
+        frame.newline = False
+
+        if frame.raw_field is not None:
+            return body
+
+        if strip:
+            body = body.rstrip()
+        if not body:
+            return None
+
+        parent = frame.para if frame.kind is _BLOCK else frame.node
+        parent[NodeField.CHILDREN].append(Node({
+            NodeField.NODE_TYPE: 'Text',
+            'body': body,
+            NodeField.PARENT: parent,
+        }))
+
+    def _start_para(self, frame):
+        para = Node({NodeField.NODE_TYPE: 'Para',
+                     NodeField.PARENT: frame.node})
+        frame.node[NodeField.CHILDREN].append(para)
+        frame.para = para
+
+    def _end_para(self, frame):
+        if frame.para is not None:
+            self._flush_text(frame, strip=True)
+            frame.para = None
+
+    def _end_frame(self, frame):
+        if frame.raw_field is not None:
+            frame.node[frame.raw_field] = self._flush_text(frame).strip()
+        elif frame.kind is _BLOCK:
+            self._end_para(frame)
+        else:
+            self._flush_text(frame)
+
+    def _fields(self, command, text):
+        fields = []
+        pos = 0
+        text = text.strip()
+        while pos < len(text):
+            match = _FIELD_RE.match(text, pos)
+            if match is None:
+                raise self._error("Bad fields for \\{}: {!r}".format(
+                    command, text[pos:]
+                ))
+            pos = match.end()
+
+            value = match.group('quoted')
+            if value is not None:
+                value = _UNESCAPE_RE.sub(r'\1', value)
+            else:
+                value = match.group('bare')
+                if _INT_RE.match(value):
+                    value = int(value)
+            fields.append((match.group('key'), value))
+        return fields
+
+    def _command(self, frame, match):
+        """Adds the node for a command, returning the frame to parse what
+        follows in."""
+        if frame.raw_field is not None:
+            raise self._error(
+                "\\{} within \\{}{{...}}, which only holds text".format(
+                    match.group('command'), frame.name
+                )
+            )
+
+        name = match.group('command')
+        node_type, fields, is_block, raw_field = COMMANDS.get(
+            name, (name, (), False, None)
+        )
+
+        if is_block and frame.kind is _BLOCK:
+            self._end_para(frame)
+            parent = frame.node
+        else:
+            if frame.kind is _BLOCK and frame.para is None:
+                self._start_para(frame)
+            self._flush_text(frame)
+            parent = frame.para if frame.kind is _BLOCK else frame.node
+
+        node = Node(fields)
+        node[NodeField.NODE_TYPE] = node_type
+        node[NodeField.PARENT] = parent
+        if match.group('fields'):
+            node.update(self._fields(name, match.group('fields')))
+        parent[NodeField.CHILDREN].append(node)
+
+        if match.group('opens') is None:
+            return frame
+
+        new_frame = _Frame(
+            node, _BLOCK if is_block and raw_field is None else _INLINE,
+            raw_field=raw_field, name=name, line=self._line
+        )
+        self._stack.append(new_frame)
+        return new_frame
+
+
+def parse_markup(fp, name=None, chunk_size=CHUNK_SIZE):
+    """Parses markup from a text file object, a chunk at a time."""
+    parser = MarkupParser(name or getattr(fp, 'name', '<markup>'))
+    while True:
+        chunk = fp.read(chunk_size)
+        if not chunk:
+            break
+        parser.feed(chunk)
+    return parser.close()
+
+
+def parse_markup_string(text, name='<markup>'):
+    parser = MarkupParser(name)
+    parser.feed(text)
+    return parser.close()
+
+
+def _compile_markup(text):
+    from .table import NodeTable
+    return NodeTable.from_node(parse_markup_string(text))
+
+
+def load_markup(fpath, top_level=True, compact=False, cache=None):
+    """As ast.load_ast_yaml(), for a markup file."""
+    if cache is not None:
+        table = cache.load(fpath, _compile_markup, fmt='markup')
+
+        if top_level:
+            table.wrap_root(
+                NodeType.TRANSFORMATION,
+                [(NodeField.AST_TRANSFORMATION, 'compute_heading_levels')]
+            )
+
+        return table.root if compact else table.root.to_node()
+
+    with open(fpath) as fp:
+        ast = parse_markup(fp, fpath)
+
+    if top_level:
+        # decorate document with transformation functions
+        ast = Node({
+            NodeField.NODE_TYPE: NodeType.TRANSFORMATION,
+            NodeField.AST_TRANSFORMATION: 'compute_heading_levels',
+            NodeField.PARENT: None,
+            NodeField.CHILDREN: [ast],
+        })
+        ast[NodeField.CHILDREN][0][NodeField.PARENT] = ast
+
+    if compact:
+        from .table import NodeTable
+        return NodeTable.from_node(ast).root
+
+    return ast
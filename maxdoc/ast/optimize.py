@@ -0,0 +1,190 @@
+"""Optimization of transformed ASTs for rendering.
+
+Transformations leave many small nodes behind: each env_var becomes a Text
+node of its own, next to the Text around it, and wrappers that render
+nothing themselves (transformation regions aside) stay in the tree. An
+ASTOptimizer rewrites the tree into fewer nodes that render to exactly the
+same output, with the renderers it's going to be rendered with:
+
+* adjacent Text-like siblings of the same type are merged into one (which
+  folds resolved env_var values into the text around them),
+* nodes that render nothing, and have no children, are dropped, as are
+  Text-like nodes with an empty body, and
+* nodes that render nothing but their children are replaced by their
+  children.
+
+What nodes render as is up to each renderer (see
+Renderer.node_type_output()), and is asked once per node type. Include
+roots, headings and transformation nodes, which later stages (incremental
+rebuilds, the outline) refer to, are always kept, and so are references to
+DB records, which are checked for after optimization.
+"""
+
+import logging
+
+from ..model_names import is_model
+from ..renderers.base import RENDERS_BODY, RENDERS_NOTHING
+from .ast import NodeField, NodeType
+from .transforms import INCLUDE_PATH
+
+
+logger = logging.getLogger(__name__)
+
+# node types that are referred to from outside the tree (by the outline),
+# and so are never removed (nor are DB record references, which missing
+# records are looked for by)
+_KEPT_NODE_TYPES = frozenset(('Head', NodeType.TRANSFORMATION))
+
+
+class ASTOptimizer:
+    """Rewrites ASTs into fewer nodes, which render just the same with each
+    of renderers."""
+
+    def __init__(self, renderers):
+        self.renderers = renderers
+        # node type -> what every renderer renders it as
+        self._outputs = {}
+
+        self.visited = 0
+        self.merged = 0
+        self.dropped = 0
+        self.unwrapped = 0
+
+    @property
+    def removed(self):
+        return self.merged + self.dropped + self.unwrapped
+
+    def _output(self, node_type):
+        try:
+            return self._outputs[node_type]
+        except KeyError:
+            pass
+
+        outputs = {r.node_type_output(node_type) for r in self.renderers}
+        if (node_type in _KEPT_NODE_TYPES or is_model(node_type)
+            or None in outputs
+        ):
+            output = None
+        elif outputs == {RENDERS_NOTHING}:
+            output = RENDERS_NOTHING
+        else:
+            # merging and dropping text is safe for renderers that render
+            # nothing of it, too
+            output = RENDERS_BODY
+
+        self._outputs[node_type] = output
+        return output
+
+    def _classify(self, node):
+        """Returns what node renders as (as for _output()), or None if it
+        must be kept as it is."""
+        if isinstance(node, list) or INCLUDE_PATH in node:
+            return None
+
+        output = self._output(node[NodeField.NODE_TYPE])
+        if output == RENDERS_BODY and (
+            node[NodeField.CHILDREN] or not isinstance(node.get('body'), str)
+        ):
+            return None
+        return output
+
+    def optimize(self, ast_node):
+        """Optimizes ast_node's subtree in place (ast_node itself is always
+        kept)."""
+        # post-order, so that each node's children are done before it is
+        # decided what to do with them
+        stack = [(ast_node, False)]
+        while stack:
+            node, children_done = stack.pop()
+            if children_done:
+                self._optimize_children(node)
+                continue
+
+            self.visited += 1
+            children = node[NodeField.CHILDREN]
+            if children:
+                stack.append((node, True))
+                # (lists are rendered as they are)
+                stack.extend(
+                    (child, False) for child in children
+                    if not isinstance(child, list)
+                )
+
+        return ast_node
+
+    def _optimize_children(self, node):
+        kept = []
+        # what the last node kept renders as
+        last = None
+        changed = False
+
+        for child in list(node[NodeField.CHILDREN]):
+            output = self._classify(child)
+
+            if output == RENDERS_NOTHING:
+                changed = True
+                grandchildren = list(child[NodeField.CHILDREN])
+                if not grandchildren:
+                    self.dropped += 1
+                    continue
+
+                self.unwrapped += 1
+                for grandchild in grandchildren:
+                    last = self._append(
+                        kept, last, grandchild, self._classify(grandchild)
+                    )
+
+            else:
+                n_kept = len(kept)
+                last = self._append(kept, last, child, output)
+                if len(kept) == n_kept:
+                    changed = True
+
+        if changed:
+            node._set_children(kept)
+
+    def _append(self, kept, last, node, output):
+        """Appends node, which renders as output, to kept, unless it can be
+        merged into the last node kept, which renders as last, or dropped.
+
+        Returns:
+            What the last node kept now renders as.
+        """
+        if output == RENDERS_BODY:
+            body = node['body']
+            if not body:
+                self.dropped += 1
+                return last
+
+            # (only into a node of the same type: renderers can render
+            # different types' bodies differently, or not at all)
+            if (last == RENDERS_BODY and kept[-1][NodeField.NODE_TYPE]
+                == node[NodeField.NODE_TYPE]
+            ):
+                kept[-1]['body'] += body
+                self.merged += 1
+                return last
+
+        kept.append(node)
+        return output
+
+
+def optimize_ast(renderers, ast_node):
+    """Optimizes ast_node's subtree for rendering with renderers (see
+    ASTOptimizer).
+
+    Returns:
+        The ASTOptimizer, with counts of the nodes visited and removed.
+    """
+    optimizer = ASTOptimizer(renderers)
+    optimizer.optimize(ast_node)
+
+    logger.info(
+        "AST optimization: {} of {} nodes removed ({} merged into "
+        "neighbouring text, {} empty nodes dropped, {} wrappers "
+        "unwrapped)".format(
+            optimizer.removed, optimizer.visited, optimizer.merged,
+            optimizer.dropped, optimizer.unwrapped
+        )
+    )
+    return optimizer
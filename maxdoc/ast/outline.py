@@ -0,0 +1,154 @@
+import collections
+import re
+
+
+# stamped on each Head node (and the level on each prune_heading_levels
+# region too, as that of the heading it's in)
+HEADING_LEVEL = '_ast_heading_level_'
+HEADING_ANCHOR = '_ast_heading_anchor_'
+HEADING_NUMBER = '_ast_heading_number_'
+
+
+_NON_ANCHOR_CHARS_RE = re.compile(r'[^a-z0-9]+')
+
+
+def _slugify(title):
+    return _NON_ANCHOR_CHARS_RE.sub('-', str(title).lower()).strip('-')
+
+
+class OutlineEntry:
+    """One heading in an Outline."""
+
+    __slots__ = ('node', 'level', 'title', 'anchor', 'number', 'index', 'end',
+                 'node_count')
+
+    def __init__(self, node, level, title, anchor, number, index):
+        self.node = node
+        self.level = level
+        self.title = title
+        self.anchor = anchor
+        self.number = number
+
+        # this entry's position in the outline; the entries for the headings
+        # inside it run from index + 1 up to (but not including) end
+        self.index = index
+        self.end = index + 1
+
+        # the number of nodes in the heading's subtree, itself included
+        self.node_count = 1
+
+    def __repr__(self):
+        return "{}({!r}, {!r}, level={})".format(
+            self.__class__.__name__, self.number, self.title, self.level
+        )
+
+
+class Outline:
+    """A flat index of a document's headings, in document order.
+
+    Built in the same walk that computes heading levels, so that anything
+    needing the document's structure (a table of contents, section numbers,
+    links to sections) can get it without walking the tree again.
+    """
+
+    def __init__(self):
+        self._clear()
+
+    def _clear(self):
+        self.entries = []
+        self._by_anchor = {}
+        self._slug_counts = collections.Counter()
+        self._numbering = []
+
+    def _place(self, title, level):
+        """Returns the anchor and number of a heading with title, at level,
+        coming after every heading added so far."""
+        # anchors only depend on the headings before this one with the same
+        # title, so they're stable while those don't change
+        slug = _slugify(title) if title is not None else ''
+        slug = slug or 'section'
+        anchor = slug
+        while anchor in self._by_anchor:
+            self._slug_counts[slug] += 1
+            anchor = "{}-{}".format(slug, self._slug_counts[slug] + 1)
+
+        numbering = self._numbering[:level]
+        numbering.extend([0] * (level - len(numbering)))
+        numbering[-1] += 1
+        self._numbering = numbering
+
+        return anchor, ".".join(str(n) for n in numbering)
+
+    def add(self, node, level):
+        """Adds an entry for heading node, at level, which must come after
+        every heading added so far."""
+        title = node.get('title')
+        anchor, number = self._place(title, level)
+
+        entry = OutlineEntry(node, level, title, anchor, number,
+                             len(self.entries))
+        self.entries.append(entry)
+        self._by_anchor[anchor] = entry
+        return entry
+
+    def cut(self, entries):
+        """Drops entries, and the entries for the headings inside them, as
+        when pruning cuts their headings from the document.
+
+        The entries kept are renumbered and re-anchored just as if the
+        headings cut had never been there, and the node counts of those
+        that held them are brought down by the nodes cut.
+        """
+        cut = {id(e) for e in entries}
+        old = self.entries
+        self._clear()
+
+        # the entries kept that hold the one being gone through
+        holding = []
+        i = 0
+        while i < len(old):
+            entry = old[i]
+            while holding and holding[-1].level >= entry.level:
+                holding.pop().end = len(self.entries)
+
+            if id(entry) in cut:
+                for e in holding:
+                    e.node_count -= entry.node_count
+                # (the entries inside it go with it)
+                i = entry.end
+                continue
+
+            entry.anchor, entry.number = self._place(entry.title, entry.level)
+            entry.index = len(self.entries)
+            self.entries.append(entry)
+            self._by_anchor[entry.anchor] = entry
+            holding.append(entry)
+            i += 1
+
+        for e in holding:
+            e.end = len(self.entries)
+
+    def __iter__(self):
+        return iter(self.entries)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __getitem__(self, i):
+        return self.entries[i]
+
+    def find(self, anchor):
+        """Returns the entry with the given anchor, or None."""
+        return self._by_anchor.get(anchor)
+
+    def subsections(self, entry):
+        """Returns the entries for the headings inside entry's."""
+        return self.entries[entry.index + 1:entry.end]
+
+    def toc(self, max_level=None, within=None):
+        """Returns the entries to list in a table of contents: those no
+        deeper than max_level, optionally only from within entry within."""
+        entries = self.entries if within is None else self.subsections(within)
+        if max_level is None:
+            return list(entries)
+        return [e for e in entries if e.level <= max_level]
@@ -0,0 +1,749 @@
+"""Compact, columnar storage for ASTs.
+
+A NodeTable holds a whole tree in a handful of flat integer arrays (node type
+id, parent, first child, last child, next sibling), plus one small tuple of
+extra fields per node that has any. Node types and string field values are
+interned, so the thousands of identical 'Text'/'Para' type names and repeated
+bodies in a large document are stored once.
+
+Code that works on Node trees can use a table through NodeView, a thin,
+Node-compatible view of one row. Views are created on demand and are cheap;
+nothing is stored per node beyond the table rows themselves.
+"""
+
+import array
+import enum
+import marshal
+import weakref
+
+from .ast import ASTNode, Node, NodeField, NodeType
+from .exceptions import ASTError
+
+
+NO_NODE = -1
+
+# bump when the layout written by NodeTable.to_bytes() changes
+_SERIAL_FORMAT = 1
+
+
+class NodeTable:
+    def __init__(self):
+        self._type_ids = array.array('i')
+        self._parent = array.array('i')
+        self._first_child = array.array('i')
+        self._last_child = array.array('i')
+        self._next_sibling = array.array('i')
+
+        # None, or a flat (key, value, key, value, ...) tuple per node
+        self._fields = []
+
+        self._types = []
+        self._type_index = {}
+        self._strings = {}
+
+        self._root = 0
+        self._views = weakref.WeakValueDictionary()
+
+        # bumped whenever any node's children change, so that ChildLists
+        # know when what they've cached is out of date
+        self._structure_version = 0
+
+    def __len__(self):
+        return len(self._type_ids)
+
+    @property
+    def root(self):
+        if not self._type_ids:
+            raise ASTError("Empty node table has no root")
+        return self.view(self._root)
+
+    def view(self, idx):
+        """Returns the NodeView for row idx.
+
+        Views are shared for as long as anything references them, so
+        identity checks (`a is b`) work on views just as they do on Nodes.
+        """
+        try:
+            return self._views[idx]
+        except KeyError:
+            v = self._views[idx] = NodeView(self, idx)
+            return v
+
+    # -- interning --------------------------------------------------------
+
+    def _intern_type(self, node_type):
+        try:
+            return self._type_index[node_type]
+        except KeyError:
+            type_id = self._type_index[node_type] = len(self._types)
+            self._types.append(node_type)
+            return type_id
+
+    def _intern(self, v):
+        if isinstance(v, str):
+            return self._strings.setdefault(v, v)
+        return v
+
+    # -- row access -------------------------------------------------------
+
+    def node_type(self, idx):
+        return self._types[self._type_ids[idx]]
+
+    def parent(self, idx):
+        return self._parent[idx]
+
+    def first_child(self, idx):
+        return self._first_child[idx]
+
+    def next_sibling(self, idx):
+        return self._next_sibling[idx]
+
+    def children(self, idx):
+        """Yields the row indexes of idx's children, in order."""
+        child = self._first_child[idx]
+        next_sibling = self._next_sibling
+        while child != NO_NODE:
+            yield child
+            child = next_sibling[child]
+
+    def iter_subtree(self, idx=None):
+        """Yields row indexes of the subtree at idx (default: the root), in
+        document order."""
+        if idx is None:
+            idx = self._root
+
+        first_child = self._first_child
+        next_sibling = self._next_sibling
+        parent = self._parent
+
+        node = idx
+        while True:
+            yield node
+
+            child = first_child[node]
+            if child != NO_NODE:
+                node = child
+                continue
+
+            while node != idx and next_sibling[node] == NO_NODE:
+                node = parent[node]
+
+            if node == idx:
+                return
+
+            node = next_sibling[node]
+
+    def get_field(self, idx, k, default=None):
+        fields = self._fields[idx]
+        if fields is not None:
+            for i in range(0, len(fields), 2):
+                if fields[i] == k:
+                    return fields[i + 1]
+        return default
+
+    def has_field(self, idx, k):
+        fields = self._fields[idx]
+        return fields is not None and k in fields[::2]
+
+    def set_field(self, idx, k, v):
+        v = self._intern(v)
+        fields = self._fields[idx]
+        if fields is None:
+            self._fields[idx] = (k, v)
+            return
+
+        for i in range(0, len(fields), 2):
+            if fields[i] == k:
+                self._fields[idx] = fields[:i + 1] + (v,) + fields[i + 2:]
+                return
+
+        self._fields[idx] = fields + (k, v)
+
+    def del_field(self, idx, k):
+        fields = self._fields[idx]
+        if fields is not None:
+            for i in range(0, len(fields), 2):
+                if fields[i] == k:
+                    fields = fields[:i] + fields[i + 2:]
+                    self._fields[idx] = fields or None
+                    return
+        raise KeyError(k)
+
+    def iter_fields(self, idx):
+        fields = self._fields[idx]
+        if fields is not None:
+            for i in range(0, len(fields), 2):
+                yield fields[i], fields[i + 1]
+
+    # -- structure --------------------------------------------------------
+
+    def add_node(self, node_type, fields=(), parent=NO_NODE):
+        """Appends a new row, as the last child of parent if given."""
+        idx = len(self._type_ids)
+
+        self._type_ids.append(self._intern_type(node_type))
+        self._parent.append(NO_NODE)
+        self._first_child.append(NO_NODE)
+        self._last_child.append(NO_NODE)
+        self._next_sibling.append(NO_NODE)
+
+        flat = []
+        for k, v in fields:
+            flat.append(k)
+            flat.append(self._intern(v))
+        self._fields.append(tuple(flat) if flat else None)
+
+        if parent != NO_NODE:
+            self.append_child(parent, idx)
+
+        return idx
+
+    def append_child(self, parent, child):
+        self._structure_version += 1
+        self._parent[child] = parent
+        self._next_sibling[child] = NO_NODE
+
+        last = self._last_child[parent]
+        if last == NO_NODE:
+            self._first_child[parent] = child
+        else:
+            self._next_sibling[last] = child
+        self._last_child[parent] = child
+
+    def _prev_sibling(self, parent, child):
+        prev = NO_NODE
+        for idx in self.children(parent):
+            if idx == child:
+                return prev
+            prev = idx
+        raise ASTError("Row {} is not a child of row {}".format(child, parent))
+
+    def unlink(self, child):
+        """Detaches child (and its subtree) from its parent."""
+        parent = self._parent[child]
+        if parent == NO_NODE:
+            return
+
+        self._structure_version += 1
+        prev = self._prev_sibling(parent, child)
+        following = self._next_sibling[child]
+
+        if prev == NO_NODE:
+            self._first_child[parent] = following
+        else:
+            self._next_sibling[prev] = following
+
+        if self._last_child[parent] == child:
+            self._last_child[parent] = prev
+
+        self._parent[child] = NO_NODE
+        self._next_sibling[child] = NO_NODE
+
+    def detach_children(self, parent):
+        """Detaches all of parent's children at once.
+
+        Returns:
+            Their rows.
+        """
+        self._structure_version += 1
+        rows = list(self.children(parent))
+        for row in rows:
+            self._parent[row] = NO_NODE
+            self._next_sibling[row] = NO_NODE
+        self._first_child[parent] = self._last_child[parent] = NO_NODE
+        return rows
+
+    def retain_children(self, parent, keep):
+        """Detaches the children of parent that keep(row) is false for, in a
+        single pass over them.
+
+        Returns:
+            The rows kept.
+        """
+        self._structure_version += 1
+        kept = []
+        prev = NO_NODE
+        child = self._first_child[parent]
+        self._first_child[parent] = NO_NODE
+
+        while child != NO_NODE:
+            following = self._next_sibling[child]
+
+            if keep(child):
+                if prev == NO_NODE:
+                    self._first_child[parent] = child
+                else:
+                    self._next_sibling[prev] = child
+                prev = child
+                kept.append(child)
+
+            else:
+                self._parent[child] = NO_NODE
+                self._next_sibling[child] = NO_NODE
+
+            child = following
+
+        if prev != NO_NODE:
+            self._next_sibling[prev] = NO_NODE
+        self._last_child[parent] = prev
+        return kept
+
+    def insert_after(self, prev, child, parent):
+        """Links child into parent's children after prev (or first if
+        prev is NO_NODE)."""
+        self._structure_version += 1
+        self._parent[child] = parent
+
+        if prev == NO_NODE:
+            following = self._first_child[parent]
+            self._first_child[parent] = child
+        else:
+            following = self._next_sibling[prev]
+            self._next_sibling[prev] = child
+
+        self._next_sibling[child] = following
+        if following == NO_NODE:
+            self._last_child[parent] = child
+
+    def wrap_root(self, node_type, fields=()):
+        """Adds a new root node, with the current root as its only child."""
+        idx = self.add_node(node_type, fields)
+        self.append_child(idx, self._root)
+        self._root = idx
+        return idx
+
+    def replace(self, old, new):
+        """Puts row new in row old's place among its siblings."""
+        parent = self._parent[old]
+        if parent == NO_NODE:
+            raise ASTError("Can't replace the root of a node table")
+
+        prev = self._prev_sibling(parent, old)
+        self.unlink(old)
+        self.insert_after(prev, new, parent)
+
+    def graft(self, node, parent=NO_NODE):
+        """Copies node (a Node, NodeView or list of them) into this table.
+
+        Returns the row index of the copy's root.
+        """
+        if isinstance(node, list):
+            node = Node({NodeField.NODE_TYPE: NodeType.LIST,
+                         NodeField.CHILDREN: node})
+
+        if isinstance(node, NodeView) and node._table is self:
+            node = node.to_node()
+
+        # explicit stack, so deep trees don't hit the recursion limit
+        root = NO_NODE
+        stack = [(node, parent)]
+        while stack:
+            n, p = stack.pop()
+            if isinstance(n, NodeView):
+                fields = list(n._table.iter_fields(n._idx))
+                children = [n._table.view(c)
+                            for c in n._table.children(n._idx)]
+            else:
+                fields = [(k, v) for k, v in n.items()
+                          if k not in _STRUCTURAL_FIELDS]
+                children = n.get(NodeField.CHILDREN) or []
+
+            idx = self.add_node(n.get(NodeField.NODE_TYPE), fields, parent=p)
+            if root == NO_NODE:
+                root = idx
+
+            for child in reversed(children):
+                stack.append((child, idx))
+
+        return root
+
+    # -- construction -----------------------------------------------------
+
+    @classmethod
+    def from_ast_yaml(cls, yaml_doc):
+        """Builds a table straight from loaded AST yaml data, without creating
+        an intermediate Node per dict."""
+        table = cls()
+
+        stack = [(yaml_doc, NO_NODE)]
+        while stack:
+            yaml_node, parent = stack.pop()
+            if not isinstance(yaml_node, dict):
+                raise ASTError(
+                    "Expected an AST node, got {!r}".format(yaml_node)
+                )
+
+            node_type = NodeType.DICT
+            children = ()
+            fields = []
+            for k, v in yaml_node.items():
+                k = Node._key_from_ast_yaml(k)
+                if k is NodeField.NODE_TYPE:
+                    node_type = Node._value_from_ast_yaml(k, v)
+                elif k is NodeField.CHILDREN:
+                    children = v or ()
+                else:
+                    fields.append((k, Node.from_ast_yaml(v)))
+
+            idx = table.add_node(node_type, fields, parent=parent)
+
+            for child in reversed(children):
+                stack.append((child, idx))
+
+        return table
+
+    @classmethod
+    def from_node(cls, node):
+        table = cls()
+        table.graft(node)
+        return table
+
+    # -- serialisation ----------------------------------------------------
+
+    def to_bytes(self):
+        """Serialises the table to a compact binary form.
+
+        Raises ValueError if a field holds a value that can't be serialised
+        (anything beyond plain yaml scalars, lists, dicts and the ast enums).
+        """
+        return marshal.dumps((
+            _SERIAL_FORMAT,
+            self._type_ids.itemsize,
+            self._root,
+            [_encode_value(t) for t in self._types],
+            self._type_ids.tobytes(),
+            self._parent.tobytes(),
+            self._first_child.tobytes(),
+            self._last_child.tobytes(),
+            self._next_sibling.tobytes(),
+            [None if f is None else tuple(_encode_value(v) for v in f)
+             for f in self._fields],
+        ))
+
+    @classmethod
+    def from_bytes(cls, data):
+        """Loads a table written by to_bytes().
+
+        Raises ValueError if data isn't in the current serialisation format.
+        """
+        try:
+            state = marshal.loads(data)
+            (serial_format, itemsize, root, types, type_ids, parents,
+             first_children, last_children, next_siblings, fields) = state
+        except (EOFError, TypeError, ValueError) as e:
+            raise ValueError("Not a serialised NodeTable") from e
+
+        table = cls()
+        if (serial_format != _SERIAL_FORMAT
+                or itemsize != table._type_ids.itemsize):
+            raise ValueError(
+                "Unsupported NodeTable format {}".format(serial_format)
+            )
+
+        table._root = root
+        table._types = [_decode_value(t) for t in types]
+        table._type_index = {t: i for i, t in enumerate(table._types)}
+        table._type_ids.frombytes(type_ids)
+        table._parent.frombytes(parents)
+        table._first_child.frombytes(first_children)
+        table._last_child.frombytes(last_children)
+        table._next_sibling.frombytes(next_siblings)
+
+        intern = table._intern
+        table._fields = [
+            None if f is None else tuple(intern(_decode_value(v)) for v in f)
+            for f in fields
+        ]
+
+        return table
+
+
+_STRUCTURAL_FIELDS = frozenset((
+    NodeField.NODE_TYPE, NodeField.PARENT, NodeField.CHILDREN,
+))
+
+
+# the ast enums are written as (enum name, member name) tuples; yaml data
+# never contains tuples, so this can't be ambiguous
+_SERIAL_ENUMS = {e.__name__: e for e in (NodeField, NodeType)}
+
+
+def _encode_value(v):
+    if isinstance(v, enum.Enum):
+        return (v.__class__.__name__, v.name)
+    elif isinstance(v, ASTNode):
+        raise ValueError("Can't serialise nested node {!r}".format(v))
+    return v
+
+
+def _decode_value(v):
+    if isinstance(v, tuple):
+        enum_name, member_name = v
+        return _SERIAL_ENUMS[enum_name][member_name]
+    return v
+
+
+class NodeView:
+    """A Node-compatible view of one NodeTable row."""
+
+    __slots__ = ('_table', '_idx', '__weakref__')
+
+    def __init__(self, table, idx):
+        self._table = table
+        self._idx = idx
+
+    def __getitem__(self, k):
+        table = self._table
+        if k is NodeField.NODE_TYPE:
+            return table.node_type(self._idx)
+
+        elif k is NodeField.CHILDREN:
+            return ChildList(table, self._idx)
+
+        elif k is NodeField.PARENT:
+            parent = table.parent(self._idx)
+            return None if parent == NO_NODE else table.view(parent)
+
+        fields = table._fields[self._idx]
+        if fields is not None:
+            for i in range(0, len(fields), 2):
+                if fields[i] == k:
+                    return fields[i + 1]
+
+        raise KeyError(k)
+
+    def __setitem__(self, k, v):
+        table = self._table
+        if k is NodeField.NODE_TYPE:
+            table._type_ids[self._idx] = table._intern_type(v)
+
+        elif k is NodeField.PARENT:
+            # structural in a table; accept (re)statements of the truth only
+            if v is not self.get(NodeField.PARENT):
+                raise ASTError("Can't reparent a NodeView by assignment")
+
+        elif k is NodeField.CHILDREN:
+            children = list(v)
+            for child in list(table.children(self._idx)):
+                table.unlink(child)
+            for child in children:
+                self._adopt(child)
+
+        else:
+            table.set_field(self._idx, k, v)
+
+    def __delitem__(self, k):
+        if k in _STRUCTURAL_FIELDS:
+            raise ASTError("Can't delete structural field {}".format(k))
+        self._table.del_field(self._idx, k)
+
+    def __contains__(self, k):
+        return k in _STRUCTURAL_FIELDS or self._table.has_field(self._idx, k)
+
+    def __getattr__(self, k):
+        try:
+            return self[k]
+        except KeyError:
+            raise AttributeError(k)
+
+    def __eq__(self, other):
+        return (isinstance(other, NodeView) and other._table is self._table
+                and other._idx == self._idx)
+
+    def __hash__(self):
+        return hash((id(self._table), self._idx))
+
+    def get(self, k, default=None):
+        try:
+            return self[k]
+        except KeyError:
+            return default
+
+    def keys(self):
+        return [k for k, _ in self.items()]
+
+    def items(self):
+        yield NodeField.NODE_TYPE, self[NodeField.NODE_TYPE]
+        for item in self._table.iter_fields(self._idx):
+            yield item
+        yield NodeField.CHILDREN, list(self[NodeField.CHILDREN])
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.keys())
+
+    def parents(self):
+        table = self._table
+        p = table.parent(self._idx)
+        while p != NO_NODE:
+            yield table.view(p)
+            p = table.parent(p)
+
+    def _adopt(self, child):
+        """Returns the row index for child, copying it in if it isn't
+        already a detached row of this table."""
+        if (isinstance(child, NodeView) and child._table is self._table
+            and self._table.parent(child._idx) == NO_NODE
+        ):
+            self._table.append_child(self._idx, child._idx)
+            return child._idx
+
+        return self._table.graft(child, parent=self._idx)
+
+    def _replace_child(self, old_child, new_child):
+        """Returns the view that now occupies old_child's place."""
+        if not (isinstance(old_child, NodeView)
+                and old_child._table is self._table
+                and self._table.parent(old_child._idx) == self._idx
+        ):
+            raise ASTError(
+                "{!r} is not a child of this node".format(old_child)
+            )
+
+        if (isinstance(new_child, NodeView) and new_child._table is self._table
+            and self._table.parent(new_child._idx) == NO_NODE
+        ):
+            new_idx = new_child._idx
+        else:
+            new_idx = self._table.graft(new_child)
+
+        self._table.replace(old_child._idx, new_idx)
+        return self._table.view(new_idx)
+
+    def _set_children(self, children):
+        """As Node._set_children(). Views of rows of this table are moved
+        here from wherever they are; anything else is copied in."""
+        table = self._table
+        table.detach_children(self._idx)
+
+        # the rows to move from other nodes, by the node they're moved from
+        moving = {}
+        for child in children:
+            if isinstance(child, NodeView) and child._table is table:
+                parent = table.parent(child._idx)
+                if parent != NO_NODE:
+                    moving.setdefault(parent, set()).add(child._idx)
+
+        # one pass over each of those nodes' children, however many move
+        for parent, rows in moving.items():
+            table.retain_children(parent, lambda row: row not in rows)
+
+        for child in children:
+            self._adopt(child)
+
+    def to_node(self):
+        """Materialises this subtree as a tree of Node dicts."""
+        table = self._table
+
+        root = None
+        stack = [(self._idx, None)]
+        while stack:
+            idx, parent = stack.pop()
+
+            node = Node(table.iter_fields(idx))
+            node[NodeField.NODE_TYPE] = table.node_type(idx)
+            node[NodeField.PARENT] = parent
+            if parent is None:
+                root = node
+            else:
+                parent[NodeField.CHILDREN].append(node)
+
+            for child in reversed(list(table.children(idx))):
+                stack.append((child, node))
+
+        return root
+
+    def __repr__(self):
+        return "<NodeView #{} {!r}>".format(
+            self._idx, self._table.node_type(self._idx)
+        )
+
+
+ASTNode.register(NodeView)
+
+
+class ChildList:
+    """List-like view of a NodeView's children."""
+
+    __slots__ = ('_table', '_idx', '_rows', '_version')
+
+    def __init__(self, table, idx):
+        self._table = table
+        self._idx = idx
+        self._rows = None
+        self._version = None
+
+    def _child_rows(self):
+        """Returns the children's rows, in order. The list is kept until the
+        table's structure next changes, so indexing and len() don't walk
+        the children each time."""
+        version = self._table._structure_version
+        if self._version != version:
+            self._rows = list(self._table.children(self._idx))
+            self._version = version
+        return self._rows
+
+    def __iter__(self):
+        # fetch the next sibling before handing out the current child, so
+        # that callers may remove the child they're looking at
+        table = self._table
+        child = table.first_child(self._idx)
+        while child != NO_NODE:
+            following = table.next_sibling(child)
+            yield table.view(child)
+            child = following
+
+    def __bool__(self):
+        return self._table.first_child(self._idx) != NO_NODE
+
+    def __len__(self):
+        return len(self._child_rows())
+
+    def __getitem__(self, i):
+        rows = self._child_rows()
+        if isinstance(i, slice):
+            return [self._table.view(r) for r in rows[i]]
+        return self._table.view(rows[i])
+
+    def _row_of(self, child):
+        if (isinstance(child, NodeView) and child._table is self._table
+            and self._table.parent(child._idx) == self._idx
+        ):
+            return child._idx
+        raise ValueError("{!r} is not in list".format(child))
+
+    def index(self, child):
+        return self._child_rows().index(self._row_of(child))
+
+    def remove(self, child):
+        self._table.unlink(self._row_of(child))
+
+    def retain(self, keep):
+        """Removes the children that keep() is false for. Returns the
+        children kept."""
+        view = self._table.view
+        return [
+            view(row) for row in
+            self._table.retain_children(self._idx, lambda row: keep(view(row)))
+        ]
+
+    def append(self, child):
+        NodeView(self._table, self._idx)._adopt(child)
+
+    def insert(self, i, child):
+        rows = self._child_rows()
+        row = NodeView(self._table, self._idx)._adopt(child)
+        self._table.unlink(row)
+
+        # same clamping as list.insert
+        if i < 0:
+            i += len(rows)
+        i = max(0, min(i, len(rows)))
+
+        prev = rows[i - 1] if i > 0 else NO_NODE
+        self._table.insert_after(prev, row, self._idx)
+
+    def __repr__(self):
+        return repr(list(self))
@@ -1,7 +1,17 @@
 import abc
+import collections
+import hashlib
+import logging
 import os
+import time
 
-from .ast import Node, NodeField, NodeType, load_ast_yaml, ASTWalker, ASTVisitor
+from .ast import (ASTNode, Node, NodeField, NodeType, load_ast,
+                  ASTWalker, ASTVisitor)
+from .outline import HEADING_ANCHOR, HEADING_LEVEL, HEADING_NUMBER, Outline
+from ..profiling import Profiler, timed
+
+
+logger = logging.getLogger(__name__)
 
 
 class ASTError(Exception):
@@ -9,183 +19,375 @@ class ASTError(Exception):
 
 
 class ASTTransform(metaclass=abc.ABCMeta):
-    def execute(self, config, db_session, ast_node, child_handler, parent=None):
-        """
-        child_handler: Similar function to call for child nodes, but which can
-                       determine the appropriate handler to call.
+    # Names of transformations that must have been applied everywhere in the
+    # tree before this one runs anywhere.
+    after = ()
 
+    def execute(self, config, db_session, ast_node, parent=None):
+        """
         Returns:
-            (bool) Whether to rescan the (sub)tree if parent is not None, else
-            None
+            (bool, node) Whether the returned node (which now occupies
+            ast_node's place) is new content that may hold further
+            transformations, and the node itself.
         """
+        return self._execute(config, db_session, ast_node, parent=parent)
 
-        while True:
-            rescan, ast_node = self._pre_execute(
-                config, db_session, ast_node, child_handler, parent=parent
-            )
-            if rescan:
-                return rescan, ast_node
+    def _execute(self, config, db_session, ast_node, parent=None):
+        return False, ast_node
 
-            rescan, ast_node = self._execute(
-                config, db_session, ast_node, child_handler, parent=parent
-            )
-            if rescan:
-                return rescan, ast_node
-
-            if isinstance(ast_node, Node) and ast_node[NodeField.CHILDREN]:
-                children_copy = list(ast_node[NodeField.CHILDREN])
-
-                for child_node in children_copy:
-                    rescan, child_node = child_handler(
-                        config, db_session, child_node, child_handler,
-                        parent=ast_node
-                    )
-                    if rescan:
-                        return rescan, ast_node
-
-            rescan, ast_node = self._post_execute(
-                config, db_session, ast_node, child_handler, parent=parent
+    def reapply(self, config, db_session, region_node, ast_node):
+        """Applies this transformation, which has already been applied at
+        region_node, to new content (ast_node's subtree) within its region.
+        """
+        pass
+
+
+class EnvVarASTTransform(ASTTransform):
+    def _execute(self, config, db_session, ast_node, parent=None):
+        value = os.environ[ast_node.body]
+
+        new_node = Node({
+            NodeField.NODE_TYPE: 'Text',
+            'body': value,
+        })
+        new_node = parent._replace_child(ast_node, new_node)
+        return False, new_node
+
+
+# set on the root of each included subtree, for cycle detection
+INCLUDE_PATH = '_ast_include_path_'
+
+
+class IncludeCache:
+    """Loads each distinct included file once per build.
+
+    Files are keyed by content, and every inclusion site gets its own copy
+    of the loaded AST, since later transforms modify it in place.
+    """
+
+    def __init__(self, ast_cache=None):
+        self._ast_cache = ast_cache
+        self._loaded = {}
+        self.primed = 0
+        self.reset_stats()
+
+    def reset_stats(self):
+        """Zeroes the counts of loads, for a new document. (Files primed
+        ahead of the document stay counted.)"""
+        self.hits = 0
+        self.misses = 0
+        self.avoided = 0
+
+    def prime(self, digest, template):
+        """Adds an already loaded file, a compact AST, with the sha256
+        digest of its content."""
+        if digest not in self._loaded:
+            self._loaded[digest] = template
+            self.primed += 1
+
+    def load(self, fpath, compact=False):
+        with open(fpath, 'rb') as fp:
+            digest = hashlib.sha256(fp.read()).digest()
+
+        try:
+            template = self._loaded[digest]
+            self.hits += 1
+        except KeyError:
+            template = self._loaded[digest] = load_ast(
+                fpath, top_level=False, compact=True, cache=self._ast_cache
             )
-            if (parent is not None and rescan) or not rescan:
-                break
+            self.misses += 1
 
-        return False, ast_node
+        # grafting a view into a NodeTable copies it, so compact ASTs can
+        # take the template itself
+        return template if compact else template.to_node()
 
-    def _pre_execute(self, config, db_session, ast_node, child_handler,
-                     parent=None
-    ):
-        return False, ast_node
 
-    def _execute(self, config, db_session, ast_node, child_handler, parent=None
-    ):
-        return False, ast_node
+def _include_chain(config, ast_node):
+    """Returns the real paths of the files that ast_node was included
+    through, outermost first."""
+    chain = [
+        p.get(INCLUDE_PATH) for p in ast_node.parents() if INCLUDE_PATH in p
+    ]
+    if INCLUDE_PATH in ast_node:
+        chain.insert(0, ast_node[INCLUDE_PATH])
+    chain.append(os.path.realpath(config.input_doc))
+    chain.reverse()
+    return chain
 
-    def _post_execute(self, config, db_session, ast_node, child_handler,
-                      parent=None
-    ):
-        return False, ast_node
 
+def _heading_level(ast_node):
+    """The level of the innermost heading containing ast_node (0 if none)."""
+    return sum(
+        1 for p in ast_node.parents() if p[NodeField.NODE_TYPE] == 'Head'
+    )
 
-class EnvVarASTTransform(ASTTransform):
-    def _execute(self, config, db_session, ast_node, child_handler, parent=None
-    ):
-        new_node = Node(node_type='Text', body=os.environ[ast_node.body])
-        parent._replace_child(ast_node, new_node)
-        return False, new_node
+
+def _is_prune_region(ast_node):
+    return (ast_node[NodeField.NODE_TYPE] == NodeType.TRANSFORMATION
+            and ast_node[NodeField.AST_TRANSFORMATION]
+                == 'prune_heading_levels')
+
+
+# set on prune_heading_levels regions inside other such regions
+NESTED_PRUNE = '_ast_nested_prune_'
+
+
+def _is_pruned(ast_node):
+    """Whether an enclosing prune_heading_levels transformation will cut the
+    heading that ast_node is in.
+
+    This only depends on ast_node's ancestors, so it can be decided before
+    anything else around it is loaded or transformed.
+    """
+    relative_level = 0
+    for p in ast_node.parents():
+        if p[NodeField.NODE_TYPE] == 'Head':
+            relative_level += 1
+
+        elif _is_prune_region(p) and relative_level > p.max_level:
+            return True
+
+    return False
 
 
 class ASTIncludeASTTransform(ASTTransform):
-    def _execute(self, config, db_session, ast_node, child_handler, parent=None
-    ):
-        new_node = load_ast_yaml(ast_node.path, top_level=False)
-        parent._replace_child(ast_node, new_node)
+    def _execute(self, config, db_session, ast_node, parent=None):
+        if _is_pruned(ast_node):
+            # no point loading what pruning will throw away
+            parent[NodeField.CHILDREN].remove(ast_node)
+            config.include_cache.avoided += 1
+            return False, ast_node
+
+        fpath = os.path.realpath(ast_node.path)
+
+        chain = _include_chain(config, parent)
+        if fpath in chain:
+            raise ASTError("Cyclic include: {}".format(
+                " -> ".join(chain[chain.index(fpath):] + [fpath])
+            ))
+
+        config.deps.add_include(fpath)
+        with timed(config, Profiler.INCLUDE, fpath):
+            new_node = config.include_cache.load(
+                ast_node.path, compact=config.compact_ast
+            )
+        new_node = parent._replace_child(ast_node, new_node)
+        new_node[INCLUDE_PATH] = fpath
         return True, new_node
 
 
 class ASTHeadingLevelAdjuster(ASTVisitor):
+    """Stamps each heading with its level, anchor and section number, and
+    builds the Outline of the headings walked, in a single pass.
+
+    prune_heading_levels regions are stamped with the level of the heading
+    they're in, and with NESTED_PRUNE if they're inside another region.
+    """
+
+    def __init__(self):
+        self.outline = Outline()
+        self._open = []
+        # nodes walked so far
+        self.visited = 0
+
     def pre_visit(self, ast_node, parents, context):
         if 'heading_level' not in context:
             context['heading_level'] = 0
+        if 'prune_regions' not in context:
+            context['prune_regions'] = 0
 
-        if hasattr(ast_node, 'node_type') and ast_node[NodeField.NODE_TYPE] == 'Head':
+        self.visited += 1
+
+        if ast_node[NodeField.NODE_TYPE] == 'Head':
             context['heading_level'] += 1
-            ast_node['_ast_heading_level_'] = context['heading_level']
+            entry = self.outline.add(ast_node, context['heading_level'])
+            ast_node[HEADING_LEVEL] = entry.level
+            ast_node[HEADING_ANCHOR] = entry.anchor
+            ast_node[HEADING_NUMBER] = entry.number
+            self._open.append((entry, self.visited))
+
+        elif _is_prune_region(ast_node):
+            ast_node[HEADING_LEVEL] = context['heading_level']
+            if context['prune_regions']:
+                ast_node[NESTED_PRUNE] = True
+            context['prune_regions'] += 1
 
     def post_visit(self, ast_node, parents, context):
-        if isinstance(ast_node, Node) and ast_node[NodeField.NODE_TYPE] == 'Head':
+        if not isinstance(ast_node, ASTNode):
+            return
+
+        if ast_node[NodeField.NODE_TYPE] == 'Head':
             context['heading_level'] -= 1
+            entry, visited = self._open.pop()
+            entry.end = len(self.outline)
+            entry.node_count = self.visited - visited + 1
 
+        elif _is_prune_region(ast_node):
+            context['prune_regions'] -= 1
 
-class ASTHeadingLevelPruner(ASTVisitor):
-    def __init__(self, max_level=None):
-        assert max_level is not None
-        self._max_level = max_level
-        self._pruning = False
-        self._relative_depth = [0]
 
-    def pre_visit(self, ast_node, parents, context):
-        if 'current_depth' not in context:
-            context['current_depth'] = 0
+# set on prune_heading_levels regions once they (and any regions nested in
+# them) have been pruned
+PRUNED = '_ast_pruned_'
 
-        context['current_depth'] += 1
 
-        if isinstance(ast_node, list):
-            return
-
-        else:
-            assert isinstance(ast_node, Node)
+def _retain_children(children, keep):
+    """Drops the children that keep() is false for, in a single pass over
+    them. Returns the children kept."""
+    if isinstance(children, list):
+        kept = []
+        for child in children:
+            if keep(child):
+                kept.append(child)
+            else:
+                # so that nothing in the dropped subtree still takes itself
+                # to be part of the tree
+                child[NodeField.PARENT] = None
+        children[:] = kept
+        return children
 
-            if 'current_level' not in context:
-                context['current_level'] = 0
+    # table.ChildList
+    return children.retain(keep)
 
-            if '_ast_heading_level_' in ast_node:
-                context['current_level'] = ast_node['_ast_heading_level_']
 
-            if (ast_node[NodeField.NODE_TYPE] == NodeType.AST_TRANSFORMATION
-                and ast_node[NodeField.TRANSFORMATION] == 'prune_heading_levels'
-            ):
-                self._relative_depth.append(context['current_depth'])
+class ASTHeadingLevelPruner:
+    """Cuts headings deeper than prune_heading_levels regions allow, along
+    with everything in them.
 
-            relative_prune_depth = self._max_level + self._relative_depth[-1]
-            if (
-                not self._pruning
-                and context['current_level'] > relative_prune_depth
-            ):
-                self._pruning = True
+    Whether a heading stays is decided when its parent is reached, and too
+    deep headings are dropped from their parent's children in one go,
+    without visiting anything below them. Regions nested in the subtree
+    being pruned are applied on the way, since they can only tighten the
+    limit, so the work done is proportional to what is kept, however much
+    is cut.
 
-    def post_visit(self, ast_node, parents, context):
-        context['current_depth'] -= 1
+    The level to start from is read from the stamp compute_heading_levels
+    leaves on the subtree's root, where there is one.
+    """
 
-        if isinstance(ast_node, Node) and '_ast_heading_level_' in ast_node:
-            context['current_level'] = ast_node['_ast_heading_level_']
+    def __init__(self):
+        self.kept = 0
+        # the headings cut
+        self.cut = []
 
-        if self._pruning:
-            relative_prune_depth = self._max_level + self._relative_depth[-1]
+    def prune(self, ast_node, max_level=None):
+        """Prunes ast_node's subtree.
 
-            if context['current_level'] <= relative_prune_depth:
-               self._pruning = False
+        Args:
+            max_level: The deepest (absolute) heading level allowed anywhere
+                       in the subtree, on top of the limits set by the
+                       regions in it.
+        """
+        if HEADING_LEVEL in ast_node:
+            level = ast_node[HEADING_LEVEL]
+        else:
+            level = _heading_level(ast_node)
+            if ast_node[NodeField.NODE_TYPE] == 'Head':
+                level += 1
+
+        stack = [(ast_node, level, max_level)]
+        while stack:
+            node, level, max_level = stack.pop()
+            self.kept += 1
+
+            if _is_prune_region(node):
+                # max_level is relative to the heading the region is in
+                region_max = level + node.max_level
+                if max_level is None or region_max < max_level:
+                    max_level = region_max
+                node[PRUNED] = True
+
+            children = node[NodeField.CHILDREN]
+            if not children:
+                continue
+
+            if max_level is not None and level >= max_level:
+                def keep(child):
+                    if child[NodeField.NODE_TYPE] == 'Head':
+                        self.cut.append(child)
+                        return False
+                    return True
+
+                children = _retain_children(children, keep)
+
+            stack.extend(
+                (child,
+                 level + 1 if child[NodeField.NODE_TYPE] == 'Head' else level,
+                 max_level)
+                for child in children
+            )
 
-            else:
-               if not parents:
-                   #raise ASTError(("INTERNAL ERROR: no parents for {!r} when"
-                   #                "pruning!").format(ast_node)) # TODO
-                   return
 
-               parent = parents[-1]
+class ComputeHeadingLevelsASTTransform(ASTTransform):
+    after = ('include_ast',)
 
-               if isinstance(parent, Node):
-                   parent[NodeField.CHILDREN].remove(ast_node)
+    def _execute(self, config, db_session, ast_node, parent=None):
+        walker = ASTWalker()
+        visitor = ASTHeadingLevelAdjuster()
+        walker.walk(visitor, ast_node,
+                    context={'heading_level': _heading_level(ast_node)},
+                    dump_ast_walk=config.dump_ast_walk)
 
-               elif isinstance(parent, dict):
-                   parent[NodeField.CHILDREN].remove(ast_node)
+        if parent is None:
+            # the whole document's, rather than that of some content within
+            # it (see reinclude())
+            config.outline = visitor.outline
 
-               elif isinstance(parent, list):
-                   list.remove(ast_node)
+        return False, ast_node
 
-        if (
-            hasattr(ast_node, '_transformation')
-            and ast_node._transformation == 'prune_heading_levels'
-        ):
-            self._relative_depth.pop()
 
+def _cut_from_outline(outline, heads):
+    """Drops the entries for heads, cut by pruning, from outline, and
+    restamps the headings kept with their new anchors and numbers."""
+    entries = []
+    for head in heads:
+        entry = outline.find(head.get(HEADING_ANCHOR))
+        # (heads cut from content outside the outline have none)
+        if entry is not None and _identity(entry.node) == _identity(head):
+            entries.append(entry)
+    if not entries:
+        return
 
-class ComputeHeadingLevelsASTTransform(ASTTransform):
-    def _execute(self, config, db_session, ast_node, child_handler, parent=None
-    ):
-        walker = ASTWalker()
-        visitor = ASTHeadingLevelAdjuster()
-        walker.walk(visitor, ast_node, dump_ast_walk=config.dump_ast_walk)
-        return False, ast_node
+    outline.cut(entries)
+    for entry in outline:
+        entry.node[HEADING_ANCHOR] = entry.anchor
+        entry.node[HEADING_NUMBER] = entry.number
 
 
 class PruneHeadingLevelsASTTransform(ASTTransform):
-    def _execute(self, config, db_session, ast_node, child_handler, parent=None
-    ):
-        walker = ASTWalker()
-        visitor = ASTHeadingLevelPruner(max_level=ast_node.max_level)
-        walker.walk(visitor, ast_node, dump_ast_walk=config.dump_ast_walk)
+    # prunes from the levels computed, and updates the outline to match
+    after = ('include_ast', 'compute_heading_levels')
+
+    def _execute(self, config, db_session, ast_node, parent=None):
+        if PRUNED in ast_node:
+            # already done, as part of an enclosing region
+            return False, ast_node
+
+        if NESTED_PRUNE in ast_node:
+            # the enclosing region would have pruned it along with the rest
+            # of its own, so it's in a heading that was cut
+            return False, ast_node
+
+        pruner = ASTHeadingLevelPruner()
+        pruner.prune(ast_node)
+        logger.debug("Pruned headings: {} nodes kept, {} subtrees cut".format(
+            pruner.kept, len(pruner.cut)
+        ))
+
+        if pruner.cut and config.outline is not None:
+            _cut_from_outline(config.outline, pruner.cut)
+
         return False, ast_node
 
+    def reapply(self, config, db_session, region_node, ast_node):
+        # (ast_node is new content, which isn't in the document's outline
+        # yet)
+        ASTHeadingLevelPruner().prune(
+            ast_node,
+            max_level=region_node[HEADING_LEVEL] + region_node.max_level
+        )
+
 
 BUILTIN_AST_TRANSFORMS = {
     'env_var': EnvVarASTTransform(),
@@ -195,36 +397,201 @@ BUILTIN_AST_TRANSFORMS = {
 }
 
 
-def transform_ast(config, db_session, ast_node, child_handler, parent=None):
+def _dependency_order(transforms):
+    """Returns the transformation names, each after everything it depends on,
+    and a map from each name to all of its direct and indirect
+    dependencies."""
+    order = []
+    depends_on = {}
+
+    def visit(name, path):
+        if name in depends_on:
+            return depends_on[name]
+        if name in path:
+            raise ASTError("Cyclic AST transformation dependencies: {}".format(
+                " -> ".join(path + [name])
+            ))
+        if name not in transforms:
+            raise ASTError(
+                "Unknown AST transformation: {} (required by {})".format(
+                    name, path[-1]
+                )
+            )
+
+        deps = set()
+        for dep in transforms[name].after:
+            deps.add(dep)
+            deps.update(visit(dep, path + [name]))
+
+        depends_on[name] = deps
+        order.append(name)
+        return deps
+
+    for name in transforms:
+        visit(name, [])
+
+    return order, depends_on
+
+
+def _identity(ast_node):
+    # Nodes are dicts, compared by content; NodeViews by the row they view
+    return id(ast_node) if isinstance(ast_node, Node) else ast_node
+
+
+class TransformScheduler:
+    """Applies the transformation nodes of an AST from a worklist.
+
+    The tree is scanned once for transformation nodes, and only content that
+    a transformation introduces (an included file, say) is scanned again, so
+    each node is visited once however many includes there are. A
+    transformation only runs once none of the transformations it depends on
+    (see ASTTransform.after) are pending anywhere in the tree.
     """
-    Args:
-        child_handler: Set this to None when calling from user code
+
+    def __init__(self, transforms=None):
+        self._transforms = (
+            BUILTIN_AST_TRANSFORMS if transforms is None else transforms
+        )
+        self._order, self._depends_on = _dependency_order(self._transforms)
+        self._pending = {
+            name: collections.deque() for name in self._transforms
+        }
+
+        self.applied = 0
+        self.scanned = 0
+
+    def schedule(self, ast_node):
+        """Queues the transformation nodes in ast_node's subtree, in document
+        order."""
+        stack = [ast_node]
+        while stack:
+            node = stack.pop()
+            self.scanned += 1
+
+            if node[NodeField.NODE_TYPE] == NodeType.TRANSFORMATION:
+                name = node[NodeField.AST_TRANSFORMATION]
+                try:
+                    self._pending[name].append(node)
+                except KeyError as e:
+                    raise ASTError(
+                        "Unknown AST transformation: {}".format(str(e))
+                    ) from e
+
+            children = node[NodeField.CHILDREN]
+            if children:
+                stack.extend(reversed(list(children)))
+
+    def _next(self):
+        for name in self._order:
+            if self._pending[name] and not any(
+                self._pending[dep] for dep in self._depends_on[name]
+            ):
+                return name, self._pending[name].popleft()
+
+        return None, None
+
+    def run(self, config, db_session):
+        profiler = config.profiler
+
+        while True:
+            name, ast_node = self._next()
+            if ast_node is None:
+                break
+
+            if profiler is not None:
+                started = time.perf_counter()
+
+            new_content, new_node = self._transforms[name].execute(
+                config, db_session, ast_node,
+                parent=ast_node.get(NodeField.PARENT)
+            )
+            self.applied += 1
+
+            if profiler is not None:
+                profiler.record(Profiler.TRANSFORM, name,
+                                time.perf_counter() - started)
+
+            if new_content:
+                self.schedule(new_node)
+
+
+def transform_ast(config, db_session, ast_node, transforms=None):
+    """Applies all of the transformations in ast_node's tree.
+
+    Returns:
+        The transformed tree.
     """
-    class ASTNoOp(ASTTransform):
-        pass
+    scheduler = TransformScheduler(transforms)
+    scheduler.schedule(ast_node)
+    scheduler.run(config, db_session)
 
-    no_op = ASTNoOp()
+    logger.info("Transformations: {} applied, {} nodes scanned".format(
+        scheduler.applied, scheduler.scanned
+    ))
 
-    rescan = None
-    while True:
-        if (
-            isinstance(ast_node, Node) and ast_node[NodeField.NODE_TYPE] == NodeType.TRANSFORMATION
-        ):
-            try:
-                handler = BUILTIN_AST_TRANSFORMS[ast_node[NodeField.AST_TRANSFORMATION]]
-            except KeyError as e:
-                raise ASTError(
-                    "Unknown AST transformation: {}".format(str(e))
-                ) from e
+    return ast_node
 
-        else:
-            handler = no_op
 
-        rescan, ast_node = handler.execute(
-            config, db_session, ast_node, transform_ast, parent=parent
-        )
+def reinclude(config, db_session, ast_node):
+    """Reloads the file that ast_node, the root of an included subtree, was
+    loaded from, and transforms the new content just as if it had been
+    included in the first place.
+
+    Returns:
+        The root of the new subtree, which now occupies ast_node's place.
+    """
+    parent = ast_node.get(NodeField.PARENT)
+
+    include = Node({
+        NodeField.NODE_TYPE: NodeType.TRANSFORMATION,
+        NodeField.AST_TRANSFORMATION: 'include_ast',
+        'path': ast_node[INCLUDE_PATH],
+    })
+
+    # heading levels around the include have already been computed, so the
+    # new content needs a computation of its own, before any pruning inside
+    # it runs
+    wrapper = Node({
+        NodeField.NODE_TYPE: NodeType.TRANSFORMATION,
+        NodeField.AST_TRANSFORMATION: 'compute_heading_levels',
+        NodeField.CHILDREN: [include],
+    })
+    include[NodeField.PARENT] = wrapper
+    wrapper = parent._replace_child(ast_node, wrapper)
+
+    transform_ast(config, db_session, wrapper)
+
+    new_node = parent._replace_child(
+        wrapper, wrapper[NodeField.CHILDREN][0]
+    )
+
+    # then whatever enclosing transformations have done to the rest of
+    # their region, outermost first
+    for p in reversed(list(new_node.parents())):
+        if p[NodeField.NODE_TYPE] == NodeType.TRANSFORMATION:
+            BUILTIN_AST_TRANSFORMS[p[NodeField.AST_TRANSFORMATION]].reapply(
+                config, db_session, p, new_node
+            )
+
+    return new_node
+
+
+def outline_subtree(ast_node):
+    """Walks ast_node's subtree as compute_heading_levels does, but without
+    setting the document's outline.
+
+    Returns:
+        The ASTHeadingLevelAdjuster, with the Outline of the headings in the
+        subtree, and the number of nodes in it.
+    """
+    visitor = ASTHeadingLevelAdjuster()
+    ASTWalker().walk(visitor, ast_node,
+                     context={'heading_level': _heading_level(ast_node)})
+    return visitor
 
-        if (parent is not None and rescan) or not rescan:
-            break
 
-    return rescan, ast_node
+def compute_outline(config, ast_node):
+    """Recomputes heading levels, anchors and numbers over the whole of
+    ast_node's document, and its Outline, after part of it has changed."""
+    ComputeHeadingLevelsASTTransform().execute(config, None, ast_node)
+    return config.outline
@@ -0,0 +1,195 @@
+"""Builds many documents in one go, listed in a manifest.
+
+Data is gathered once for the whole batch, and each worker process keeps
+its DB session, renderer templates and include cache warm from one
+document to the next, so a batch costs far less than running maxdoc once
+per document.
+"""
+
+import argparse
+import copy
+import logging
+import multiprocessing
+import os
+import shlex
+import sys
+import tempfile
+import time
+
+from .build import Build
+from .config import add_build_options, make_config
+from .data import gather_all
+from .db import init_db
+from .gatherers import ALL_GATHERERS
+from .profiling import stage
+from .renderers import ALL_RENDERERS
+
+
+logger = logging.getLogger(__name__)
+
+
+class ManifestError(Exception):
+    pass
+
+
+def read_manifest(fpath):
+    """Reads a manifest: one "input_doc output_doc" pair per line, quoted as
+    for a shell if need be. Blank lines and # comments are ignored.
+
+    Returns:
+        A list of (input_doc, output_doc).
+    """
+    jobs = []
+    with open(fpath) as fp:
+        for lineno, line in enumerate(fp, 1):
+            fields = shlex.split(line, comments=True)
+            if not fields:
+                continue
+            if len(fields) != 2:
+                raise ManifestError(
+                    "{}:{}: expected an input and an output path".format(
+                        fpath, lineno
+                    )
+                )
+            jobs.append(tuple(fields))
+    return jobs
+
+
+# (base config, DB session) for the documents built by this process
+_worker = None
+
+
+def _init_worker(args, db_path):
+    global _worker
+
+    config = make_config(args)
+    db_engine, DBSession = init_db(db_path)
+    _worker = config, DBSession()
+
+
+def _build_document(job):
+    """Builds one document.
+
+    Returns:
+        (input_doc, an error message or None, seconds taken)
+    """
+    input_doc, output_doc = job
+    base_config, db_session = _worker
+
+    config = base_config.for_document(input_doc, output_doc)
+    renderer = ALL_RENDERERS[config.renderer]
+
+    started = time.perf_counter()
+    try:
+        config.out_fp = open(output_doc, 'w')
+        try:
+            rc = Build(config, db_session, renderer, []).run()
+        finally:
+            config.out_fp.close()
+
+    except Exception as e:
+        logger.debug("Building {} failed".format(input_doc), exc_info=True)
+        return input_doc, "{}: {}".format(e.__class__.__name__, e), \
+            time.perf_counter() - started
+
+    error = "exit status {}".format(rc) if rc else None
+    return input_doc, error, time.perf_counter() - started
+
+
+def main(argv):
+    argparser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    add_build_options(argparser)
+    argparser.add_argument(
+        '-j', '--jobs', type=int, default=os.cpu_count() or 1,
+        help="Worker processes to build documents with (default: one per CPU)"
+    )
+    argparser.add_argument(
+        'manifest', help="A file listing input_doc output_doc pairs"
+    )
+
+    args = argparser.parse_args(argv[1:])
+    if args.profile and args.jobs != 1:
+        argparser.error("--profile needs --jobs 1")
+    if ',' in args.renderer:
+        argparser.error("--renderer takes a single renderer here")
+
+    args.input_doc = args.output_doc = None
+    args.in_fp = args.out_fp = None
+    args.watch = False
+
+    try:
+        jobs = read_manifest(args.manifest)
+    except (OSError, ManifestError) as e:
+        argparser.error(str(e))
+
+    # before make_config() adds caches to it, which workers make their own of
+    worker_args = copy.copy(args)
+    config = make_config(args)
+
+    with tempfile.TemporaryDirectory(prefix='maxdoc-batch-') as tmp:
+        # workers share the gathered data through an SQLite file
+        db_path = args.data_db or os.path.join(tmp, 'data.db')
+
+        print("Loading data...", end="", file=sys.stderr)
+        db_engine, DBSession = init_db(db_path)
+        db_session = DBSession()
+        with stage(config, 'gather'):
+            gather_all(ALL_GATHERERS, config, db_session)
+        print("", file=sys.stderr)
+
+        started = time.perf_counter()
+        pool = None
+
+        if args.jobs == 1:
+            global _worker
+            _worker = config, db_session
+            results = map(_build_document, jobs)
+
+        else:
+            db_session.close()
+            db_engine.dispose()
+
+            pool = multiprocessing.Pool(
+                args.jobs, initializer=_init_worker,
+                initargs=(worker_args, db_path)
+            )
+            results = pool.imap_unordered(
+                _build_document, jobs,
+                chunksize=max(1, len(jobs) // (args.jobs * 8))
+            )
+
+        failed = 0
+        try:
+            for input_doc, error, seconds in results:
+                if error is not None:
+                    failed += 1
+                    logger.error("{}: {}".format(input_doc, error))
+                else:
+                    logger.info("{}: built in {:.3f}s".format(
+                        input_doc, seconds
+                    ))
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+
+        elapsed = time.perf_counter() - started
+
+    print(
+        "Built {} documents in {:.2f}s ({:.1f} documents/s) with {} "
+        "worker(s); {} failed".format(
+            len(jobs), elapsed, len(jobs) / elapsed if elapsed else 0,
+            args.jobs, failed
+        ),
+        file=sys.stderr
+    )
+
+    # only holds anything if documents were built in this process
+    if config.render_cache is not None:
+        config.render_cache.save()
+
+    if config.profiler is not None:
+        config.profiler.write(config.profile)
+        print(config.profiler.summary(), file=sys.stderr)
+
+    return 1 if failed else 0
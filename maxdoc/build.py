@@ -0,0 +1,695 @@
+import logging
+import os
+import sys
+import time
+
+from .ast import ASTNode, NodeField, load_ast, transform_ast
+from .ast.dump import dump_ast_file
+from .ast.optimize import optimize_ast
+from .ast.outline import HEADING_ANCHOR, HEADING_NUMBER
+from .ast.transforms import (INCLUDE_PATH, compute_outline, outline_subtree,
+                             reinclude)
+from .model_names import get_model, is_model
+from .profiling import stage
+from .renderers.records import RecordMap, report_missing_records
+from .renderers.sinks import BufferedSink, write_chunks
+
+
+logger = logging.getLogger(__name__)
+
+# nodes rendered from the document outline, which must be re-rendered
+# whenever it changes
+TOC_NODE_TYPE = 'Toc'
+
+
+class BuildError(Exception):
+    pass
+
+
+def _is_include_root(ast_node):
+    return isinstance(ast_node, ASTNode) and INCLUDE_PATH in ast_node
+
+
+def _node_types(ast_node):
+    """The node types in ast_node's subtree, leaving out included subtrees
+    below it."""
+    node_types = set()
+    stack = [ast_node]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, list):
+            stack.extend(node)
+            continue
+
+        if node is not ast_node and _is_include_root(node):
+            continue
+
+        node_types.add(node[NodeField.NODE_TYPE])
+        stack.extend(node[NodeField.CHILDREN])
+
+    return node_types
+
+
+def edition_path(output_doc, renderer_name, renderer):
+    """Returns the file to write renderer's edition of a document to, when
+    rendering several: output_doc with {renderer} replaced by renderer_name,
+    or if it has none, with its extension replaced by renderer's."""
+    if '{renderer}' in output_doc:
+        return output_doc.replace('{renderer}', renderer_name)
+
+    extension = renderer.extension or '.' + renderer_name
+    return os.path.splitext(output_doc)[0] + extension
+
+
+def _render_edition(build, renderer, fpath):
+    started = time.perf_counter()
+
+    build.config.heading_level = 1
+    with open(fpath, 'w') as fp:
+        renderer.render(
+            build.config, build.db_session, build.ast, sink=BufferedSink(fp)
+        )
+    return fpath, time.perf_counter() - started
+
+
+# in edition worker processes, the Build whose editions they render
+_worker_build = None
+
+
+def _init_edition_worker(build):
+    global _worker_build
+    _worker_build = build
+
+
+def _render_edition_in_worker(edition):
+    return _render_edition(_worker_build, *edition)
+
+
+def _can_fork():
+    """Whether edition workers can be forked: not on Windows, which can't
+    fork, nor on macOS, where forking a process that may have started
+    threads (as gathering does) isn't safe."""
+    import multiprocessing
+
+    return (sys.platform != 'darwin'
+            and 'fork' in multiprocessing.get_all_start_methods())
+
+
+class Fragment:
+    """The output for one included subtree (or the whole document).
+
+    pieces holds the output as strings, with the Fragments of the includes
+    inside it in their places, so that any fragment can be re-rendered and
+    spliced back into the output on its own.
+    """
+
+    def __init__(self, node, heading_level):
+        self.node = node
+        self.heading_level = heading_level
+        self.pieces = []
+        self.node_types = set()
+
+    def children(self):
+        return [p for p in self.pieces if isinstance(p, Fragment)]
+
+    def iter_fragments(self):
+        """Yields this fragment and every fragment nested in it."""
+        stack = [self]
+        while stack:
+            fragment = stack.pop()
+            yield fragment
+            stack.extend(fragment.children())
+
+    def iter_chunks(self):
+        """Yields the whole output, nested fragments and all."""
+        stack = [iter(self.pieces)]
+        while stack:
+            for piece in stack[-1]:
+                if isinstance(piece, Fragment):
+                    stack.append(iter(piece.pieces))
+                    break
+                yield piece
+            else:
+                stack.pop()
+
+
+class Build:
+    """Builds a document: loads, transforms and renders it, from data that
+    gather() has put in the DB.
+
+    Everything read along the way is recorded in config.deps. If incremental
+    is True, the output is also kept, as a tree of Fragments (one per
+    included file), so that update() can redo just the work that a change
+    affects, rather than everything.
+    """
+
+    def __init__(self, config, db_session, renderer, gatherers,
+                 incremental=False):
+        """
+        Args:
+            db_session: A session on the DB to gather data into, or None to
+                        open the DB only once the document turns out to
+                        refer to records in it (see open_db()).
+            gatherers: The gatherers to gather data with, or None to make
+                       them just for the tables the document refers to. An
+                       empty list if the data has already been gathered.
+        """
+        self.config = config
+        self.db_session = db_session
+        self.renderer = renderer
+        self.gatherers = gatherers
+        self.incremental = incremental
+
+        self.ast = None
+        self._output = None
+        # the names of the tables gathered so far
+        self._gathered = set()
+
+    def open_db(self):
+        """Opens the DB (config.data_db, or an in-memory one), unless a
+        session on it was given or it's already open."""
+        if self.db_session is None:
+            # imported here, as documents that don't refer to the DB never
+            # need SQLAlchemy
+            from .db import init_db
+
+            db_engine, DBSession = init_db(self.config.data_db)
+            self.db_session = DBSession()
+        return self.db_session
+
+    def _gatherers_for(self, table_names):
+        if self.gatherers is None:
+            from .gatherers import get_gatherers
+            return get_gatherers(table_names)
+
+        return [
+            g for g in self.gatherers
+            if table_names is None or g.table_name in table_names
+        ]
+
+    def _start_gathering(self, table_names):
+        self.open_db()
+        gatherers = self._gatherers_for(table_names)
+
+        if gatherers:
+            logger.info("Gathering data for: {}".format(
+                ", ".join(sorted(g.table_name for g in gatherers))
+            ))
+
+        for gatherer in gatherers:
+            self.config.deps.add_data_source(
+                gatherer.table_name, gatherer.source_id
+            )
+        self._gathered.update(g.table_name for g in gatherers)
+        if table_names is not None:
+            self._gathered.update(table_names)
+
+        return gatherers
+
+    def gather(self, table_names=None):
+        """Gathers the data of the tables called table_names (by default,
+        of every table) into the DB, opening it if need be."""
+        from .data import gather_all
+
+        gatherers = self._start_gathering(table_names)
+        with stage(self.config, 'gather'):
+            gather_all(gatherers, self.config, self.db_session)
+
+    async def gather_async(self, table_names=None):
+        """As gather(), letting other tasks run while sources are read."""
+        from .data import gather_all_async
+
+        gatherers = self._start_gathering(table_names)
+        with stage(self.config, 'gather'):
+            await gather_all_async(gatherers, self.config, self.db_session)
+
+    def _prefetch(self, ast_node):
+        """Prefetches the DB records that ast_node's subtree refers to into
+        config.db_records, first gathering the data of any of their tables
+        that hasn't been.
+
+        Returns:
+            As for RecordMap.prefetch().
+        """
+        config = self.config
+
+        with stage(config, 'prefetch'):
+            references = config.db_records.references(ast_node)
+        if not references:
+            return []
+
+        table_names = {
+            model.__tablename__ for model in references
+        }.difference(self._gathered)
+        if table_names:
+            self.gather(table_names)
+
+        with stage(config, 'prefetch'):
+            return config.db_records.fetch(self.db_session, references)
+
+    def load(self):
+        """Returns the document's AST, as loaded from the input file."""
+        config = self.config
+        return load_ast(
+            config.input_doc, compact=config.compact_ast,
+            cache=config.ast_cache
+        )
+
+    def prepare(self, ast=None, renderers=None):
+        """Loads and transforms the document, and prefetches the DB records it
+        refers to (gathering their data first, if need be), leaving self.ast
+        ready to render.
+
+        Args:
+            ast: The document, if it's already been loaded (see load()).
+            renderers: What the document will be rendered with, for
+                       --optimize-ast (by default, self.renderer).
+
+        Returns:
+            An exit status, as for run().
+        """
+        config = self.config
+        renderers = renderers or [self.renderer]
+        for renderer in renderers:
+            renderer.configure(config)
+
+        if ast is None:
+            with stage(config, 'load'):
+                ast = self.load()
+        self.ast = ast
+
+        # (the include cache is shared by every document built with config)
+        config.include_cache.reset_stats()
+        with stage(config, 'transform'):
+            self.ast = transform_ast(config, self.db_session, self.ast)
+
+        logger.info(
+            "Includes: {} files loaded, {} cache hits ({} prefetched), {} "
+            "skipped as pruned".format(
+                config.include_cache.misses, config.include_cache.hits,
+                config.include_cache.primed, config.include_cache.avoided
+            )
+        )
+
+        if config.dump_transformed_ast:
+            with stage(config, 'dump'):
+                dump_ast_file(self.ast, config.dump_transformed_ast,
+                              config.dump_format)
+
+        # after the dump, which is of the transformed document, whatever it's
+        # rendered with
+        if config.optimize_ast:
+            with stage(config, 'optimize'):
+                optimize_ast(renderers, self.ast)
+
+        config.db_records = RecordMap()
+        missing = self._prefetch(self.ast)
+        if missing:
+            report_missing_records(missing)
+            self._output = None
+            return 20
+
+        return 0
+
+    def run(self, ast=None):
+        """Builds the document from scratch.
+
+        Args:
+            ast: As for prepare().
+
+        Returns:
+            An exit status for main(): non-zero if the build failed.
+        """
+        config = self.config
+
+        rc = self.prepare(ast)
+        if rc:
+            return rc
+
+        with stage(config, 'render'):
+            if self.incremental:
+                if self._output is not None:
+                    config.heading_level = self._output.heading_level
+                self._output = self._render_fragment(self.ast)
+                self._record_templates()
+                self._write_output()
+
+            else:
+                self.renderer.render(config, self.db_session, self.ast)
+
+        logger.info("Rendered with {!r}: {}".format(
+            self.renderer, self.renderer.stats()
+        ))
+        if config.render_cache is not None:
+            logger.info("Render cache: {}".format(config.render_cache.stats()))
+
+        return 0
+
+    def run_editions(self, editions, n_workers=None, ast=None):
+        """Builds the document once, then renders it with each of several
+        renderers, in parallel.
+
+        Args:
+            editions: A list of (renderer, output file).
+            n_workers: How many editions to render at once (by default, as
+                       many as there are CPUs).
+            ast: As for prepare().
+
+        Returns:
+            An exit status, as for run().
+        """
+        config = self.config
+
+        rc = self.prepare(ast, [renderer for renderer, fpath in editions])
+        if rc:
+            return rc
+
+        if n_workers is None:
+            n_workers = os.cpu_count() or 1
+        n_workers = min(n_workers, len(editions))
+        if config.profiler is not None:
+            # workers' timings would be lost
+            n_workers = 1
+        elif n_workers > 1 and not _can_fork():
+            logger.info("Can't fork workers here; rendering editions one "
+                        "after another")
+            n_workers = 1
+
+        with stage(config, 'render'):
+            if n_workers == 1:
+                results = [
+                    _render_edition(self, renderer, fpath)
+                    for renderer, fpath in editions
+                ]
+
+            else:
+                import multiprocessing
+
+                # forked, so that the workers inherit this build, AST and
+                # all, rather than each rebuilding it or having it pickled
+                # over
+                context = multiprocessing.get_context('fork')
+                with context.Pool(n_workers, initializer=_init_edition_worker,
+                                  initargs=(self,)) as pool:
+                    results = pool.map(_render_edition_in_worker, editions,
+                                       chunksize=1)
+
+        for fpath, seconds in results:
+            logger.info("Rendered {} in {:.3f}s".format(fpath, seconds))
+
+        return 0
+
+    def update(self, changes):
+        """Redoes whatever work changes (a deps.Changes) affects, and
+        rewrites the output with the new fragments spliced in.
+
+        Returns:
+            An exit status, as for run().
+        """
+        if self.config.optimize_ast and (
+            changes.templates or changes.template_dirs
+        ):
+            # how the AST was optimized depends on what the templates render
+            # nodes as
+            self.renderer.reload()
+            self._output = None
+
+        if self._output is None or changes.input_doc:
+            # anything in the document may depend on it (and run() gathers
+            # the data of any tables it newly refers to)
+            if self._gathered:
+                self.gather(set(self._gathered))
+            return self.run()
+
+        node_types = set()
+
+        if changes.tables:
+            self.gather(set(self._gathered))
+
+            # the old records are gone from the DB
+            self.config.db_records = RecordMap()
+            missing = self._prefetch(self.ast)
+            if missing:
+                report_missing_records(missing)
+                self._output = None
+                return 20
+
+            node_types.update(
+                node_type
+                for fragment in self._output.iter_fragments()
+                for node_type in fragment.node_types
+                if is_model(node_type)
+                and get_model(node_type).__tablename__ in changes.tables
+            )
+
+        if changes.templates or changes.template_dirs:
+            before = self.renderer.template_files()
+            self.renderer.reload()
+            after = self.renderer.template_files()
+
+            node_types.update(changes.templates)
+            # templates added or removed
+            node_types.update(
+                node_type for node_type in set(before).union(after)
+                if sorted(before.get(node_type, []))
+                != sorted(after.get(node_type, []))
+            )
+
+        # id(fragment) -> (its old root, the root of its re-included content)
+        replaced = {}
+        # ids of the nodes of fragments whose headings were renumbered
+        renumbered = set()
+
+        if changes.includes:
+            self._reinclude(self._output, changes.includes, replaced)
+
+            renumbered, outline_changed = self._update_outline(
+                replaced.values()
+            )
+            if outline_changed:
+                node_types.add(TOC_NODE_TYPE)
+
+        self._output = self._refresh(
+            self._output, replaced, renumbered, node_types
+        )
+        self._record_templates()
+        self._write_output()
+        return 0
+
+    def reset(self):
+        """Forgets the kept output, so that the next update() rebuilds
+        everything."""
+        self._output = None
+
+    def _render_fragment(self, ast_node, reuse=None):
+        """Renders ast_node's subtree into a Fragment.
+
+        Args:
+            reuse: A dict of id(node) -> Fragment, of already-rendered
+                   includes to use as they are.
+        """
+        fragment = Fragment(ast_node, self.config.heading_level)
+
+        for piece in self.renderer.render_chunks(
+            self.config, self.db_session, ast_node, holes=_is_include_root
+        ):
+            if isinstance(piece, str):
+                fragment.pieces.append(piece)
+                continue
+
+            child = None if reuse is None else reuse.get(id(piece))
+            if child is None:
+                child = self._render_fragment(piece)
+            fragment.pieces.append(child)
+
+        fragment.node_types = _node_types(ast_node)
+        return fragment
+
+    def _reinclude(self, fragment, includes, replaced):
+        """Re-includes the files in includes everywhere they're included
+        within fragment, noting the new content in replaced."""
+        for child in fragment.children():
+            if child.node[INCLUDE_PATH] not in includes:
+                self._reinclude(child, includes, replaced)
+                continue
+
+            new_node = reinclude(self.config, self.db_session, child.node)
+            replaced[id(child)] = child.node, new_node
+
+            missing = self._prefetch(new_node)
+            if missing:
+                report_missing_records(missing)
+                raise BuildError("{}: missing DB records".format(
+                    child.node[INCLUDE_PATH]
+                ))
+
+            if self.config.optimize_ast:
+                optimize_ast([self.renderer], new_node)
+
+    def _fragment_node(self, ast_node):
+        """Returns the root of the fragment that ast_node is rendered in."""
+        if _is_include_root(ast_node):
+            return ast_node
+        for p in ast_node.parents():
+            if _is_include_root(p):
+                return p
+        return self.ast
+
+    def _update_outline(self, replaced):
+        """Brings the document outline up to date after the re-includes in
+        replaced, a list of (old root, new root).
+
+        If the new content has just the same headings as the old, their
+        entries are moved over to the new heading nodes; only if headings
+        have changed is the whole outline recomputed.
+
+        Returns:
+            As for _recompute_outline().
+        """
+        outline = self.config.outline
+        by_node = {id(e.node): e for e in outline}
+
+        moves = []
+        for old_node, new_node in replaced:
+            old_entries = []
+            old_count = 0
+            stack = [old_node]
+            while stack:
+                node = stack.pop()
+                old_count += 1
+                if id(node) in by_node:
+                    old_entries.append(by_node[id(node)])
+                stack.extend(node[NodeField.CHILDREN])
+            old_entries.sort(key=lambda e: e.index)
+
+            new = outline_subtree(new_node)
+
+            if ([(e.level, e.title) for e in old_entries]
+                != [(e.level, e.title) for e in new.outline]
+            ):
+                return self._recompute_outline()
+
+            moves.append((old_entries, new, new_node, new.visited - old_count))
+
+        for old_entries, new, new_node, delta in moves:
+            for entry, new_entry in zip(old_entries, new.outline):
+                entry.node = new_entry.node
+                entry.node_count = new_entry.node_count
+                entry.node[HEADING_ANCHOR] = entry.anchor
+                entry.node[HEADING_NUMBER] = entry.number
+
+            for p in new_node.parents():
+                if id(p) in by_node:
+                    by_node[id(p)].node_count += delta
+
+        return set(), False
+
+    def _recompute_outline(self):
+        """Recomputes the document outline, after includes have changed.
+
+        Returns:
+            (the ids of the nodes of fragments holding headings whose anchor
+            or number has changed, whether the outline has changed at all)
+        """
+        def summary(outline):
+            return [(e.level, e.title, e.anchor, e.number) for e in outline]
+
+        old_outline = self.config.outline
+        old = {id(e.node): (e.anchor, e.number) for e in old_outline}
+
+        outline = compute_outline(self.config, self.ast)
+
+        renumbered = {
+            id(self._fragment_node(e.node)) for e in outline
+            if old.get(id(e.node)) != (e.anchor, e.number)
+        }
+        return renumbered, summary(outline) != summary(old_outline)
+
+    def _refresh(self, fragment, replaced, renumbered, node_types):
+        """Returns fragment, or its replacement if anything it was built from
+        has changed: its file was re-included, its headings were renumbered,
+        or a template or data for one of node_types changed."""
+        if id(fragment) in replaced:
+            self.config.heading_level = fragment.heading_level
+            old_node, new_node = replaced[id(fragment)]
+            return self._render_fragment(new_node)
+
+        children = {
+            id(child.node): self._refresh(child, replaced, renumbered,
+                                          node_types)
+            for child in fragment.children()
+        }
+
+        if fragment.node_types & node_types or id(fragment.node) in renumbered:
+            self.config.heading_level = fragment.heading_level
+            return self._render_fragment(fragment.node, reuse={
+                id(child.node): child for child in children.values()
+            })
+
+        fragment.pieces = [
+            children[id(piece.node)] if isinstance(piece, Fragment) else piece
+            for piece in fragment.pieces
+        ]
+        return fragment
+
+    def _record_templates(self):
+        deps = self.config.deps
+        for dpath in self.renderer.template_dirs():
+            deps.add_template_dir(dpath)
+
+        template_files = self.renderer.template_files()
+        for fragment in self._output.iter_fragments():
+            for node_type in fragment.node_types:
+                if node_type in template_files:
+                    deps.add_templates(node_type, template_files[node_type])
+
+    def _write_output(self):
+        # written aside and moved into place, so that anything watching the
+        # output never sees it half-written
+        fpath = self.config.output_doc
+        tmp_fpath = fpath + '.tmp'
+        with open(tmp_fpath, 'w') as fp:
+            write_chunks(self._output.iter_chunks(), BufferedSink(fp))
+        os.replace(tmp_fpath, fpath)
+
+
+def watch(build, interval=0.5):
+    """Updates build whenever anything it was built from changes, until
+    interrupted."""
+    deps = build.config.deps
+    snapshot = deps.snapshot()
+
+    print("Watching {} files for changes...".format(len(snapshot)),
+          file=sys.stderr)
+
+    try:
+        while True:
+            time.sleep(interval)
+
+            changes, current = deps.changes_since(snapshot)
+            if not changes:
+                continue
+
+            logger.info("Changed: {!r}".format(changes))
+            started = time.perf_counter()
+            try:
+                rc = build.update(changes)
+            except Exception as e:
+                logger.exception("Rebuild failed: {}".format(e))
+                rc = 1
+
+            if rc:
+                # the kept state may be half-updated, so start afresh next time
+                build.reset()
+                print("Rebuild failed", file=sys.stderr)
+            else:
+                print("Rebuilt in {:.3f}s".format(
+                    time.perf_counter() - started
+                ), file=sys.stderr)
+
+            # files first depended on during the update are watched from
+            # their state now
+            snapshot = deps.snapshot(current)
+
+    except KeyboardInterrupt:
+        return 0
@@ -1,5 +1,15 @@
 import argparse
+import copy
 import logging
+import sys
+
+from .ast.cache import ASTCache, default_cache_dir
+from .ast.dump import FORMATS as DUMP_FORMATS
+from .ast.transforms import IncludeCache
+from .deps import DependencyGraph
+from .paths import caching_disabled, user_cache_dir
+from .profiling import Profiler
+from .renderers.memo import DEFAULT_MAX_SIZE, RenderCache
 
 
 class Config:
@@ -8,6 +18,29 @@ class Config:
             setattr(self, k, v)
 
         self.heading_level = 1
+        self.db_records = None
+        # the document's ast.outline.Outline, once heading levels are known
+        self.outline = None
+        # the row a mail-merge is rendering the document for
+        self.merge_row = None
+        self.deps = DependencyGraph(self.input_doc)
+
+    def for_document(self, input_doc, output_doc):
+        """Returns a copy of this config for building another document, which
+        shares this one's caches.
+
+        The caller must open out_fp (and close it once done).
+        """
+        config = copy.copy(self)
+        config.input_doc = input_doc
+        config.output_doc = output_doc
+        config.in_fp = None
+        config.out_fp = None
+        config.heading_level = 1
+        config.db_records = None
+        config.outline = None
+        config.deps = DependencyGraph(input_doc)
+        return config
 
     def increment_heading_level(self):
         self.heading_level += 1
@@ -18,21 +51,159 @@ class Config:
         return ''
 
 
+def add_build_options(argparser):
+    """Adds the options that control how documents are built."""
+    argparser.add_argument(
+        '--renderer', default='html',
+        help="The renderer to use, or a comma-separated list of renderers to "
+             "render editions of the document with, all from one transformed "
+             "AST"
+    )
+    argparser.add_argument(
+        '--dump-transformed-ast', default=None, metavar='FILE',
+        help="Dump the transformed AST to FILE (- for stderr), which can be "
+             "built from again, without redoing the transformations"
+    )
+    argparser.add_argument(
+        '--dump-format', default=None, choices=DUMP_FORMATS,
+        help="The format of --dump-transformed-ast (default: binary for "
+             ".mdast files, json for .json files, or else yaml)"
+    )
+    argparser.add_argument(
+        '--dump-ast-walk', default=False, action="store_true"
+    )
+    argparser.add_argument(
+        '--compact-ast', default=False, action="store_true",
+        help="Hold the AST in a compact, array-backed node table"
+    )
+    argparser.add_argument(
+        '--optimize-ast', default=False, action="store_true",
+        help="Merge adjacent text, and drop nodes that render nothing, "
+             "after transformation, so that fewer nodes are rendered (the "
+             "output is just the same)"
+    )
+    argparser.add_argument(
+        '--ast-cache-dir', default=default_cache_dir(),
+        help="Where to keep compiled ASTs of loaded documents (by default, "
+             "maxdoc/ast in $XDG_CACHE_HOME, or ~/.cache)"
+    )
+    argparser.add_argument(
+        '--no-ast-cache', default=False, action="store_true",
+        help="Always parse documents, without using the AST cache (as "
+             "does setting $MAXDOC_NO_CACHE)"
+    )
+    argparser.add_argument(
+        '--template-cache-dir', default=user_cache_dir('jinja2'),
+        help="Where to keep compiled templates (by default, maxdoc/jinja2 in "
+             "$XDG_CACHE_HOME, or ~/.cache)"
+    )
+    argparser.add_argument(
+        '--no-template-cache', default=False, action="store_true",
+        help="Always compile templates, without caching them (as does "
+             "setting $MAXDOC_NO_CACHE)"
+    )
+    argparser.add_argument(
+        '--data-db', default=None,
+        help="An SQLite file to keep gathered data in between runs, so that "
+             "only data whose sources changed is reloaded"
+    )
+    argparser.add_argument(
+        '--render-cache', default=False, action="store_true",
+        help="Render identical subtrees once, reusing their output"
+    )
+    argparser.add_argument(
+        '--render-cache-file', default=None,
+        help="Keep the render cache in this file between runs (implies "
+             "--render-cache)"
+    )
+    argparser.add_argument(
+        '--render-cache-size', default=DEFAULT_MAX_SIZE // 2 ** 20, type=int,
+        metavar='MiB',
+        help="How much output the render cache may hold"
+    )
+    argparser.add_argument(
+        '--profile', default=None, metavar='REPORT_JSON',
+        help="Record where the build's time goes, writing a report here "
+             "and a summary to stderr"
+    )
+    argparser.add_argument(
+        '-v', '--verbose', default=False, action="store_true"
+    )
+
+
+def make_config(args):
+    """Returns the Config for parsed arguments (see add_build_options())."""
+    if args.verbose:
+        logging.basicConfig(level=logging.INFO)
+
+    if caching_disabled():
+        args.no_ast_cache = args.no_template_cache = True
+
+    args.ast_cache = (
+        None if args.no_ast_cache else ASTCache(args.ast_cache_dir)
+    )
+    args.include_cache = IncludeCache(args.ast_cache)
+    args.profiler = Profiler() if args.profile else None
+    args.render_cache = (
+        RenderCache(args.render_cache_size * 2 ** 20, args.render_cache_file)
+        if args.render_cache or args.render_cache_file else None
+    )
+    args.renderers = args.renderer.split(',')
+
+    return Config(args)
+
+
 def get_config(argv):
     argparser = argparse.ArgumentParser()
-    argparser.add_argument('--renderer', default='html')
+    add_build_options(argparser)
     argparser.add_argument(
-        '--dump-transformed-ast', default=False, action="store_true"
+        '--watch', default=False, action="store_true",
+        help="Keep running, and rebuild whatever is affected whenever "
+             "anything the document was built from changes (except "
+             "environment variables, which need a restart)"
     )
     argparser.add_argument(
-        '--dump-ast-walk', default=False, action="store_true"
+        '--watch-interval', default=0.5, type=float,
+        help="How often to check for changes in --watch mode, in seconds"
     )
     argparser.add_argument('input_doc')
-    argparser.add_argument('output_doc')
+    argparser.add_argument(
+        'output_doc',
+        help="Output file, or - for stdout. With several renderers, each "
+             "edition's file is named by replacing {renderer} in this with "
+             "the renderer's name, or if there's no {renderer}, by replacing "
+             "its extension with the renderer's"
+    )
+    argparser.add_argument(
+        '--pipeline', default=False, action="store_true",
+        help="Gather data while loading the document, and load everything "
+             "it includes in parallel, in --jobs worker processes"
+    )
+    argparser.add_argument(
+        '-j', '--jobs', type=int, default=None,
+        help="Worker processes to render editions with, with several "
+             "renderers, or to load includes in, with --pipeline (default: "
+             "one per CPU)"
+    )
 
     args = argparser.parse_args(argv[1:])
 
+    if args.watch and args.output_doc == '-':
+        argparser.error("--watch needs an output file to rewrite")
+
+    if ',' in args.renderer:
+        if args.watch:
+            argparser.error("--watch needs a single renderer")
+        if args.output_doc == '-':
+            argparser.error("Several renderers need an output file each")
+
     args.in_fp = open(args.input_doc)
-    args.out_fp = open(args.output_doc, 'w')
+    if ',' in args.renderer:
+        # each edition opens its own
+        args.out_fp = None
+    elif args.output_doc == '-':
+        args.out_fp = sys.stdout
+    else:
+        args.out_fp = open(args.output_doc, 'w')
 
-    return Config(args)
\ No newline at end of file
+    return make_config(args)
\ No newline at end of file
@@ -1,10 +1,272 @@
 import abc
+import asyncio
+import collections
+import functools
+import logging
+import queue
+import threading
+import time
+
+from . import db
+
+
+logger = logging.getLogger(__name__)
+
+
+class DataGatherError(Exception):
+    pass
 
 
 class DataGatherer(metaclass=abc.ABCMeta):
+    # The table this gatherer fills, if known. Gatherers of different tables
+    # may run concurrently.
+    table_name = None
+
     def __init__(self):
         pass
 
+    @property
+    def source_id(self):
+        """Identifies where this gatherer reads from, across runs."""
+        return repr(self)
+
+    def source_hash(self, config):
+        """Returns a digest of this gatherer's source, to tell whether data
+        kept from a previous run is still current, or None if that can't be
+        known (in which case, the data is always reloaded).
+        """
+        return None
+
     @abc.abstractmethod
-    def gather_data(self, db_engine):
-        pass
\ No newline at end of file
+    def iter_batches(self, config):
+        """Yields (model, list of row dicts) batches of data to insert.
+
+        This must not touch the DB, as it may run in a worker thread.
+        """
+        pass
+
+    def gather_data(self, config, db_session):
+        for model, rows in self.iter_batches(config):
+            insert_rows(db_session, model, rows)
+        db_session.flush()
+
+
+def insert_rows(db_session, model, rows):
+    """Inserts a batch of rows with a single executemany."""
+    db_session.execute(model.__table__.insert(), rows)
+
+
+def _stale_tables(groups, config, db_session):
+    """Works out which tables' data needs to be (re)loaded.
+
+    Returns a dict of table name -> {source_id: content hash}. A table is
+    stale if any of its sources changed, or if its set of sources did.
+    """
+    recorded = collections.defaultdict(dict)
+    for source_id, table_name, content_hash in db_session.execute(
+        db.data_sources.select()
+    ):
+        recorded[table_name][source_id] = content_hash
+
+    stale = {}
+    for table_name, group in groups.items():
+        current = {g.source_id: g.source_hash(config) for g in group}
+        if None in current.values() or current != recorded[table_name]:
+            stale[table_name] = current
+        else:
+            logger.info("{}: sources unchanged; keeping stored data".format(
+                table_name
+            ))
+    return stale
+
+
+def _clear_table(db_session, table_name):
+    if table_name in db.Base.metadata.tables:
+        db_session.execute(db.Base.metadata.tables[table_name].delete())
+
+    db_session.execute(db.data_sources.delete().where(
+        db.data_sources.c.table_name == table_name
+    ))
+
+
+def _record_sources(db_session, table_name, source_hashes):
+    db_session.execute(db.data_sources.insert(), [
+        {
+            'source_id': source_id,
+            'table_name': table_name,
+            'content_hash': content_hash,
+        }
+        for source_id, content_hash in source_hashes.items()
+    ])
+
+
+def _report(gatherer, rows, seconds):
+    logger.info("{}: {} rows in {:.3f}s ({:.0f} rows/s)".format(
+        gatherer, rows, seconds, rows / seconds if seconds else 0
+    ))
+
+
+# markers put on the batch queue by producer threads
+_GATHERER_DONE = 'done'
+_GATHERER_ROWS = 'rows'
+_GATHERER_FAILED = 'failed'
+
+# how long producer threads wait for room on the batch queue before checking
+# whether gathering has been cancelled, in seconds
+_PUT_TIMEOUT = 0.1
+
+
+class _Gathering:
+    """Gatherers running in producer threads, with the batches they produce
+    waiting on a queue to be inserted by the thread that started them (as DB
+    sessions aren't thread-safe)."""
+
+    def __init__(self, gatherers, config, db_session):
+        self.db_session = db_session
+
+        groups = collections.OrderedDict()
+        for gatherer in gatherers:
+            groups.setdefault(gatherer.table_name, []).append(gatherer)
+
+        self.stale = _stale_tables(groups, config, db_session)
+        for table_name in self.stale:
+            _clear_table(db_session, table_name)
+        groups = collections.OrderedDict(
+            (table_name, group) for table_name, group in groups.items()
+            if table_name in self.stale
+        )
+
+        # bounded, so that parsing can't run arbitrarily far ahead of
+        # inserting
+        self.batches = queue.Queue(maxsize=16)
+        self.remaining = sum(len(group) for group in groups.values())
+        self._started = {}
+        self._row_counts = collections.Counter()
+        # set once nothing more from the queue will be handled
+        self._cancelled = threading.Event()
+
+        for table_name, group in groups.items():
+            threading.Thread(
+                target=self._produce, args=(group, config),
+                name='gather-{}'.format(table_name), daemon=True
+            ).start()
+
+    def _put(self, item):
+        """Puts item on the batch queue, unless gathering is cancelled while
+        waiting for room on it.
+
+        Returns:
+            Whether item was put.
+        """
+        while not self._cancelled.is_set():
+            try:
+                self.batches.put(item, timeout=_PUT_TIMEOUT)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _produce(self, group, config):
+        for gatherer in group:
+            self._started[gatherer] = time.perf_counter()
+            try:
+                for model, rows in gatherer.iter_batches(config):
+                    if not self._put((_GATHERER_ROWS, gatherer, model, rows)):
+                        return
+            except Exception as e:
+                self._put((_GATHERER_FAILED, gatherer, e, None))
+                return
+            if not self._put((_GATHERER_DONE, gatherer, None, None)):
+                return
+
+    def cancel(self):
+        """Stops the producer threads, after anything has gone wrong."""
+        self._cancelled.set()
+
+        # wake up any producers waiting for room on the queue
+        while True:
+            try:
+                self.batches.get_nowait()
+            except queue.Empty:
+                break
+
+    def handle(self, item):
+        """Deals with one item from the batch queue."""
+        try:
+            self._handle(item)
+        except BaseException:
+            self.cancel()
+            raise
+
+    def _handle(self, item):
+        status, gatherer, model, rows = item
+
+        if status == _GATHERER_ROWS:
+            insert_rows(self.db_session, model, rows)
+            self._row_counts[gatherer] += len(rows)
+
+        elif status == _GATHERER_FAILED:
+            # leave the DB as it was, tables cleared above included
+            self.db_session.rollback()
+            raise DataGatherError(
+                "{} failed: {}".format(gatherer, model)
+            ) from model
+
+        else:
+            self.remaining -= 1
+            _report(gatherer, self._row_counts[gatherer],
+                    time.perf_counter() - self._started[gatherer])
+
+    def finish(self):
+        for table_name, source_hashes in self.stale.items():
+            _record_sources(self.db_session, table_name, source_hashes)
+
+        # commit, so that a persistent DB keeps what was loaded
+        self.db_session.commit()
+
+
+def gather_all(gatherers, config, db_session):
+    """Runs gatherers, reading and parsing their sources concurrently.
+
+    Gatherers are grouped by table_name, and each group runs in its own
+    thread, one gatherer after another. The batches they produce are
+    inserted from the calling thread, as DB sessions aren't thread-safe.
+
+    Tables whose sources haven't changed since they were last loaded into
+    the DB (only possible with a persistent DB) are left as they are; stale
+    tables are emptied and reloaded in full.
+    """
+    gathering = _Gathering(gatherers, config, db_session)
+    while gathering.remaining:
+        gathering.handle(gathering.batches.get())
+    gathering.finish()
+
+
+async def gather_all_async(gatherers, config, db_session):
+    """As gather_all(), but waits for batches without blocking the event
+    loop, so that other tasks run while sources are read and parsed.
+
+    Batches are still inserted from the calling (event loop) thread.
+    """
+    loop = asyncio.get_event_loop()
+    gathering = _Gathering(gatherers, config, db_session)
+    # waits for the next batch in an executor thread, for a little at a
+    # time, so that no thread is left waiting once gathering is cancelled
+    get = functools.partial(gathering.batches.get, timeout=_PUT_TIMEOUT)
+
+    try:
+        while gathering.remaining:
+            try:
+                item = gathering.batches.get_nowait()
+            except queue.Empty:
+                try:
+                    item = await loop.run_in_executor(None, get)
+                except queue.Empty:
+                    continue
+            gathering.handle(item)
+
+    except asyncio.CancelledError:
+        gathering.cancel()
+        raise
+
+    gathering.finish()
@@ -1,9 +1,11 @@
-import sqlalchemy
-from sqlalchemy import (Column, Date, Integer, Sequence, String, create_engine)
+import inspect
+
+from sqlalchemy import Column, Date, String, Table, create_engine, event
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 
 
+# (each model's name is listed in model_names.MODEL_NAMES too)
 Base = declarative_base()
 
 
@@ -22,12 +24,59 @@ class Book(Base):
     url = Column(String, nullable=True)
 
 
-def init_db():
-    db_engine = create_engine('sqlite:///:memory:')
+# What each data source's content was when its table was last loaded, so a
+# persistent DB only reloads tables whose sources changed. A plain table
+# rather than a model, so no gatherer is generated for it.
+data_sources = Table(
+    '_maxdoc_data_sources', Base.metadata,
+    Column('source_id', String, primary_key=True),
+    Column('table_name', String, nullable=False),
+    Column('content_hash', String, nullable=True),
+)
+
+
+def get_model(node_type):
+    """Returns the model that AST nodes of node_type refer to, if any."""
+    if not isinstance(node_type, str):
+        return None
+
+    model = globals().get(node_type)
+    if (inspect.isclass(model) and issubclass(model, Base)
+            and model is not Base):
+        return model
+
+    return None
+
+
+def _enable_wal(dbapi_connection, connection_record):
+    # WAL lets any number of maxdoc processes read the store while one
+    # writes to it
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.close()
+
+
+def init_db(db_path=None):
+    """
+    Args:
+        db_path: An SQLite file to keep gathered data in between runs. By
+                 default, data is only held in memory.
+    """
+    if db_path is None:
+        db_engine = create_engine('sqlite:///:memory:')
+
+    else:
+        db_engine = create_engine(
+            'sqlite:///{}'.format(db_path),
+            # wait for other processes' writes rather than failing
+            connect_args={'timeout': 30},
+        )
+        event.listen(db_engine, 'connect', _enable_wal)
 
     Base.metadata.create_all(db_engine)
 
-    DBSession = sessionmaker() 
+    DBSession = sessionmaker()
     DBSession.configure(bind=db_engine)
 
-    return db_engine, DBSession
\ No newline at end of file
+    return db_engine, DBSession
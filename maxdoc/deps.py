@@ -0,0 +1,116 @@
+"""Records what a build read, so that the work affected by a change to any of
+it can be found, and redone, without rebuilding everything.
+"""
+
+import os
+
+
+def _file_state(fpath):
+    try:
+        st = os.stat(fpath)
+    except OSError:
+        return None
+    return st.st_mtime_ns, st.st_size
+
+
+class Changes:
+    """What changed since a DependencyGraph snapshot, by kind of input."""
+
+    def __init__(self):
+        self.input_doc = False
+        self.template_dirs = False
+        self.includes = set()     # real paths
+        self.tables = set()       # names of tables whose sources changed
+        self.templates = set()    # node types whose templates changed
+
+    def __bool__(self):
+        return bool(
+            self.input_doc or self.template_dirs or self.includes
+            or self.tables or self.templates
+        )
+
+    def __repr__(self):
+        return "{}({})".format(self.__class__.__name__, ", ".join(
+            "{}={!r}".format(k, v) for k, v in sorted(self.__dict__.items())
+            if v
+        ))
+
+
+class DependencyGraph:
+    """The inputs a build consumed, and what in the build depends on each.
+
+    Inputs are the input document, every file included into it, the source
+    of each table of data, and the templates used for each node type (and
+    the directories they're found in).
+
+    Environment variables aren't tracked: a watching process can't see
+    changes to its environment, so changing them needs a restart.
+    """
+
+    def __init__(self, input_doc=None):
+        self.input_doc = (
+            None if input_doc is None else os.path.realpath(input_doc)
+        )
+        self.includes = set()
+        self.data_sources = {}      # table name -> set of source paths
+        self.templates = {}         # node type -> set of template paths
+        self.template_dirs = set()
+
+    def add_include(self, fpath):
+        self.includes.add(os.path.realpath(fpath))
+
+    def add_data_source(self, table_name, fpath):
+        self.data_sources.setdefault(table_name, set()).add(fpath)
+
+    def add_templates(self, node_type, fpaths):
+        self.templates.setdefault(node_type, set()).update(fpaths)
+
+    def add_template_dir(self, dpath):
+        self.template_dirs.add(dpath)
+
+    def files(self):
+        files = set(self.includes)
+        if self.input_doc is not None:
+            files.add(self.input_doc)
+        for fpaths in self.data_sources.values():
+            files.update(fpaths)
+        for fpaths in self.templates.values():
+            files.update(fpaths)
+        # a directory's mtime changes when templates are added or removed
+        files.update(self.template_dirs)
+        return files
+
+    def snapshot(self, base=None):
+        """Returns the state of every file depended on, keeping base's
+        record of any file that it already has."""
+        snapshot = dict(base or {})
+        for fpath in self.files():
+            if fpath not in snapshot:
+                snapshot[fpath] = _file_state(fpath)
+        return snapshot
+
+    def changes_since(self, snapshot):
+        """
+        Returns:
+            (Changes, the current snapshot)
+        """
+        current = {fpath: _file_state(fpath) for fpath in self.files()}
+        changed = {
+            fpath for fpath, state in current.items()
+            if snapshot.get(fpath) != state
+        }
+
+        changes = Changes()
+        changes.input_doc = self.input_doc in changed
+        changes.template_dirs = bool(self.template_dirs & changed)
+        changes.includes = self.includes & changed
+        changes.tables = {
+            table_name for table_name, fpaths in self.data_sources.items()
+            if fpaths & changed
+        }
+        changes.templates = {
+            node_type for node_type, fpaths in self.templates.items()
+            if fpaths & changed
+        }
+
+        return changes, current
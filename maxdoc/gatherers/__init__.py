@@ -1,12 +1,11 @@
 import inspect
 import os
-import sqlalchemy
 
 from .. import db
 from .generic import GenericConfigFileDataGatherer
 
 
-def _generate_gatherers():
+def _generate_gatherers(table_names=None):
     def as_config_fname(cls):
         lowered = cls.__name__.lower()
         if lowered.endswith("y"):
@@ -20,10 +19,27 @@ def _generate_gatherers():
         if (
             inspect.isclass(item)
             and issubclass(item, db.Base) and item.__name__ != 'Base'
+            and (table_names is None or item.__tablename__ in table_names)
         ):
             fpath = os.path.join('data', as_config_fname(item)) + '.yaml'
             gatherer = GenericConfigFileDataGatherer(item, fpath)
             yield gatherer
 
 
-ALL_GATHERERS = list(_generate_gatherers())
\ No newline at end of file
+def get_gatherers(table_names=None):
+    """Returns gatherers for the tables called table_names (by default, for
+    every table)."""
+    return list(_generate_gatherers(table_names))
+
+
+def __getattr__(name):
+    # (PEP 562) ALL_GATHERERS is only made when something asks for it
+    global ALL_GATHERERS
+
+    if name != 'ALL_GATHERERS':
+        raise AttributeError(
+            "module {!r} has no attribute {!r}".format(__name__, name)
+        )
+
+    ALL_GATHERERS = get_gatherers()
+    return ALL_GATHERERS
@@ -1,14 +1,112 @@
+import hashlib
 import logging
 import os
-import sys
 import yaml
 
-from ..db import *
-from ..data import DataGatherer
+from ..data import DataGatherer, DataGatherError
 
 
 logger = logging.getLogger(__name__)
 
+# libyaml's loader is several times faster than the pure-python one
+_YAML_LOADER = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+
+
+def _resolve_tag(loader, node_class, event, value):
+    if event.tag is None or event.tag == '!':
+        implicit = event.implicit if node_class is yaml.ScalarNode else True
+        return loader.resolve(node_class, value, implicit)
+    return event.tag
+
+
+def _compose_node(loader, anchors):
+    """Composes the node starting at the loader's next event.
+
+    This is a minimal, iterative version of yaml's Composer.compose_node().
+    It's needed because libyaml's CParser only composes whole documents (its
+    node composition isn't exposed), and iter_yaml_rows() composes one item
+    of a document's top-level sequence at a time. tests/test_gatherers.py
+    checks it against yaml.safe_load(), with both loaders.
+    """
+    stack = []
+    while True:
+        event = loader.get_event()
+
+        if isinstance(event, yaml.AliasEvent):
+            node = anchors[event.anchor]
+
+        elif isinstance(event, yaml.ScalarEvent):
+            node = yaml.ScalarNode(
+                _resolve_tag(loader, yaml.ScalarNode, event, event.value),
+                event.value, event.start_mark, event.end_mark,
+                style=event.style
+            )
+
+        elif isinstance(event, (yaml.SequenceStartEvent,
+                                yaml.MappingStartEvent)):
+            node_class = (yaml.SequenceNode
+                          if isinstance(event, yaml.SequenceStartEvent)
+                          else yaml.MappingNode)
+            node = node_class(
+                _resolve_tag(loader, node_class, event, None), [],
+                event.start_mark, None, flow_style=event.flow_style
+            )
+            if event.anchor is not None:
+                anchors[event.anchor] = node
+
+            # [node, pending mapping key]
+            stack.append([node, None])
+            continue
+
+        else:
+            # end of a sequence or mapping
+            node = stack.pop()[0]
+            node.end_mark = event.end_mark
+
+        if isinstance(event, yaml.ScalarEvent) and event.anchor is not None:
+            anchors[event.anchor] = node
+
+        if not stack:
+            return node
+
+        parent = stack[-1]
+        if isinstance(parent[0], yaml.SequenceNode):
+            parent[0].value.append(node)
+        elif parent[1] is None:
+            parent[1] = node
+        else:
+            parent[0].value.append((parent[1], node))
+            parent[1] = None
+
+
+def iter_yaml_rows(fp):
+    """Yields the items of each top-level sequence in a yaml stream, one at a
+    time, without loading whole documents into memory. Documents that aren't
+    sequences are yielded whole."""
+    loader = _YAML_LOADER(fp)
+    try:
+        loader.get_event()  # stream start
+
+        while not loader.check_event(yaml.StreamEndEvent):
+            loader.get_event()  # document start
+            anchors = {}
+
+            if loader.check_event(yaml.SequenceStartEvent):
+                loader.get_event()
+                while not loader.check_event(yaml.SequenceEndEvent):
+                    yield loader.construct_document(
+                        _compose_node(loader, anchors)
+                    )
+                loader.get_event()
+
+            else:
+                yield loader.construct_document(_compose_node(loader, anchors))
+
+            loader.get_event()  # document end
+
+    finally:
+        loader.dispose()
+
 
 class GenericConfigFileDataGatherer(DataGatherer):
     """A quick, hacky way to load yaml files directly into the DB.
@@ -17,33 +115,66 @@ class GenericConfigFileDataGatherer(DataGatherer):
              NOT be used with untrusted data.
     """
 
-    def __init__(self, data_type, fpath):
+    def __init__(self, data_type, fpath, batch_size=1000):
         self._data_type = data_type
         self._fpath = fpath
+        self._batch_size = batch_size
+        self.table_name = data_type.__tablename__
 
-    def gather_data(self, config, db_session):
-        if os.path.exists(self._fpath):
-            logger.info(
-                "Gathering {} data from {}...".format(
-                    self._data_type.__name__, self._fpath
-                ),
-                end=""
-            )
-            sys.stdout.flush()
+    @property
+    def source_id(self):
+        return self._fpath
 
-            with open(self._fpath) as fp:
-                data = yaml.load(fp.read())
+    def source_hash(self, config):
+        if not os.path.exists(self._fpath):
+            return 'missing'
 
-            for datapoint in data:
-                item = self._data_type(**datapoint)
-                db_session.add(item)
+        digest = hashlib.sha256()
+        with open(self._fpath, 'rb') as fp:
+            for block in iter(lambda: fp.read(1 << 16), b''):
+                digest.update(block)
+        return digest.hexdigest()
 
-            db_session.flush()
-            print("done.")
-
-        else:
-            print(
+    def iter_batches(self, config):
+        if not os.path.exists(self._fpath):
+            logger.info(
                 "No {} found; skipping loading of {}s.".format(
                     self._fpath, self._data_type.__name__
                 )
-            )
\ No newline at end of file
+            )
+            return
+
+        logger.info(
+            "Gathering {} data from {}...".format(
+                self._data_type.__name__, self._fpath
+            )
+        )
+
+        columns = self._data_type.__table__.columns.keys()
+
+        batch = []
+        with open(self._fpath) as fp:
+            for datapoint in iter_yaml_rows(fp):
+                if datapoint is None:
+                    continue
+
+                unknown = set(datapoint).difference(columns)
+                if unknown:
+                    raise DataGatherError(
+                        "{}: unknown {} fields: {}".format(
+                            self._fpath, self._data_type.__name__,
+                            ", ".join(sorted(unknown))
+                        )
+                    )
+
+                # executemany needs every row to have the same keys
+                batch.append({c: datapoint.get(c) for c in columns})
+                if len(batch) >= self._batch_size:
+                    yield self._data_type, batch
+                    batch = []
+
+        if batch:
+            yield self._data_type, batch
+
+    def __repr__(self):
+        return "{}({})".format(self.__class__.__name__, self._fpath)
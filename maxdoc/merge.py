@@ -0,0 +1,305 @@
+"""Mail-merges a document over DB rows.
+
+The document is loaded, transformed and rendered once. Only the nodes whose
+templates refer to the row (such as MergeField nodes) are left as holes,
+and those are re-rendered for each row of a model, or of a query over it.
+Output goes to one file per row, or into a zip archive.
+"""
+
+import argparse
+import logging
+import multiprocessing
+import os
+import sys
+import time
+import zipfile
+
+import sqlalchemy
+
+from . import db
+from .ast import NodeField
+from .build import Build
+from .config import add_build_options, make_config
+from .gatherers import ALL_GATHERERS
+from .profiling import stage
+from .renderers import ALL_RENDERERS
+from .renderers.sinks import BufferedSink, StringSink, write_chunks
+
+
+logger = logging.getLogger(__name__)
+
+
+class MergeError(Exception):
+    pass
+
+
+class MergeTemplate:
+    """A document rendered as far as it can be without a row.
+
+    pieces holds the output as strings, with (node, heading level) in the
+    places of the subtrees that depend on the row.
+    """
+
+    def __init__(self, config, db_session, renderer, ast_node):
+        self.config = config
+        self.db_session = db_session
+        self.renderer = renderer
+        self.pieces = []
+
+        node_types = renderer.merge_node_types()
+        if node_types is None:
+            # no telling what depends on the row, so render it all per row
+            self.pieces.append((ast_node, config.heading_level))
+            return
+
+        def holes(node):
+            return (not isinstance(node, list)
+                    and node[NodeField.NODE_TYPE] in node_types)
+
+        for piece in renderer.render_chunks(
+            config, db_session, ast_node, holes=holes
+        ):
+            if isinstance(piece, str):
+                if self.pieces and isinstance(self.pieces[-1], str):
+                    self.pieces[-1] += piece
+                else:
+                    self.pieces.append(piece)
+            else:
+                self.pieces.append((piece, config.heading_level))
+
+    def holes(self):
+        return sum(1 for p in self.pieces if not isinstance(p, str))
+
+    def render_chunks(self, row):
+        """Yields the document's output for row, chunk by chunk."""
+        config = self.config
+        config.merge_row = row
+        try:
+            for piece in self.pieces:
+                if isinstance(piece, str):
+                    yield piece
+                    continue
+
+                node, config.heading_level = piece
+                yield from self.renderer.render_chunks(
+                    config, self.db_session, node
+                )
+        finally:
+            config.merge_row = None
+
+
+def query_rows(db_session, model_name, where=None, order_by=None):
+    """Returns the rows of model_name's table to merge, as dicts of column
+    name -> value, optionally filtered and ordered by SQL expressions."""
+    model = db.get_model(model_name)
+    if model is None:
+        raise MergeError("No such model: {}".format(model_name))
+
+    query = db_session.query(model)
+    if where is not None:
+        query = query.filter(sqlalchemy.text(where))
+    query = query.order_by(
+        sqlalchemy.text(order_by) if order_by is not None else model.id
+    )
+
+    columns = [c.key for c in sqlalchemy.inspect(model).column_attrs]
+    try:
+        return [
+            {column: getattr(record, column) for column in columns}
+            for record in query
+        ]
+    except sqlalchemy.exc.SQLAlchemyError as e:
+        raise MergeError("Bad query over {}: {}".format(model_name, e)) from e
+
+
+# what path separators in row values are replaced with, in output names
+_SEPARATOR_REPLACEMENT = '_'
+
+
+def _path_safe(value):
+    """Returns value, with any path separators in it replaced, if it's a
+    string."""
+    if not isinstance(value, str):
+        return value
+    for sep in {'/', os.sep, os.altsep}.difference([None]):
+        value = value.replace(sep, _SEPARATOR_REPLACEMENT)
+    return value
+
+
+def _pattern_dir(pattern):
+    """The directory that all the names pattern makes must be in: that of
+    the part of it before the first field."""
+    return os.path.dirname(pattern.split('{', 1)[0])
+
+
+def output_name(pattern, row):
+    """Returns the output file (or archive member) name for row.
+
+    Path separators in the row's values are replaced, and names that would
+    still end up outside the pattern's directory (through a '..' value, say)
+    are refused, so that rows can't have output written anywhere else.
+    """
+    try:
+        name = pattern.format(
+            **{column: _path_safe(value) for column, value in row.items()}
+        )
+    except (KeyError, IndexError, ValueError) as e:
+        raise MergeError(
+            "Can't name output {!r} for row {!r}: {}".format(pattern, row, e)
+        ) from e
+
+    dpath = os.path.abspath(_pattern_dir(pattern))
+    fpath = os.path.abspath(name)
+    if fpath == dpath or os.path.commonpath([dpath, fpath]) != dpath:
+        raise MergeError(
+            "Output {!r} for row {!r} is outside {!r}".format(
+                name, row, _pattern_dir(pattern) or os.curdir
+            )
+        )
+
+    return name
+
+
+# the MergeTemplate being merged; set before worker processes are forked, so
+# that they all share it without it being rebuilt or pickled
+_template = None
+
+
+def _render_to_file(job):
+    fpath, row = job
+    dpath = os.path.dirname(fpath)
+    if dpath:
+        os.makedirs(dpath, exist_ok=True)
+    with open(fpath, 'w') as fp:
+        write_chunks(_template.render_chunks(row), BufferedSink(fp))
+    return fpath
+
+
+def _render_to_string(job):
+    name, row = job
+    sink = StringSink()
+    write_chunks(_template.render_chunks(row), sink)
+    return name, sink.getvalue()
+
+
+def merge(template, jobs, render, n_workers):
+    """Renders (name, row) jobs with render(), across n_workers processes.
+
+    Yields:
+        What render() returns, for each job, in no particular order.
+    """
+    global _template
+    _template = template
+
+    if n_workers == 1:
+        yield from map(render, jobs)
+        return
+
+    # forked, so that the workers inherit the template
+    pool = multiprocessing.get_context('fork').Pool(n_workers)
+    chunksize = max(1, min(100, len(jobs) // (n_workers * 8)))
+    try:
+        yield from pool.imap_unordered(render, jobs, chunksize=chunksize)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def main(argv):
+    argparser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    add_build_options(argparser)
+    argparser.add_argument(
+        '--model', required=True,
+        help="The model (e.g. Author) whose rows to merge the document with"
+    )
+    argparser.add_argument(
+        '--where', default=None, metavar='SQL',
+        help="Only merge rows matching this SQL condition"
+    )
+    argparser.add_argument(
+        '--order-by', default=None, metavar='SQL',
+        help="The order to merge rows in (by default, by id)"
+    )
+    argparser.add_argument(
+        '--archive', default=None, metavar='ZIP',
+        help="Write the documents into this zip archive, rather than files"
+    )
+    argparser.add_argument(
+        '-j', '--jobs', type=int, default=os.cpu_count() or 1,
+        help="Worker processes to render with (default: one per CPU)"
+    )
+    argparser.add_argument('input_doc')
+    argparser.add_argument(
+        'output_pattern',
+        help="Each row's output file (or name in the archive), with {column} "
+             "replaced by the row's values, e.g. letters/{id}.html (path "
+             "separators in the values are replaced with _)"
+    )
+
+    args = argparser.parse_args(argv[1:])
+    if args.profile and args.jobs != 1:
+        argparser.error("--profile needs --jobs 1")
+    if ',' in args.renderer:
+        argparser.error("--renderer takes a single renderer here")
+
+    args.output_doc = None
+    args.in_fp = args.out_fp = None
+    args.watch = False
+    config = make_config(args)
+
+    db_engine, DBSession = db.init_db(config.data_db)
+    db_session = DBSession()
+
+    renderer = ALL_RENDERERS[config.renderer]
+    build = Build(config, db_session, renderer, ALL_GATHERERS)
+
+    print("Loading data...", end="", file=sys.stderr)
+    build.gather()
+    print("", file=sys.stderr)
+
+    rc = build.prepare()
+    if rc:
+        return rc
+
+    try:
+        rows = query_rows(db_session, args.model, args.where, args.order_by)
+        jobs = [(output_name(args.output_pattern, row), row) for row in rows]
+    except MergeError as e:
+        logger.error("ERROR: {}".format(e))
+        return 2
+
+    with stage(config, 'render'):
+        template = MergeTemplate(config, db_session, renderer, build.ast)
+    logger.info("Merge template: {} pieces, {} per row".format(
+        len(template.pieces), template.holes()
+    ))
+
+    started = time.perf_counter()
+
+    with stage(config, 'merge'):
+        if args.archive is None:
+            for _ in merge(template, jobs, _render_to_file, args.jobs):
+                pass
+
+        else:
+            with zipfile.ZipFile(
+                args.archive, 'w', compression=zipfile.ZIP_DEFLATED
+            ) as archive:
+                for name, output in merge(
+                    template, jobs, _render_to_string, args.jobs
+                ):
+                    archive.writestr(name, output)
+
+    elapsed = time.perf_counter() - started
+    rate = len(jobs) / elapsed if elapsed else 0
+    print(
+        "Merged {} rows in {:.2f}s ({:.0f} documents/s, {:.0f}/hour) with {} "
+        "worker(s)".format(len(jobs), elapsed, rate, rate * 3600, args.jobs),
+        file=sys.stderr
+    )
+
+    if config.profiler is not None:
+        config.profiler.write(config.profile)
+        print(config.profiler.summary(), file=sys.stderr)
+
+    return 0
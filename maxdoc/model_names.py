@@ -0,0 +1,31 @@
+"""The names of the DB models, as the node types of the AST nodes that refer
+to their records.
+
+Kept apart from db.py, so that finding out whether a document refers to the
+DB at all doesn't mean importing SQLAlchemy.
+"""
+
+
+# the classes declared on db.Base; add any new model here too (a test checks
+# that the two agree)
+MODEL_NAMES = (
+    'Author',
+    'Book',
+)
+
+_MODEL_NAMES = frozenset(MODEL_NAMES)
+
+
+def is_model(node_type):
+    """Whether AST nodes of node_type refer to DB records."""
+    return isinstance(node_type, str) and node_type in _MODEL_NAMES
+
+
+def get_model(node_type):
+    """As db.get_model(), importing db only for node types that are
+    models."""
+    if not is_model(node_type):
+        return None
+
+    from . import db
+    return db.get_model(node_type)
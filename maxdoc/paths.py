@@ -0,0 +1,14 @@
+import os
+
+
+def user_cache_dir(*subdirs):
+    """Returns maxdoc's per-user cache directory (or a subdirectory of it),
+    following the XDG base directory spec."""
+    base = os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache')
+    return os.path.join(base, 'maxdoc', *subdirs)
+
+
+def caching_disabled():
+    """Whether $MAXDOC_NO_CACHE is set (to anything but ''), which turns off
+    the on-disk caches that are otherwise on by default."""
+    return bool(os.environ.get('MAXDOC_NO_CACHE'))
@@ -0,0 +1,208 @@
+"""Runs the stages of a build that don't depend on each other concurrently.
+
+Gathering data, loading the document and loading the files it includes are
+independent of each other, but a plain Build does them one after another,
+and loads includes one at a time, as the transformations reach them. Here,
+in an asyncio event loop:
+
+* data is gathered (its sources read and parsed in threads, as ever, and
+  inserted into the DB from the event loop's thread, which owns the DB
+  session) while
+* the document is loaded, in a thread, and then every file it includes,
+  and every file they include in turn, is loaded as soon as it's found,
+  in a pool of worker processes (or threads, with a single worker).
+
+Loaded includes are handed to the build's IncludeCache, so by the time the
+transformations run, every include they reach is already there.
+Transformation and rendering then go ahead as usual: rendering can't start
+on part of the document before all of it is transformed, as heading levels
+and the outline (which a table of contents renders) are computed over the
+whole document, once everything else is done.
+"""
+
+import asyncio
+import concurrent.futures
+import hashlib
+import logging
+import multiprocessing
+import os
+
+from .ast import NodeField, NodeType, load_ast
+from .ast.table import NodeTable, NodeView
+from .ast.transforms import _is_pruned
+from .profiling import stage
+
+
+logger = logging.getLogger(__name__)
+
+
+def _is_include(ast_node):
+    return (ast_node[NodeField.NODE_TYPE] == NodeType.TRANSFORMATION
+            and ast_node[NodeField.AST_TRANSFORMATION] == 'include_ast')
+
+
+def _include_paths(ast_node):
+    """Yields the paths of the includes in ast_node's subtree that aren't
+    pruned away within it."""
+    if isinstance(ast_node, NodeView):
+        # straight from the table, rather than through a view of every node
+        table = ast_node._table
+        nodes = (
+            table.view(idx) for idx in table.iter_subtree(ast_node._idx)
+            if table.node_type(idx) == NodeType.TRANSFORMATION
+        )
+    else:
+        nodes = _iter_subtree(ast_node)
+
+    for node in nodes:
+        if _is_include(node) and not _is_pruned(node):
+            yield node['path']
+
+
+def _iter_subtree(ast_node):
+    stack = [ast_node]
+    while stack:
+        node = stack.pop()
+        yield node
+        stack.extend(node[NodeField.CHILDREN])
+
+
+# the AST cache for worker processes to load through; set before they are
+# forked
+_ast_cache = None
+
+
+def _load_include(fpath):
+    """Loads an included file, as IncludeCache.load() would.
+
+    Returns:
+        (sha256 digest of its content, its compact AST).
+    """
+    with open(fpath, 'rb') as fp:
+        digest = hashlib.sha256(fp.read()).digest()
+    return digest, load_ast(fpath, top_level=False, compact=True,
+                            cache=_ast_cache)
+
+
+def _load_include_in_worker(fpath):
+    """As _load_include(), returning the AST serialised, to send back from a
+    worker process."""
+    digest, ast = _load_include(fpath)
+    return digest, ast._table.to_bytes()
+
+
+class IncludePrefetcher:
+    """Loads everything a document includes, transitively, in parallel."""
+
+    def __init__(self, include_cache, executor, in_processes):
+        self.include_cache = include_cache
+        self.executor = executor
+        self.in_processes = in_processes
+
+        self._seen = set()
+        self._pending = set()
+        self.loaded = 0
+        self.failed = 0
+
+    def find(self, ast_node):
+        """Starts loading the includes in ast_node's subtree that haven't
+        been seen yet."""
+        loop = asyncio.get_event_loop()
+        load = _load_include_in_worker if self.in_processes else _load_include
+
+        for path in _include_paths(ast_node):
+            fpath = os.path.realpath(path)
+            if fpath in self._seen:
+                continue
+            self._seen.add(fpath)
+
+            future = loop.run_in_executor(self.executor, load, fpath)
+            self._pending.add(
+                asyncio.ensure_future(self._loaded(fpath, future))
+            )
+
+    async def _loaded(self, fpath, future):
+        try:
+            digest, ast = await future
+            if self.in_processes:
+                ast = NodeTable.from_bytes(ast).root
+
+        except Exception as e:
+            # left for the transformation to load, and report properly, if it
+            # turns out to be needed
+            logger.debug("Couldn't prefetch include {}: {}".format(fpath, e))
+            self.failed += 1
+            return
+
+        self.include_cache.prime(digest, ast)
+        self.loaded += 1
+        self.find(ast)
+
+    async def wait(self):
+        """Waits until everything found, and everything that it includes,
+        is loaded."""
+        while self._pending:
+            # (more are found, and added, as these finish)
+            pending, self._pending = self._pending, set()
+            await asyncio.wait(pending)
+
+
+async def _load(build, executor, in_processes):
+    config = build.config
+    loop = asyncio.get_event_loop()
+
+    with stage(config, 'load'):
+        ast = await loop.run_in_executor(None, build.load)
+
+        prefetcher = IncludePrefetcher(
+            config.include_cache, executor, in_processes
+        )
+        prefetcher.find(ast)
+        await prefetcher.wait()
+
+    logger.info("Prefetched {} included files ({} failed)".format(
+        prefetcher.loaded, prefetcher.failed
+    ))
+    return ast
+
+
+async def _gather_and_load(build, executor, in_processes):
+    # (gathering first, so that its producer threads start right away)
+    _, ast = await asyncio.gather(
+        build.gather_async(), _load(build, executor, in_processes)
+    )
+    return ast
+
+
+def load_concurrently(build, n_workers=None):
+    """Gathers build's data while loading its document and includes.
+
+    Args:
+        n_workers: How many processes to load includes in (by default, one
+                   per CPU). With one, includes are loaded in a thread.
+
+    Returns:
+        The document's AST, to pass to build.run() or build.run_editions().
+    """
+    global _ast_cache
+
+    if n_workers is None:
+        n_workers = os.cpu_count() or 1
+
+    _ast_cache = build.config.ast_cache
+
+    if n_workers > 1:
+        # forked, so that workers inherit everything loaded so far
+        executor = concurrent.futures.ProcessPoolExecutor(
+            n_workers, mp_context=multiprocessing.get_context('fork')
+        )
+        # fork them all now, before gathering starts any threads
+        for future in [executor.submit(int) for _ in range(n_workers)]:
+            future.result()
+    else:
+        executor = concurrent.futures.ThreadPoolExecutor(1)
+
+    try:
+        return asyncio.run(_gather_and_load(build, executor, n_workers > 1))
+    finally:
+        executor.shutdown(wait=True)
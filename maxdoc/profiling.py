@@ -0,0 +1,202 @@
+"""Where a build's time goes: per pipeline stage, and per transformation,
+included file, template and DB model.
+
+Profiling is off unless config.profiler is set (by --profile), and the
+code being profiled only pays for a None check when it is.
+"""
+
+import collections
+import contextlib
+import json
+import sys
+import time
+
+
+ProfileEvent = collections.namedtuple(
+    'ProfileEvent', ('kind', 'key', 'wall', 'cpu', 'allocated_blocks')
+)
+ProfileEvent.__doc__ = """Something that took time.
+
+kind is one of Profiler.KINDS (or a kind of a subscriber's own), key says
+what within that kind (a stage or transformation name, a file, a
+template...). cpu and allocated_blocks (the net change in memory blocks
+allocated) are only measured for stages, and are None for other kinds.
+"""
+
+
+def _max_rss():
+    """Returns the process's peak resident set size (KiB on Linux, bytes on
+    macOS), or None where that can't be had (on Windows)."""
+    try:
+        # imported here, as it's Unix-only
+        import resource
+    except ImportError:
+        return None
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def _key_str(key):
+    if isinstance(key, tuple):
+        # (node_type, suffix) of templates, as in their file names
+        return "_".join(str(k) for k in key)
+    return str(key)
+
+
+class _Totals:
+    __slots__ = ('count', 'wall', 'max_wall')
+
+    def __init__(self):
+        self.count = 0
+        self.wall = 0.0
+        self.max_wall = 0.0
+
+    def add(self, wall):
+        self.count += 1
+        self.wall += wall
+        if wall > self.max_wall:
+            self.max_wall = wall
+
+    def to_dict(self):
+        return {'count': self.count, 'wall': self.wall,
+                'max_wall': self.max_wall}
+
+
+class Profiler:
+    """Collects ProfileEvents, and totals them per kind and key.
+
+    Anything else that wants to see the events as they happen (to forward
+    them to some other instrumentation, say) can subscribe() to them.
+    """
+
+    STAGE = 'stage'
+    TRANSFORM = 'transform'
+    INCLUDE = 'include'
+    TEMPLATE = 'template'
+    DB_LOOKUP = 'db_lookup'
+    KINDS = (STAGE, TRANSFORM, INCLUDE, TEMPLATE, DB_LOOKUP)
+
+    def __init__(self):
+        self.stages = collections.OrderedDict()
+        self.totals = {kind: collections.defaultdict(_Totals)
+                       for kind in self.KINDS}
+        self._subscribers = []
+
+    def subscribe(self, callback):
+        """Calls callback(event) with every ProfileEvent from now on."""
+        self._subscribers.append(callback)
+
+    def unsubscribe(self, callback):
+        self._subscribers.remove(callback)
+
+    def record(self, kind, key, wall, cpu=None, allocated_blocks=None):
+        totals = self.totals.get(kind)
+        if totals is None:
+            totals = self.totals[kind] = collections.defaultdict(_Totals)
+        totals[key].add(wall)
+
+        if self._subscribers:
+            event = ProfileEvent(kind, key, wall, cpu, allocated_blocks)
+            for callback in self._subscribers:
+                callback(event)
+
+    @contextlib.contextmanager
+    def timed(self, kind, key):
+        """Records the wall time that the with block takes."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(kind, key, time.perf_counter() - started)
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """Records the wall and CPU time, and the allocations, of a pipeline
+        stage."""
+        blocks = sys.getallocatedblocks()
+        cpu = time.process_time()
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            wall = time.perf_counter() - started
+            cpu = time.process_time() - cpu
+            blocks = sys.getallocatedblocks() - blocks
+
+            stage = self.stages.setdefault(
+                name, {'wall': 0.0, 'cpu': 0.0, 'allocated_blocks': 0}
+            )
+            stage['wall'] += wall
+            stage['cpu'] += cpu
+            stage['allocated_blocks'] += blocks
+
+            self.record(self.STAGE, name, wall, cpu=cpu,
+                        allocated_blocks=blocks)
+
+    def report(self):
+        """Returns everything recorded, as a JSON-serialisable dict."""
+        report = {
+            'stages': self.stages,
+            'max_rss': _max_rss(),
+        }
+        for kind, totals in self.totals.items():
+            if kind == self.STAGE:
+                continue
+            report[kind] = {
+                _key_str(key): t.to_dict() for key, t in sorted(
+                    totals.items(), key=lambda item: -item[1].wall
+                )
+            }
+        return report
+
+    def summary(self, top=10):
+        """Returns a human-readable summary: the stages, and the top few
+        keys of each other kind by total time."""
+        lines = ["{:<30} {:>10} {:>10} {:>12}".format(
+            "stage", "wall (s)", "cpu (s)", "blocks"
+        )]
+        for name, stage in self.stages.items():
+            lines.append("{:<30} {:>10.3f} {:>10.3f} {:>12}".format(
+                name, stage['wall'], stage['cpu'], stage['allocated_blocks']
+            ))
+
+        for kind, totals in self.totals.items():
+            if kind == self.STAGE or not totals:
+                continue
+
+            lines.append("")
+            lines.append("{:<30} {:>10} {:>10} {:>12}".format(
+                kind, "wall (s)", "count", "max (ms)"
+            ))
+            ranked = sorted(totals.items(), key=lambda item: -item[1].wall)
+            for key, t in ranked[:top]:
+                key = _key_str(key)
+                if len(key) > 30:
+                    key = "..." + key[-27:]
+                lines.append("{:<30} {:>10.3f} {:>10} {:>12.2f}".format(
+                    key, t.wall, t.count, t.max_wall * 1000
+                ))
+            if len(ranked) > top:
+                lines.append("({} more)".format(len(ranked) - top))
+
+        return "\n".join(lines)
+
+    def write(self, fpath):
+        with open(fpath, 'w') as fp:
+            json.dump(self.report(), fp, indent=2)
+
+
+def stage(config, name):
+    """Returns a context manager that profiles a stage, if config has a
+    profiler, or does nothing."""
+    profiler = config.profiler
+    if profiler is None:
+        return contextlib.nullcontext()
+    return profiler.stage(name)
+
+
+def timed(config, kind, key):
+    """As stage(), but for Profiler.timed()."""
+    profiler = config.profiler
+    if profiler is None:
+        return contextlib.nullcontext()
+    return profiler.timed(kind, key)
@@ -1,9 +1,84 @@
-from .render_pdf import PDFRenderer
-from .render_utf8 import UTF8Renderer
-from .render_html_jinja2 import Jinja2HTMLRenderer
-
-ALL_RENDERERS = {
-    "html": Jinja2HTMLRenderer(["../templates/html/jinja2"]),
-    "pdf": PDFRenderer(),
-    "utf8": UTF8Renderer(),
+"""The renderers, by name.
+
+Renderers are registered as factories, and each is only imported and
+created the first time it's looked up in ALL_RENDERERS, so that starting
+maxdoc doesn't cost building every renderer (the HTML one's jinja2
+environment, say) when just one is used.
+"""
+
+import collections.abc
+import importlib
+
+
+# class name -> the module defining it, for the renderer classes exported
+# here
+_CLASS_MODULES = {
+    'PDFRenderer': '.render_pdf',
+    'UTF8Renderer': '.render_utf8',
+    'Jinja2HTMLRenderer': '.render_html_jinja2',
 }
+
+
+def __getattr__(name):
+    # (PEP 562) imports a renderer class only when it's asked for
+    try:
+        module_name = _CLASS_MODULES[name]
+    except KeyError:
+        raise AttributeError(
+            "module {!r} has no attribute {!r}".format(__name__, name)
+        )
+    return getattr(importlib.import_module(module_name, __name__), name)
+
+
+class RendererRegistry(collections.abc.Mapping):
+    """A mapping of name -> renderer, creating each renderer from its
+    factory the first time it's looked up."""
+
+    def __init__(self):
+        self._factories = {}
+        self._renderers = {}
+
+    def register(self, name, factory):
+        """Registers factory, called with no arguments, to create the
+        renderer called name."""
+        self._factories[name] = factory
+        self._renderers.pop(name, None)
+
+    def __getitem__(self, name):
+        try:
+            return self._renderers[name]
+        except KeyError:
+            pass
+
+        renderer = self._renderers[name] = self._factories[name]()
+        return renderer
+
+    def __iter__(self):
+        return iter(self._factories)
+
+    def __len__(self):
+        return len(self._factories)
+
+    def __contains__(self, name):
+        return name in self._factories
+
+
+def _html_renderer():
+    from .render_html_jinja2 import Jinja2HTMLRenderer
+    return Jinja2HTMLRenderer(["../templates/html/jinja2"])
+
+
+def _pdf_renderer():
+    from .render_pdf import PDFRenderer
+    return PDFRenderer()
+
+
+def _utf8_renderer():
+    from .render_utf8 import UTF8Renderer
+    return UTF8Renderer()
+
+
+ALL_RENDERERS = RendererRegistry()
+ALL_RENDERERS.register("html", _html_renderer)
+ALL_RENDERERS.register("pdf", _pdf_renderer)
+ALL_RENDERERS.register("utf8", _utf8_renderer)
@@ -1,59 +1,184 @@
 import abc
 import logging
-import sys
+import time
 
-import sqlalchemy
-
-from .. import db
 from .. import ast
+from ..model_names import get_model
+from ..profiling import Profiler
+from .exceptions import RenderError
+from .sinks import BufferedSink, write_chunks
 
 
 logger = logging.getLogger(__name__)
 
+# what a renderer renders nodes of a type as, besides their children's
+# output (see Renderer.node_type_output()): nothing at all...
+RENDERS_NOTHING = 'nothing'
+# ...or their 'body' field, as it is, before their children's output
+RENDERS_BODY = 'body'
+
 
 class Renderer(metaclass=abc.ABCMeta):
+    # of the files this renderer's output is written to
+    extension = None
+
+    # The _*_render() hooks return the output for their part of ast_node, or
+    # None if they have none.
+
     def _pre_render(self, config, db_session, ast_node):
-        pass
+        return None
 
     def _render_body(self, config, db_session, ast_node):
-        pass
+        return None
 
     def _post_render(self, config, db_session, ast_node):
-        pass
+        return None
 
     def _get_ast_db_node(self, config, db_session, ast_node):
         if isinstance(ast_node, list):
             return None
 
-        try:
-            db_type = getattr(db, ast_node[ast.NodeField.NODE_TYPE])
-        except AttributeError:
+        db_type = get_model(ast_node[ast.NodeField.NODE_TYPE])
+        if db_type is None:
             return None
 
-        try:
-            return db_session.query(db_type).filter_by(id=ast_node.id).one()
-        except sqlalchemy.orm.exc.NoResultFound:
-            logger.error(
-                "ERROR: No DB record found for {}(id={!r})".format(
-                    ast_node[ast.NodeField.NODE_TYPE], ast_node['id']
-                )
-            )
-            sys.exit(20)
+        profiler = config.profiler
+        if profiler is None:
+            return self._lookup_db_node(config, db_session, ast_node, db_type)
 
-    def render(self, config, db_session, ast_node):
-        self._pre_render(config, db_session, ast_node)
-        self._render_body(config, db_session, ast_node)
+        started = time.perf_counter()
+        db_node = self._lookup_db_node(config, db_session, ast_node, db_type)
+        profiler.record(Profiler.DB_LOOKUP, db_type.__name__,
+                        time.perf_counter() - started)
+        return db_node
 
-        if isinstance(ast_node, list):
-            children = ast_node
+    def _lookup_db_node(self, config, db_session, ast_node, db_type):
+        if config.db_records is not None:
+            db_node = config.db_records.get(db_type, ast_node['id'])
+            if db_node is not None:
+                return db_node
 
+        from sqlalchemy.orm.exc import NoResultFound
+
+        try:
+            return db_session.query(db_type).filter_by(id=ast_node.id).one()
+        except NoResultFound as e:
+            raise RenderError("No DB record found for {}(id={!r})".format(
+                ast_node[ast.NodeField.NODE_TYPE], ast_node['id']
+            )) from e
+
+    def render_chunks(self, config, db_session, ast_node, holes=None):
+        """Yields the output for ast_node's subtree, chunk by chunk.
+
+        Rendering uses an explicit stack, so any depth of AST can be
+        rendered, and nothing is held beyond the chunk being yielded.
+
+        Args:
+            holes: A function of a node. Nodes below ast_node for which it
+                   returns True are yielded themselves, in place of their
+                   output, so that they can be rendered separately.
+        """
+        # (node, whether its children have been rendered)
+        stack = [(ast_node, False)]
+
+        while stack:
+            node, children_done = stack.pop()
+
+            if children_done:
+                chunk = self._post_render(config, db_session, node)
+                if chunk:
+                    yield chunk
+                continue
+
+            if holes is not None and node is not ast_node and holes(node):
+                yield node
+                continue
+
+            chunk = self._pre_render(config, db_session, node)
+            if chunk:
+                yield chunk
+
+            chunk = self._render_body(config, db_session, node)
+            if chunk:
+                yield chunk
+
+            if isinstance(node, list):
+                children = node
+
+            else:
+                children = node[ast.NodeField.CHILDREN]
+
+            stack.append((node, True))
+            stack.extend((child, False) for child in reversed(list(children)))
+
+    def render(self, config, db_session, ast_node, sink=None):
+        """Renders ast_node's subtree to sink (by default, a BufferedSink
+        over config.out_fp)."""
+        if sink is None:
+            sink = BufferedSink(config.out_fp)
+
+        render_cache = config.render_cache
+        if render_cache is not None and self.context_node_types() is not None:
+            chunks = render_cache.render_chunks(
+                self, config, db_session, ast_node
+            )
         else:
-            children = ast_node[ast.NodeField.CHILDREN]
+            chunks = self.render_chunks(config, db_session, ast_node)
+
+        write_chunks(chunks, sink)
+
+    def node_type_output(self, node_type):
+        """Returns what nodes of node_type render as, besides their
+        children's output, for the AST optimizer: RENDERS_NOTHING or
+        RENDERS_BODY, or None if anything else, or if that can't be known.
+        """
+        # a renderer that doesn't override the hooks renders nothing at all
+        if all(
+            getattr(type(self), hook) is getattr(Renderer, hook)
+            for hook in ('_pre_render', '_render_body', '_post_render')
+        ):
+            return RENDERS_NOTHING
+        return None
+
+    def template_files(self):
+        """Returns a dict of node type -> the template files used to render
+        nodes of that type."""
+        return {}
+
+    def template_dirs(self):
+        """Returns the directories that templates are looked up in."""
+        return []
+
+    def configure(self, config):
+        """Takes up whatever settings in config apply to this renderer,
+        before it renders anything with config."""
+        pass
 
-        for ast_child_node in children:
-            self.render(config, db_session, ast_child_node)
+    def reload(self):
+        """Forgets any templates loaded so far, so that changes to them are
+        picked up."""
+        pass
 
-        self._post_render(config, db_session, ast_node)
+    def merge_node_types(self):
+        """Returns the node types whose output depends on the mail-merge row
+        (config.merge_row), or None if that can't be known, in which case
+        every node is taken to."""
+        return None
+
+    def context_node_types(self):
+        """Returns the node types whose output depends on more than the node,
+        its subtree and its DB record (on config or the mail-merge row, say),
+        or None if that can't be known."""
+        return None
+
+    def version(self):
+        """Returns a string that changes whenever the same AST would be
+        rendered differently (when templates are edited, say)."""
+        return None
+
+    def stats(self):
+        """Returns a dict of counters describing the work done so far."""
+        return {}
 
     def __repr__(self):
         return self.__class__.__name__
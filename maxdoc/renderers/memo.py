@@ -0,0 +1,347 @@
+"""Memoization of rendered subtrees.
+
+Documents often repeat subtrees: the same included footer, the same
+citation, the same boilerplate paragraph. Each subtree gets a structural
+hash, of its nodes' types and fields, the DB records they refer to and its
+children's hashes. A RenderCache, keyed by that hash together with the
+renderer and its template version, then lets identical subtrees be
+rendered once and their output reused, within a run and (if the cache is
+kept in a file) across runs.
+
+Subtrees holding a node whose output depends on more than that (a table of
+contents, which depends on the whole document's outline, say) are never
+memoized, though the subtrees inside them may be.
+"""
+
+import collections
+import datetime
+import hashlib
+import json
+import logging
+import marshal
+import os
+import tempfile
+
+from .. import __version__
+from .. import ast
+from ..model_names import get_model, is_model
+
+
+logger = logging.getLogger(__name__)
+
+
+DEFAULT_MAX_SIZE = 64 * 2 ** 20
+
+# Subtrees of more nodes than this aren't memoized whole, only the subtrees
+# inside them, so that not too much output is held back to be stored.
+MAX_MEMO_NODES = 1000
+
+_FORMAT_VERSION = 2
+
+_NON_FIELDS = (ast.NodeField.NODE_TYPE, ast.NodeField.PARENT,
+               ast.NodeField.CHILDREN)
+
+# model -> the names of its columns
+_record_columns = {}
+
+
+def _record_values(record):
+    model = type(record)
+    try:
+        columns = _record_columns[model]
+    except KeyError:
+        import sqlalchemy
+
+        columns = _record_columns[model] = [
+            c.key for c in sqlalchemy.inspect(model).column_attrs
+        ]
+    return [getattr(record, column) for column in columns]
+
+
+def _canonical(v):
+    """Returns v, a field or record value, as plain json data that only
+    equal values map to (mappings tag what they stand for, so that nothing
+    else can be mistaken for them).
+
+    Raises:
+        TypeError: If there's no telling v from other values of its type.
+    """
+    if v is None or isinstance(v, (str, bool, int, float)):
+        return v
+    elif isinstance(v, (ast.NodeField, ast.NodeType)):
+        return {'enum': [v.__class__.__name__, v.name]}
+    elif isinstance(v, list):
+        return [_canonical(i) for i in v]
+    elif isinstance(v, ast.ASTNode):
+        return {'node': [
+            [_canonical(k), _canonical(i)] for k, i in v.items()
+            if k is not ast.NodeField.PARENT
+        ]}
+    elif isinstance(v, (datetime.date, datetime.time)):
+        return {v.__class__.__name__: v.isoformat()}
+
+    raise TypeError("Can't key render output by {!r}".format(type(v)))
+
+
+def _node_key(node, db_records, context_node_types, models):
+    """Returns what node itself (leaving out its children) is hashed by, or
+    None if its output can't be memoized."""
+    node_type = node[ast.NodeField.NODE_TYPE]
+    if node_type in context_node_types:
+        return None
+
+    # in the node's own order: nodes with the same fields in another order
+    # just aren't found to be the same
+    fields = [[k, v] for k, v in node.items() if k not in _NON_FIELDS]
+
+    try:
+        model = models[node_type]
+    except KeyError:
+        model = models[node_type] = get_model(node_type)
+
+    if model is None:
+        values = None
+    else:
+        record = (None if db_records is None
+                  else db_records.get(model, node.get('id')))
+        if record is None:
+            return None
+        values = _record_values(record)
+
+    try:
+        key = _canonical([node_type, fields, values])
+    except TypeError:
+        return None
+    return json.dumps(
+        key, ensure_ascii=False, separators=(',', ':')
+    ).encode('utf-8')
+
+
+def subtree_digests(ast_node, db_records, context_node_types):
+    """Returns a dict of id(node) -> (node, structural hash or None, number
+    of nodes in its subtree), for every node in ast_node's subtree."""
+    blake2b = hashlib.blake2b
+    models = {}
+
+    # in pre-order, so that reversed, every node comes after its children
+    order = []
+    stack = [ast_node]
+    while stack:
+        node = stack.pop()
+        children = (node if isinstance(node, list)
+                    else list(node[ast.NodeField.CHILDREN]))
+        order.append((node, children))
+        stack.extend(children)
+
+    digests = {}
+    for node, children in reversed(order):
+        if isinstance(node, list):
+            key = b'list'
+        else:
+            key = _node_key(node, db_records, context_node_types, models)
+
+        size = 1
+        parts = []
+        for child in children:
+            _, child_digest, child_size = digests[id(child)]
+            size += child_size
+            parts.append(child_digest)
+
+        if key is None or None in parts:
+            digest = None
+        else:
+            parts.append(key)
+            digest = blake2b(b''.join(parts), digest_size=16).digest()
+        digests[id(node)] = node, digest, size
+
+    return digests
+
+
+def _worth_memoizing(node, size):
+    if size > MAX_MEMO_NODES:
+        return False
+
+    # rendering any other lone node (Text, mostly) costs no more than looking
+    # it up would
+    return size > 1 or is_model(node[ast.NodeField.NODE_TYPE])
+
+
+class RenderCache:
+    """Least-recently-used cache of rendered subtrees' output, keyed by
+    structural hash, holding up to max_size characters of output.
+
+    If path is given, the cache is loaded from there, and save() writes it
+    back.
+    """
+
+    def __init__(self, max_size=DEFAULT_MAX_SIZE, path=None):
+        self.max_size = max_size
+        self.path = path
+
+        # key -> output, least recently used first
+        self._entries = collections.OrderedDict()
+        self.size = 0
+        self._dirty = False
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        if path is not None:
+            self._load()
+
+    def get(self, key):
+        output = self._entries.get(key)
+        if output is None:
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return output
+
+    def put(self, key, output):
+        if len(output) > self.max_size:
+            return
+
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self.size -= len(old)
+
+        self._entries[key] = output
+        self.size += len(output)
+        self._dirty = True
+
+        while self.size > self.max_size:
+            _, evicted = self._entries.popitem(last=False)
+            self.size -= len(evicted)
+            self.evictions += 1
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'evictions': self.evictions,
+            'entries': len(self._entries),
+            'size': self.size,
+        }
+
+    def _load(self):
+        try:
+            with open(self.path, 'rb') as fp:
+                # marshal rather than pickle: it only ever yields plain data
+                version, maxdoc_version, entries = marshal.load(fp)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError, EOFError, TypeError) as e:
+            logger.warning("Ignoring unreadable render cache {}: {}".format(
+                self.path, e
+            ))
+            return
+
+        if (version, maxdoc_version) != (_FORMAT_VERSION, __version__):
+            return
+
+        for key, output in entries:
+            self.put(key, output)
+        self._dirty = False
+
+    def save(self):
+        """Writes the cache to its file, if it has one and has changed."""
+        if self.path is None or not self._dirty:
+            return
+
+        dpath = os.path.dirname(os.path.abspath(self.path))
+        try:
+            os.makedirs(dpath, exist_ok=True)
+
+            # write-then-rename, so concurrent builds never see partial files
+            fd, tmp_path = tempfile.mkstemp(dir=dpath, suffix='.tmp')
+            with os.fdopen(fd, 'wb') as fp:
+                entries = list(self._entries.items())
+                marshal.dump((_FORMAT_VERSION, __version__, entries), fp)
+            os.replace(tmp_path, self.path)
+
+        except OSError as e:
+            logger.warning("Couldn't write render cache {}: {}".format(
+                self.path, e
+            ))
+            return
+
+        self._dirty = False
+
+    def render_chunks(self, renderer, config, db_session, ast_node):
+        """Yields the output for ast_node's subtree, as
+        renderer.render_chunks() would, reusing and storing the output of
+        memoizable subtrees."""
+        prefix = hashlib.blake2b(
+            "{}\0{}".format(
+                renderer.__class__.__name__, renderer.version()
+            ).encode('utf-8'),
+            digest_size=16
+        ).digest()
+
+        # (the digests also hold on to the nodes, so that the ids of compact
+        # AST views stay valid until rendering's done)
+        digests = subtree_digests(
+            ast_node, config.db_records, renderer.context_node_types()
+        )
+        keys = {
+            node_id: prefix + digest
+            for node_id, (node, digest, size) in digests.items()
+            if digest is not None and _worth_memoizing(node, size)
+        }
+
+        def holes(node):
+            return id(node) in keys
+
+        root_key = keys.get(id(ast_node))
+        if root_key is not None:
+            output = self.get(root_key)
+            if output is not None:
+                yield output
+                return
+
+        # (chunks of a subtree, its key, or None if it's not memoized (only
+        # ever the root), and its output so far)
+        stack = [(
+            renderer.render_chunks(config, db_session, ast_node, holes=holes),
+            root_key, []
+        )]
+
+        while stack:
+            chunks, key, output = stack[-1]
+
+            for piece in chunks:
+                if not isinstance(piece, str):
+                    piece_key = keys[id(piece)]
+                    cached = self.get(piece_key)
+                    if cached is None:
+                        stack.append((
+                            renderer.render_chunks(
+                                config, db_session, piece, holes=holes
+                            ),
+                            piece_key, []
+                        ))
+                        break
+                    piece = cached
+
+                if key is None:
+                    yield piece
+                else:
+                    output.append(piece)
+
+            else:
+                stack.pop()
+                if key is None:
+                    continue
+
+                output = ''.join(output)
+                self.put(key, output)
+
+                if not stack or stack[-1][1] is None:
+                    yield output
+                else:
+                    stack[-1][2].append(output)
@@ -0,0 +1,99 @@
+import collections
+import logging
+
+from .. import ast
+from ..model_names import get_model
+
+
+logger = logging.getLogger(__name__)
+
+
+# keep well under SQLite's default limit of 999 bound parameters per query
+_MAX_IDS_PER_QUERY = 500
+
+
+# model -> the Python type of its id column
+_id_types = {}
+
+
+def record_id(model, id_):
+    """Returns id_, an id as written in an AST (where ids that look like
+    numbers are loaded as ints), as the type of model's id column."""
+    try:
+        id_type = _id_types[model]
+    except KeyError:
+        id_type = _id_types[model] = model.__table__.c.id.type.python_type
+
+    return id_ if isinstance(id_, id_type) else id_type(id_)
+
+
+class ASTDBReferenceCollector(ast.ASTVisitor):
+    """Collects the ids of the DB records referred to by an AST, per model."""
+
+    def __init__(self):
+        self.ids = collections.defaultdict(set)
+
+    def pre_visit(self, ast_node, parents, context):
+        model = get_model(ast_node[ast.NodeField.NODE_TYPE])
+        if model is not None:
+            self.ids[model].add(record_id(model, ast_node['id']))
+
+
+class RecordMap:
+    """Identity map of the DB records an AST refers to.
+
+    prefetch() loads every record the AST needs with one query per model
+    (per few hundred ids), so rendering never goes back to the DB.
+    """
+
+    def __init__(self):
+        self._records = {}
+
+    def prefetch(self, db_session, ast_node):
+        """
+        Returns:
+            A list of (model, id) for records that the AST refers to, but
+            which don't exist.
+        """
+        return self.fetch(db_session, self.references(ast_node))
+
+    @staticmethod
+    def references(ast_node):
+        """Returns the ids of the records ast_node's subtree refers to, as a
+        dict of model -> set of ids (empty, without touching the DB, if it
+        refers to none)."""
+        collector = ASTDBReferenceCollector()
+        ast.ASTWalker().walk(collector, ast_node)
+        return collector.ids
+
+    def fetch(self, db_session, references):
+        """As prefetch(), for references as returned by references()."""
+        missing = []
+        for model, ids in references.items():
+            ids = sorted(ids)
+
+            for i in range(0, len(ids), _MAX_IDS_PER_QUERY):
+                chunk = ids[i:i + _MAX_IDS_PER_QUERY]
+                query = db_session.query(model).filter(model.id.in_(chunk))
+                for record in query:
+                    self._records[model, record.id] = record
+
+            missing.extend(
+                (model, id_) for id_ in ids
+                if (model, id_) not in self._records
+            )
+
+        return missing
+
+    def get(self, model, id_):
+        """Returns the record, or None if it wasn't prefetched."""
+        return self._records.get((model, record_id(model, id_)))
+
+
+def report_missing_records(missing):
+    logger.error("ERROR: No DB records found for:\n{}".format(
+        "\n".join(
+            "    {}(id={!r})".format(model.__name__, id_)
+            for model, id_ in missing
+        )
+    ))
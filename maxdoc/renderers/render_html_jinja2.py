@@ -1,59 +1,306 @@
+import hashlib
 import logging
 import os
+import re
+import time
 
 import jinja2
+import jinja2.meta
 
 from .exceptions import RenderError
-from .base import Renderer
-from .. import db
+from .base import RENDERS_BODY, RENDERS_NOTHING, Renderer
 from .. import ast
+from ..paths import caching_disabled, user_cache_dir
+from ..profiling import Profiler
+
+
+logger = logging.getLogger(__name__)
+
+
+_TEMPLATE_NAME_RE = re.compile(
+    r'^(?P<node_type>.+)_(?P<suffix>[^_]+)\.html\.jinja2$'
+)
+
+# a body template that renders the node's body as it is (jinja2 drops a
+# single trailing newline)
+_PLAIN_BODY_RE = re.compile(r'^\{\{-?\s*ast_node\.body\s*-?\}\}\n?$')
+
+
+def _has_templates(node_type):
+    # internal node types (NodeType members, 'AST_...' names) have none
+    return isinstance(node_type, str) and node_type.upper() != node_type
+
+
+# the variables a template may take from the context that it's rendered in,
+# beyond the node and its DB record
+_CONTEXT_VARIABLES = frozenset(('config', 'row'))
+
+
+def _template_variables(env, name, parsed):
+    """Returns the undeclared variables of template name, and of every
+    template it includes, imports or extends, however indirectly.
+
+    Args:
+        parsed: A dict of template name -> parsed template, shared between
+                calls, so that each template is only parsed once.
+    """
+    variables = set()
+    seen = {name}
+    stack = [name]
+    while stack:
+        name = stack.pop()
+        try:
+            tree = parsed[name]
+        except KeyError:
+            source = env.loader.get_source(env, name)[0]
+            tree = parsed[name] = env.parse(source)
+
+        variables.update(jinja2.meta.find_undeclared_variables(tree))
+        for referenced in jinja2.meta.find_referenced_templates(tree):
+            if referenced is None:
+                # chosen at render time, so could use anything
+                variables.update(_CONTEXT_VARIABLES)
+            elif referenced not in seen:
+                seen.add(referenced)
+                stack.append(referenced)
+
+    return variables
+
+
+class _BytecodeCache(jinja2.FileSystemBytecodeCache):
+    """A FileSystemBytecodeCache that carries on without caching if it can't
+    write to its directory."""
+
+    def __init__(self, directory):
+        super().__init__(directory)
+        self._warned = False
+
+    def dump_bytecode(self, bucket):
+        try:
+            super().dump_bytecode(bucket)
+        except OSError as e:
+            if not self._warned:
+                logger.warning("Not caching compiled templates: {}".format(e))
+                self._warned = True
 
 
 class Jinja2HTMLRenderer(Renderer):
-    def __init__(self, template_paths=['templates/html/jinja2'], **kwargs):
+    extension = '.html'
+
+    def __init__(self, template_paths=['templates/html/jinja2'],
+                 bytecode_cache_dir=None, **kwargs):
+        """
+        Args:
+            bytecode_cache_dir: Where to cache compiled templates (by
+                                default, maxdoc/jinja2 in the user's cache
+                                directory, unless $MAXDOC_NO_CACHE is set).
+                                configure() may move the cache, or turn it
+                                off.
+        """
         super().__init__(**kwargs)
         self._template_paths = template_paths
-        self._loader = jinja2.FileSystemLoader([os.path.abspath(p) for p in self._template_paths])
-        self._env = jinja2.Environment(loader=self._loader)
+        self._loader = jinja2.FileSystemLoader(
+            [os.path.abspath(p) for p in self._template_paths]
+        )
+        # None if compiled templates aren't cached
+        if bytecode_cache_dir is None and not caching_disabled():
+            bytecode_cache_dir = user_cache_dir('jinja2')
+        self._bytecode_cache_dir = bytecode_cache_dir
+        self._env = None
+
+        # (node_type, suffix) -> compiled template, for templates that exist
+        self._templates = None
+        # node type -> {suffix: compiled template}, for node types with
+        # templates, so that each node's are found with one lookup
+        self._node_type_templates = None
+        # node types whose only template renders their body as it is
+        self._plain_body_node_types = None
+        # node types with a template that refers to the mail-merge row, and
+        # to anything else beyond the node and its DB record
+        self._merge_node_types = None
+        self._context_node_types = None
+        # a hash of every template's source
+        self._version = None
+
+        self.template_lookups = 0
+        self.templates_loaded = 0
+
+    def configure(self, config):
+        cache_dir = (
+            None if config.no_template_cache else config.template_cache_dir
+        )
+        if cache_dir != self._bytecode_cache_dir:
+            self._bytecode_cache_dir = cache_dir
+            self.reload()
+
+    def _bytecode_cache(self):
+        if self._bytecode_cache_dir is None:
+            return None
 
-    def _load_template(self, basename, suffix):
         try:
-            return self._env.get_template(#
-                "{}_{}.html.jinja2".format(basename, suffix)
-            )
-        except jinja2.exceptions.TemplateNotFound:
+            os.makedirs(self._bytecode_cache_dir, exist_ok=True)
+        except OSError as e:
+            logger.warning("Not caching compiled templates: {}".format(e))
             return None
-        except jinja2.exceptions.TemplateSyntaxError as e:
-            raise RenderError(
-                "Template {}_{}: {}", basename, suffix, str(e)
-            ) from e
 
-    def _render_template(self, config, db_session, ast_node, suffix):
-        if (isinstance(ast_node, ast.Node)
-            and ast_node[ast.NodeField.NODE_TYPE].upper() != ast_node[ast.NodeField.NODE_TYPE]
+        return _BytecodeCache(self._bytecode_cache_dir)
+
+    def _load_templates(self):
+        """Finds and compiles every template on the template paths, once, so
+        that rendering never has to look for templates that don't exist."""
+        self._env = jinja2.Environment(
+            loader=self._loader, bytecode_cache=self._bytecode_cache()
+        )
+
+        templates = {}
+        node_type_templates = {}
+        plain_body_node_types = set()
+        merge_node_types = set()
+        context_node_types = set()
+        version = hashlib.sha256()
+        parsed = {}
+        for name in self._loader.list_templates():
+            match = _TEMPLATE_NAME_RE.match(name)
+            if match is None:
+                continue
+
+            try:
+                template = self._env.get_template(name)
+            except jinja2.exceptions.TemplateSyntaxError as e:
+                raise RenderError(
+                    "Template {}: {}".format(name, str(e))
+                ) from e
+
+            node_type, suffix = match.group('node_type', 'suffix')
+            templates[node_type, suffix] = template
+            if _has_templates(node_type):
+                by_suffix = node_type_templates.setdefault(node_type, {})
+                by_suffix[suffix] = template
+            self.templates_loaded += 1
+
+            source = self._loader.get_source(self._env, name)[0]
+            version.update("{}\0{}\0".format(name, source).encode('utf-8'))
+            if suffix == 'body' and _PLAIN_BODY_RE.match(source):
+                plain_body_node_types.add(node_type)
+
+            variables = _template_variables(self._env, name, parsed)
+            if 'row' in variables:
+                merge_node_types.add(match.group('node_type'))
+            if variables & _CONTEXT_VARIABLES:
+                context_node_types.add(match.group('node_type'))
+
+        self._templates = templates
+        self._node_type_templates = node_type_templates
+        self._plain_body_node_types = plain_body_node_types
+        self._merge_node_types = merge_node_types
+        self._context_node_types = context_node_types
+        self._version = version.hexdigest()
+
+    def template_files(self):
+        if self._templates is None:
+            self._load_templates()
+
+        files = {}
+        for (node_type, suffix), template in self._templates.items():
+            files.setdefault(node_type, []).append(template.filename)
+        return files
+
+    def template_dirs(self):
+        return [os.path.abspath(p) for p in self._template_paths]
+
+    def reload(self):
+        self._templates = None
+        self._node_type_templates = None
+        self._plain_body_node_types = None
+        self._merge_node_types = None
+        self._context_node_types = None
+        self._version = None
+
+    def merge_node_types(self):
+        if self._templates is None:
+            self._load_templates()
+        return self._merge_node_types
+
+    def context_node_types(self):
+        if self._templates is None:
+            self._load_templates()
+        return self._context_node_types
+
+    def version(self):
+        if self._templates is None:
+            self._load_templates()
+        return self._version
+
+    def node_type_output(self, node_type):
+        if self._templates is None:
+            self._load_templates()
+
+        templates = self._node_type_templates.get(node_type)
+        if templates is None:
+            return RENDERS_NOTHING
+        if (list(templates) == ['body']
+            and node_type in self._plain_body_node_types
         ):
-            db_node = self._get_ast_db_node(config, db_session, ast_node)
+            return RENDERS_BODY
+        return None
+
+    def stats(self):
+        return {
+            'template_lookups': self.template_lookups,
+            'templates_loaded': self.templates_loaded,
+        }
+
+    def _render_template(self, config, db_session, ast_node, suffix):
+        if self._templates is None:
+            self._load_templates()
 
-            template = self._load_template(ast_node[ast.NodeField.NODE_TYPE], suffix)
+        if not isinstance(ast_node, ast.ASTNode):
+            return None
+
+        # nodes of types without templates (internal ones among them) are
+        # skipped without looking anything up, their DB records included
+        node_type = ast_node[ast.NodeField.NODE_TYPE]
+        templates = self._node_type_templates.get(node_type)
+        if templates is not None:
+            self.template_lookups += 1
+            template = templates.get(suffix)
             if template is None:
-                return False
+                return None
+
+            db_node = self._get_ast_db_node(config, db_session, ast_node)
+
+            profiler = config.profiler
+            if profiler is None:
+                return template.render(
+                    config=config, ast_node=ast_node, db_node=db_node,
+                    row=config.merge_row
+                )
 
+            started = time.perf_counter()
             output = template.render(
-                config=config, ast_node=ast_node, db_node=db_node
+                config=config, ast_node=ast_node, db_node=db_node,
+                row=config.merge_row
             )
+            profiler.record(Profiler.TEMPLATE, (node_type, suffix),
+                            time.perf_counter() - started)
+            return output
 
-            config.out_fp.write(output)
-
-            return True
+        return None
 
     def _pre_render(self, config, db_session, ast_node):
-        if not self._render_template(config, db_session, ast_node, "pre"):
-            super()._pre_render(config, db_session, ast_node)
+        output = self._render_template(config, db_session, ast_node, "pre")
+        if output is None:
+            output = super()._pre_render(config, db_session, ast_node)
+        return output
 
     def _post_render(self, config, db_session, ast_node):
-        if not self._render_template(config, db_session, ast_node, "post"):
-            super()._post_render(config, db_session, ast_node)
+        output = self._render_template(config, db_session, ast_node, "post")
+        if output is None:
+            output = super()._post_render(config, db_session, ast_node)
+        return output
 
     def _render_body(self, config, db_session, ast_node):
-        if not self._render_template(config, db_session, ast_node, "body"):
-            super()._render_body(config, db_session, ast_node)
+        output = self._render_template(config, db_session, ast_node, "body")
+        if output is None:
+            output = super()._render_body(config, db_session, ast_node)
+        return output
@@ -3,5 +3,7 @@ from .base import Renderer
 
 
 class PDFRenderer(Renderer):
-    def render(self, config, db_session, ast_node):
-        super().render(config, db_session, ast_node)
\ No newline at end of file
+    extension = '.pdf'
+
+    def render(self, config, db_session, ast_node, sink=None):
+        super().render(config, db_session, ast_node, sink=sink)
\ No newline at end of file
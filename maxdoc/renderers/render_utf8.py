@@ -3,5 +3,7 @@ from .base import Renderer
 
 
 class UTF8Renderer(Renderer):
-    def render(self, config, db_session, ast_node):
-        super().render(config, db_session, ast_node)
\ No newline at end of file
+    extension = '.txt'
+
+    def render(self, config, db_session, ast_node, sink=None):
+        super().render(config, db_session, ast_node, sink=sink)
\ No newline at end of file
@@ -0,0 +1,75 @@
+"""Destinations for rendered output.
+
+Renderers produce output as a stream of (usually small) chunks; sinks
+gather those into large blocks before handing them on, so the underlying
+file, pipe or socket sees a few big writes instead of one per template.
+"""
+
+import io
+
+
+DEFAULT_BLOCK_SIZE = 64 * 1024
+
+
+class BufferedSink:
+    """Writes chunks to fp in blocks of roughly block_size characters.
+
+    fp can be anything with a write() method: a file, sys.stdout, a pipe, a
+    compressor, an HTTP response... If encoding is given, blocks are encoded
+    to bytes first, for binary streams.
+    """
+
+    def __init__(self, fp, block_size=DEFAULT_BLOCK_SIZE, encoding=None):
+        self._fp = fp
+        self._block_size = block_size
+        self._encoding = encoding
+        self._pending = []
+        self._pending_size = 0
+
+    def write(self, chunk):
+        self._pending.append(chunk)
+        self._pending_size += len(chunk)
+        if self._pending_size >= self._block_size:
+            self._write_block()
+
+    def _write_block(self):
+        block = ''.join(self._pending)
+        self._pending = []
+        self._pending_size = 0
+
+        if self._encoding is not None:
+            block = block.encode(self._encoding)
+        self._fp.write(block)
+
+    def flush(self):
+        if self._pending:
+            self._write_block()
+
+        flush = getattr(self._fp, 'flush', None)
+        if flush is not None:
+            flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.flush()
+
+
+class StringSink(BufferedSink):
+    """Collects output in memory."""
+
+    def __init__(self, block_size=DEFAULT_BLOCK_SIZE):
+        super().__init__(io.StringIO(), block_size=block_size)
+
+    def getvalue(self):
+        self.flush()
+        return self._fp.getvalue()
+
+
+def write_chunks(chunks, sink):
+    """Writes an iterable of output chunks to sink, then flushes it."""
+    write = sink.write
+    for chunk in chunks:
+        write(chunk)
+    sink.flush()
@@ -1,37 +1,59 @@
+import logging
+import sys
+
+from .build import Build, edition_path, watch
 from .config import get_config
-from .db import init_db
-from .gatherers import ALL_GATHERERS
 from .renderers import ALL_RENDERERS
-from .ast import load_ast_yaml, transform_ast
 
 
-def gather_data(config, db_session):
-    for gatherer in ALL_GATHERERS:
-        gatherer.gather_data(config, db_session)
+logger = logging.getLogger(__name__)
 
 
 def main(args):
     config = get_config(args)
 
-    db_engine, DBSession = init_db()
-    db_session = DBSession()
-
-    pipeline = {
-        "Loading data": gather_data,
-    }
-
-    for stage, handler in pipeline.items():
-        print("{}...".format(stage), end="")
-        handler(config, db_session)
-        print("")
-
-    ast = load_ast_yaml(config.input_doc)
-
-    _, ast = transform_ast(config, db_session, ast, None)
-
-    if config.dump_transformed_ast:
-        ast_repr = ast.to_ast_yaml()
-        logger.debug("Transformed AST:\n" + ast_repr + "\n")
-
-    renderer = ALL_RENDERERS[config.renderer]
-    renderer.render(config, db_session, ast)
+    unknown = [name for name in config.renderers if name not in ALL_RENDERERS]
+    if unknown:
+        logger.error("ERROR: No such renderer(s): {}. Choose from: {}".format(
+            ", ".join(unknown), ", ".join(sorted(ALL_RENDERERS))
+        ))
+        return 2
+
+    # the DB is only opened, and data gathered into it, if the document
+    # turns out to refer to it
+    build = Build(
+        config, None, ALL_RENDERERS[config.renderers[0]], None,
+        incremental=config.watch
+    )
+
+    # the document, if the pipeline loads it along with the data
+    ast = None
+
+    if config.pipeline:
+        from .pipeline import load_concurrently
+
+        # progress goes to stderr, so output can be streamed to stdout
+        print("Loading data and document...", end="", file=sys.stderr)
+        ast = load_concurrently(build, config.jobs)
+        print("", file=sys.stderr)
+
+    if len(config.renderers) > 1:
+        rc = build.run_editions([
+            (ALL_RENDERERS[name],
+             edition_path(config.output_doc, name, ALL_RENDERERS[name]))
+            for name in config.renderers
+        ], n_workers=config.jobs, ast=ast)
+    else:
+        rc = build.run(ast)
+
+    if config.render_cache is not None:
+        config.render_cache.save()
+
+    if config.profiler is not None:
+        config.profiler.write(config.profile)
+        print(config.profiler.summary(), file=sys.stderr)
+
+    if rc or not config.watch:
+        return rc
+
+    return watch(build, interval=config.watch_interval)
@@ -0,0 +1,54 @@
+"""A small document, with an include and data, and helpers for building it,
+for the tests that run whole builds."""
+import os
+
+from maxdoc.build import Build
+from maxdoc.config import get_config
+from maxdoc.renderers.render_html_jinja2 import Jinja2HTMLRenderer
+
+
+TEMPLATES = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    'templates', 'html', 'jinja2'
+)
+
+DOCUMENT = """\\document[title="Test"]{
+    Read \\Book[id=b1] by \\Author[id=a1].
+
+    \\head[title="Included"]{
+        \\include[path=part.mdm]
+    }
+}
+"""
+
+PART = """\\head[title="Part"]{
+    A part, about \\Book[id=b1].
+}
+"""
+
+AUTHORS = "- id: a1\n  pen_name: An Author\n"
+BOOKS = "- id: b1\n  title: A Book\n"
+
+
+def write(fpath, content):
+    with open(fpath, 'w') as fp:
+        fp.write(content)
+
+
+def read(fpath):
+    with open(fpath) as fp:
+        return fp.read()
+
+
+def build(input_doc, output_doc, incremental=False, options=()):
+    """Returns (the Build, its exit status) of building input_doc, with any
+    further command line options given."""
+    config = get_config(['maxdoc'] + list(options) + [input_doc, output_doc])
+    build = Build(config, None, Jinja2HTMLRenderer([TEMPLATES]), None,
+                  incremental=incremental)
+    try:
+        rc = build.run()
+    finally:
+        config.in_fp.close()
+        config.out_fp.close()
+    return build, rc
@@ -0,0 +1,25 @@
+import os
+
+import pytest
+
+from .building import AUTHORS, BOOKS, DOCUMENT, PART, write
+
+
+@pytest.fixture(autouse=True)
+def no_cache(monkeypatch):
+    """Keeps tests from reading or writing the user's caches."""
+    monkeypatch.setenv('MAXDOC_NO_CACHE', '1')
+
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    """A directory holding the test document, its include and its data,
+    made the current directory (which gatherers read data/ from)."""
+    dpath = str(tmp_path)
+    os.makedirs(os.path.join(dpath, 'data'))
+    write(os.path.join(dpath, 'doc.mdm'), DOCUMENT)
+    write(os.path.join(dpath, 'part.mdm'), PART)
+    write(os.path.join(dpath, 'data', 'authors.yaml'), AUTHORS)
+    write(os.path.join(dpath, 'data', 'books.yaml'), BOOKS)
+    monkeypatch.chdir(dpath)
+    return dpath
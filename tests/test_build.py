@@ -0,0 +1,11 @@
+from .building import build, read
+
+
+def test_build(workdir):
+    _, rc = build('doc.mdm', 'out.html')
+    assert rc == 0
+
+    output = read('out.html')
+    assert 'A Book' in output
+    assert 'An Author' in output
+    assert 'A part, about' in output
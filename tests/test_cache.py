@@ -0,0 +1,55 @@
+import os
+
+from maxdoc.ast import cache as ast_cache
+from maxdoc.ast.ast import Node
+from maxdoc.ast.markup import _compile_markup
+from maxdoc.config import get_config
+
+
+def _write(tmp_path, text):
+    fpath = os.path.join(str(tmp_path), 'doc.mdm')
+    with open(fpath, 'w') as fp:
+        fp.write(text)
+    return fpath
+
+
+def test_hit_after_miss(tmp_path):
+    fpath = _write(tmp_path, "\\document{Hello.}\n")
+    cache = ast_cache.ASTCache(os.path.join(str(tmp_path), 'cache'))
+
+    first = cache.load(fpath, _compile_markup, fmt='markup')
+    second = cache.load(fpath, _compile_markup, fmt='markup')
+
+    assert (cache.misses, cache.hits) == (1, 1)
+    assert (Node.to_ast_yaml(first.root.to_node())
+            == Node.to_ast_yaml(second.root.to_node()))
+
+
+def test_compile_revision_invalidates(tmp_path, monkeypatch):
+    fpath = _write(tmp_path, "\\document{Hello.}\n")
+    cache = ast_cache.ASTCache(os.path.join(str(tmp_path), 'cache'))
+    cache.load(fpath, _compile_markup, fmt='markup')
+
+    monkeypatch.setattr(ast_cache, 'COMPILE_REVISION',
+                        ast_cache.COMPILE_REVISION + 1)
+    cache.load(fpath, _compile_markup, fmt='markup')
+
+    assert (cache.misses, cache.hits) == (2, 0)
+
+
+def test_no_cache_environment_variable(monkeypatch, tmp_path):
+    (tmp_path / 'doc.mdm').write_text("text\n")
+    monkeypatch.chdir(tmp_path)
+
+    def caches(*options):
+        config = get_config(['maxdoc'] + list(options) + ['doc.mdm', '-'])
+        config.in_fp.close()
+        return config.ast_cache, config.no_template_cache
+
+    assert caches() == (None, True)
+
+    monkeypatch.delenv('MAXDOC_NO_CACHE')
+    ast_cache, no_template_cache = caches('--ast-cache-dir',
+                                          str(tmp_path / 'ast'))
+    assert ast_cache is not None
+    assert not no_template_cache
@@ -0,0 +1,42 @@
+import threading
+import time
+import types
+
+import pytest
+
+from maxdoc import db
+from maxdoc.data import DataGatherError, DataGatherer, gather_all
+
+
+class BooksGatherer(DataGatherer):
+    """Produces batches of books for as long as it's let."""
+
+    table_name = 'books'
+
+    def iter_batches(self, config):
+        i = 0
+        while True:
+            yield db.Book, [{'id': str(i), 'title': 'Book {}'.format(i)}]
+            i += 1
+
+
+class FailingGatherer(DataGatherer):
+    table_name = 'authors'
+
+    def iter_batches(self, config):
+        raise ValueError("unreadable")
+        yield
+
+
+def test_failure_stops_other_producers():
+    _, DBSession = db.init_db()
+    config = types.SimpleNamespace()
+    threads = threading.active_count()
+
+    with pytest.raises(DataGatherError, match="unreadable"):
+        gather_all([BooksGatherer(), FailingGatherer()], config, DBSession())
+
+    deadline = time.monotonic() + 5
+    while threading.active_count() > threads and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert threading.active_count() == threads
@@ -0,0 +1,117 @@
+import types
+
+from sqlalchemy import text
+
+from maxdoc import db
+from maxdoc.data import DataGatherer, _stale_tables, gather_all
+
+
+class BooksGatherer(DataGatherer):
+    table_name = 'books'
+
+    def __init__(self, titles, content_hash, source='books.yaml'):
+        super().__init__()
+        self.titles = titles
+        self.content_hash = content_hash
+        self.source = source
+        self.batches = 0
+
+    @property
+    def source_id(self):
+        return self.source
+
+    def source_hash(self, config):
+        return self.content_hash
+
+    def iter_batches(self, config):
+        self.batches += 1
+        yield db.Book, [
+            {'id': str(i), 'title': title}
+            for i, title in enumerate(self.titles)
+        ]
+
+
+def _titles(db_path):
+    _, DBSession = db.init_db(db_path)
+    session = DBSession()
+    try:
+        return sorted(b.title for b in session.query(db.Book))
+    finally:
+        session.close()
+
+
+def _gather(db_path, gatherers):
+    _, DBSession = db.init_db(db_path)
+    session = DBSession()
+    try:
+        gather_all(gatherers, types.SimpleNamespace(), session)
+    finally:
+        session.close()
+
+
+def test_data_persists_between_runs(tmp_path):
+    db_path = str(tmp_path / 'data.sqlite')
+
+    _gather(db_path, [BooksGatherer(["A", "B"], 'h1')])
+
+    assert _titles(db_path) == ["A", "B"]
+
+
+def test_unchanged_sources_are_not_reloaded(tmp_path):
+    db_path = str(tmp_path / 'data.sqlite')
+    _gather(db_path, [BooksGatherer(["A"], 'h1')])
+
+    gatherer = BooksGatherer(["Not loaded"], 'h1')
+    _gather(db_path, [gatherer])
+
+    assert gatherer.batches == 0
+    assert _titles(db_path) == ["A"]
+
+
+def test_changed_sources_are_reloaded(tmp_path):
+    db_path = str(tmp_path / 'data.sqlite')
+    _gather(db_path, [BooksGatherer(["A", "B"], 'h1')])
+
+    _gather(db_path, [BooksGatherer(["C"], 'h2')])
+
+    # the table is emptied and reloaded in full
+    assert _titles(db_path) == ["C"]
+
+
+def test_stale_tables(tmp_path):
+    db_path = str(tmp_path / 'data.sqlite')
+    _gather(db_path, [BooksGatherer(["A"], 'h1')])
+    _, DBSession = db.init_db(db_path)
+    session = DBSession()
+    config = types.SimpleNamespace()
+
+    def stale(*gatherers):
+        return _stale_tables({'books': list(gatherers)}, config, session)
+
+    assert stale(BooksGatherer([], 'h1')) == {}
+    assert stale(BooksGatherer([], 'h2')) == {'books': {'books.yaml': 'h2'}}
+    # a source that can't be hashed is always reloaded
+    assert stale(BooksGatherer([], None)) == {'books': {'books.yaml': None}}
+    # as is a table whose set of sources has changed
+    assert stale(
+        BooksGatherer([], 'h1'), BooksGatherer([], 'h3', source='more.yaml')
+    ) == {'books': {'books.yaml': 'h1', 'more.yaml': 'h3'}}
+    session.close()
+
+
+def test_in_memory_db_always_gathers():
+    _, DBSession = db.init_db()
+    session = DBSession()
+
+    assert _stale_tables({'books': [BooksGatherer([], 'h1')]},
+                         types.SimpleNamespace(), session) \
+        == {'books': {'books.yaml': 'h1'}}
+
+
+def test_persistent_db_uses_wal(tmp_path):
+    db_engine, _ = db.init_db(str(tmp_path / 'data.sqlite'))
+
+    with db_engine.connect() as connection:
+        assert connection.execute(
+            text("PRAGMA journal_mode")
+        ).scalar() == 'wal'
@@ -0,0 +1,70 @@
+import os
+
+import pytest
+
+from maxdoc.ast.ast import Node, NodeField, NodeType, load_ast
+from maxdoc.ast.dump import dump_ast_file
+from maxdoc.ast.markup import parse_markup_string
+from maxdoc.ast.table import NodeTable
+
+
+EXTENSIONS = {'json': '.json', 'yaml': '.mdoc', 'binary': '.mdast'}
+
+DOCUMENT = """\\document[title="Dumps \\"quoted\\" \u2028"]{
+    Some text, and \\strong{strong text}.
+
+    \\head[title="yes"]{
+        \\Book[id=b1] and \\env{HOME}.
+    }
+}
+"""
+
+
+def _transformed_document():
+    """A document as it is after transformation, wrapped in
+    compute_heading_levels."""
+    doc = parse_markup_string(DOCUMENT)
+    ast = Node({
+        NodeField.NODE_TYPE: NodeType.TRANSFORMATION,
+        NodeField.AST_TRANSFORMATION: 'compute_heading_levels',
+        NodeField.PARENT: None,
+        NodeField.CHILDREN: [doc],
+    })
+    doc[NodeField.PARENT] = ast
+    # fields of every type that dumps hold
+    doc['count'] = 3
+    doc['ratio'] = 0.5
+    doc['flags'] = [True, False, None]
+    return ast
+
+
+@pytest.mark.parametrize('fmt', sorted(EXTENSIONS))
+@pytest.mark.parametrize('compact', [False, True])
+def test_round_trip(tmp_path, fmt, compact):
+    ast = _transformed_document()
+    if compact:
+        ast = NodeTable.from_node(ast).root
+    fpath = os.path.join(str(tmp_path), 'dump' + EXTENSIONS[fmt])
+
+    dump_ast_file(ast, fpath, fmt)
+    loaded = load_ast(fpath, compact=compact)
+
+    # a dump of a whole document isn't wrapped in compute_heading_levels
+    # again
+    assert Node.to_ast_yaml(loaded) == Node.to_ast_yaml(ast)
+    child = list(loaded[NodeField.CHILDREN])[0]
+    assert child[NodeField.NODE_TYPE] == 'Document'
+    assert child[NodeField.PARENT] == loaded
+
+
+@pytest.mark.parametrize('fmt', sorted(EXTENSIONS))
+def test_untransformed_dump_is_wrapped(tmp_path, fmt):
+    ast = parse_markup_string(DOCUMENT)
+    fpath = os.path.join(str(tmp_path), 'dump' + EXTENSIONS[fmt])
+
+    dump_ast_file(ast, fpath, fmt)
+    loaded = load_ast(fpath)
+
+    assert loaded[NodeField.AST_TRANSFORMATION] == 'compute_heading_levels'
+    assert (Node.to_ast_yaml(loaded[NodeField.CHILDREN][0])
+            == Node.to_ast_yaml(ast))
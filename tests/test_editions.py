@@ -0,0 +1,52 @@
+import pytest
+
+from maxdoc import build as build_module
+from maxdoc.build import Build, edition_path
+from maxdoc.config import get_config
+from maxdoc.renderers.render_html_jinja2 import Jinja2HTMLRenderer
+from maxdoc.renderers.render_utf8 import UTF8Renderer
+
+from .building import TEMPLATES, build, read
+
+
+def _run_editions(n_workers):
+    config = get_config(['maxdoc', '--renderer', 'html,utf8', 'doc.mdm',
+                         'out.{renderer}'])
+    html, utf8 = Jinja2HTMLRenderer([TEMPLATES]), UTF8Renderer()
+    b = Build(config, None, html, None)
+    try:
+        return b.run_editions([
+            (html, edition_path(config.output_doc, 'html', html)),
+            (utf8, edition_path(config.output_doc, 'utf8', utf8)),
+        ], n_workers=n_workers)
+    finally:
+        config.in_fp.close()
+
+
+def _separate_builds():
+    build('doc.mdm', 'separate.html')
+    return read('separate.html')
+
+
+@pytest.mark.parametrize('n_workers', [1, 2])
+def test_editions_match_separate_builds(workdir, n_workers):
+    assert _run_editions(n_workers) == 0
+
+    assert read('out.html') == _separate_builds()
+    assert 'A part, about' in read('out.html')
+    assert read('out.utf8') == ''
+
+
+def test_editions_without_fork(workdir, monkeypatch):
+    monkeypatch.setattr(build_module, '_can_fork', lambda: False)
+
+    assert _run_editions(2) == 0
+
+    assert read('out.html') == _separate_builds()
+
+
+def test_edition_path():
+    utf8 = UTF8Renderer()
+
+    assert edition_path('out.{renderer}', 'utf8', utf8) == 'out.utf8'
+    assert edition_path('book.html', 'utf8', utf8) == 'book.txt'
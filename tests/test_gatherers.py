@@ -0,0 +1,56 @@
+import io
+
+import pytest
+import yaml
+
+from maxdoc.gatherers import generic
+from maxdoc.gatherers.generic import iter_yaml_rows
+
+
+LOADERS = [yaml.SafeLoader]
+if hasattr(yaml, 'CSafeLoader'):
+    LOADERS.append(yaml.CSafeLoader)
+
+
+DOCUMENTS = [
+    # plain rows
+    "- id: b1\n  title: A Book\n- id: b2\n  title: Another\n",
+    # scalar types, and explicit tags
+    "- {id: 1, float: 1.5, yes: true, none: ~, date: 2020-01-02}\n"
+    "- {id: !!str 2, title: !!str 3.0, quoted: '4'}\n",
+    # nesting, block and flow
+    "- id: x\n  tags: [a, b, {c: [d, e]}]\n  more:\n    - {f: g}\n    - - h\n",
+    # anchors, aliases and merge keys, across rows
+    "- &base {id: a, url: u}\n- <<: *base\n  id: b\n- id: c\n  same: *base\n"
+    "- &s scalar\n- *s\n",
+    # block scalars
+    "- id: t\n  body: |\n    line one\n    line two\n"
+    "  folded: >\n    x\n    y\n",
+    # empty rows and sequences
+    "- \n- []\n- {}\n- id: z\n",
+]
+
+
+@pytest.fixture(params=LOADERS, ids=lambda loader: loader.__name__)
+def loader(request, monkeypatch):
+    monkeypatch.setattr(generic, '_YAML_LOADER', request.param)
+    return request.param
+
+
+@pytest.mark.parametrize('text', DOCUMENTS)
+def test_rows_match_safe_load(loader, text):
+    assert list(iter_yaml_rows(io.StringIO(text))) == yaml.safe_load(text)
+
+
+def test_several_documents(loader):
+    text = "- a: 1\n- a: 2\n---\n- a: 3\n---\nnot: a sequence\n"
+
+    assert list(iter_yaml_rows(io.StringIO(text))) == [
+        row for doc in yaml.safe_load_all(text)
+        for row in (doc if isinstance(doc, list) else [doc])
+    ]
+
+
+def test_empty_stream(loader):
+    assert list(iter_yaml_rows(io.StringIO(""))) == []
+
@@ -0,0 +1,25 @@
+import pytest
+
+from maxdoc.ast.transforms import ASTError
+
+from .building import build, read, write
+
+
+def test_cyclic_include(workdir):
+    write('part.mdm', "\\include[path=doc.mdm]\n")
+
+    with pytest.raises(ASTError, match="Cyclic include"):
+        build('doc.mdm', 'out.html')
+
+
+def test_same_file_included_twice(workdir):
+    write('doc.mdm', "\\document{\\include[path=part.mdm]"
+                     "\\include[path=part.mdm]}\n")
+
+    b, rc = build('doc.mdm', 'out.html')
+
+    assert rc == 0
+    assert read('out.html').count('A part, about') == 2
+    # loaded once, and copied for the second inclusion
+    assert b.config.include_cache.misses == 1
+    assert b.config.include_cache.hits == 1
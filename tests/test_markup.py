@@ -0,0 +1,51 @@
+import io
+import os
+
+import pytest
+
+from maxdoc.ast.ast import Node, NodeField
+from maxdoc.ast.markup import CHUNK_SIZE, parse_markup, parse_markup_string
+
+
+EXAMPLES = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'examples'
+)
+
+CHUNK_SIZES = (1, 2, 3, 4, 5, 8, 9, 16, 1000, CHUNK_SIZE)
+
+
+def _parse_chunked(text, chunk_size):
+    ast = parse_markup(io.StringIO(text), chunk_size=chunk_size)
+    return Node.to_ast_yaml(ast)
+
+
+def _example():
+    with open(os.path.join(EXAMPLES, 'index.mdm')) as fp:
+        return fp.read()
+
+
+@pytest.mark.parametrize('chunk_size', CHUNK_SIZES)
+def test_chunked_example_parses_as_whole(chunk_size):
+    text = _example()
+    whole = Node.to_ast_yaml(parse_markup_string(text))
+    assert _parse_chunked(text, chunk_size) == whole
+
+
+@pytest.mark.parametrize('text', [
+    # a blank line split across chunks
+    'w' * (CHUNK_SIZE - 2) + '\n  \nsecond paragraph\n',
+    # trailing whitespace, stripped at the end of the line
+    'w' * (CHUNK_SIZE - 2) + '   \t \nnext line\n',
+    'first\n \t \n\t\n  second \\strong{ bold }  \n\n',
+])
+@pytest.mark.parametrize('chunk_size', CHUNK_SIZES)
+def test_whitespace_across_chunks(text, chunk_size):
+    whole = Node.to_ast_yaml(parse_markup_string(text))
+    assert _parse_chunked(text, chunk_size) == whole
+
+
+def test_blank_line_at_chunk_boundary_ends_paragraph():
+    text = 'w' * (CHUNK_SIZE - 2) + '\n  \nsecond paragraph\n'
+    whole = parse_markup_string(text)
+    assert len(whole[NodeField.CHILDREN]) == 2
+    assert _parse_chunked(text, CHUNK_SIZE) == Node.to_ast_yaml(whole)
@@ -0,0 +1,52 @@
+from maxdoc.ast.ast import Node, NodeField
+from maxdoc.renderers.memo import subtree_digests
+
+
+def _digest(ast_node):
+    return subtree_digests(ast_node, None, frozenset())[id(ast_node)][1]
+
+
+def _node(node_type, children=(), **fields):
+    node = Node({NodeField.NODE_TYPE: node_type,
+                 NodeField.CHILDREN: list(children)})
+    node.update(fields)
+    return node
+
+
+def test_equal_subtrees_hash_alike():
+    def tree():
+        return _node('Para', [_node('Text', body="Hello"),
+                              _node('Strong', [_node('Text', body="you")])])
+
+    assert _digest(tree()) is not None
+    assert _digest(tree()) == _digest(tree())
+
+
+def test_different_subtrees_hash_differently():
+    digests = {
+        _digest(_node('Text', body="a")),
+        _digest(_node('Text', body="b")),
+        _digest(_node('Emph', body="a")),
+        _digest(_node('Text', body=1)),
+        _digest(_node('Text', body=1.0)),
+        _digest(_node('Text', body=True)),
+        _digest(_node('Text', body=["a"])),
+        _digest(_node('Para', [_node('Text', body="a")])),
+    }
+    assert None not in digests
+    assert len(digests) == 8
+
+
+def test_nested_nodes_in_fields():
+    # fields holding nodes (mappings in AST yaml) are keyed by their whole
+    # content, however much of it a repr() would leave out
+    def tree(text):
+        nested = _node('Meta', [_node('Text', body=text)] * 3, label="x")
+        return _node('Figure', caption=nested)
+
+    assert _digest(tree("one")) != _digest(tree("two"))
+    assert _digest(tree("one")) == _digest(tree("one"))
+
+
+def test_unkeyable_fields_are_not_memoized():
+    assert _digest(_node('Text', body=object())) is None
@@ -0,0 +1,30 @@
+import pytest
+
+from maxdoc.merge import MergeError, output_name
+
+
+def test_output_name():
+    assert output_name('out/{id}.html', {'id': 'a1'}) == 'out/a1.html'
+    assert output_name('{id}.html', {'id': 'a1'}) == 'a1.html'
+    assert output_name('out/{n:03d}', {'n': 7}) == 'out/007'
+
+
+def test_separators_in_values_are_replaced():
+    assert (output_name('out/{id}.html', {'id': '../../etc/passwd'})
+            == 'out/.._.._etc_passwd.html')
+    assert output_name('out/{id}.html', {'id': '/abs'}) == 'out/_abs.html'
+
+
+@pytest.mark.parametrize('pattern, value', [
+    ('out/{id}/letter.html', '..'),
+    ('{id}/letter.html', '..'),
+    ('out/{id}', '.'),
+])
+def test_names_outside_the_pattern_dir_are_refused(pattern, value):
+    with pytest.raises(MergeError):
+        output_name(pattern, {'id': value})
+
+
+def test_missing_column():
+    with pytest.raises(MergeError):
+        output_name('out/{nope}.html', {'id': 'a1'})
@@ -0,0 +1,21 @@
+import inspect
+
+from maxdoc import db
+from maxdoc.model_names import MODEL_NAMES, get_model, is_model
+
+
+def test_model_names_match_db_models():
+    models = {
+        name for name, item in vars(db).items()
+        if inspect.isclass(item) and issubclass(item, db.Base)
+        and item is not db.Base
+    }
+    assert set(MODEL_NAMES) == models
+
+
+def test_get_model():
+    assert is_model('Book')
+    assert get_model('Book') is db.Book
+    assert not is_model('Head')
+    assert get_model('Head') is None
+    assert get_model(None) is None
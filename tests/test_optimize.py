@@ -0,0 +1,52 @@
+from maxdoc.ast.ast import Node, NodeField
+from maxdoc.ast.markup import parse_markup_string
+from maxdoc.ast.optimize import optimize_ast
+from maxdoc.renderers.base import RENDERS_BODY, Renderer
+
+
+class NullRenderer(Renderer):
+    """Renders nothing at all."""
+
+
+class TextRenderer(Renderer):
+    """Renders Text bodies, and anything else some other way."""
+
+    def _render_body(self, config, db_session, ast_node):
+        return ast_node.get('body')
+
+    def node_type_output(self, node_type):
+        return RENDERS_BODY if node_type == 'Text' else None
+
+
+def _node_types(ast_node):
+    types = []
+    stack = [ast_node]
+    while stack:
+        node = stack.pop()
+        types.append(node[NodeField.NODE_TYPE])
+        stack.extend(node[NodeField.CHILDREN])
+    return types
+
+
+def test_record_references_are_kept():
+    ast = parse_markup_string(
+        "\\document{Read \\Book[id=b1] by \\strong{\\Author[id=a1]}.}"
+    )
+    optimizer = optimize_ast([NullRenderer()], ast)
+
+    assert optimizer.removed
+    node_types = _node_types(ast)
+    assert 'Book' in node_types
+    assert 'Author' in node_types
+
+
+def test_adjacent_text_is_merged():
+    text = Node({NodeField.NODE_TYPE: 'Text', 'body': 'a'})
+    ast = Node({NodeField.NODE_TYPE: 'Paragraph', NodeField.CHILDREN: [
+        text, Node({NodeField.NODE_TYPE: 'Text', 'body': 'b'}),
+        Node({NodeField.NODE_TYPE: 'Text', 'body': ''}),
+    ]})
+    optimize_ast([TextRenderer()], ast)
+
+    assert _node_types(ast) == ['Paragraph', 'Text']
+    assert ast[NodeField.CHILDREN][0]['body'] == 'ab'
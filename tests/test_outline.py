@@ -0,0 +1,126 @@
+from maxdoc.ast.ast import NodeField
+from maxdoc.ast.markup import parse_markup_string
+from maxdoc.ast.outline import (HEADING_ANCHOR, HEADING_LEVEL, HEADING_NUMBER,
+                                Outline)
+from maxdoc.ast.table import NodeTable
+from maxdoc.ast.transforms import outline_subtree
+
+
+DOCUMENT = """\\document{
+    \\head[title="Introduction"]{
+        \\head[title="Scope"]
+        \\head[title="Scope"]{
+            \\head[title="Details"]
+        }
+    }
+    \\head[title="Usage & Examples!"]
+    \\head[title=""]
+}
+"""
+
+
+def _summary(outline):
+    return [(e.title, e.level, e.number, e.anchor, e.index, e.end)
+            for e in outline]
+
+
+def _find(ast_node, title):
+    stack = [ast_node]
+    while stack:
+        node = stack.pop()
+        if node.get('title') == title:
+            return node
+        stack.extend(node[NodeField.CHILDREN])
+
+
+def test_outline_of_document():
+    ast = parse_markup_string(DOCUMENT)
+    outline = outline_subtree(ast).outline
+
+    assert _summary(outline) == [
+        ("Introduction", 1, "1", "introduction", 0, 4),
+        ("Scope", 2, "1.1", "scope", 1, 2),
+        ("Scope", 2, "1.2", "scope-2", 2, 4),
+        ("Details", 3, "1.2.1", "details", 3, 4),
+        ("Usage & Examples!", 1, "2", "usage-examples", 4, 5),
+        ("", 1, "3", "section", 5, 6),
+    ]
+
+    details = _find(ast, "Details")
+    assert details[HEADING_LEVEL] == 3
+    assert details[HEADING_ANCHOR] == "details"
+    assert details[HEADING_NUMBER] == "1.2.1"
+
+    assert outline.find("scope-2").number == "1.2"
+    assert outline.find("missing") is None
+
+
+def test_outline_of_compact_document():
+    ast = parse_markup_string(DOCUMENT)
+    compact = NodeTable.from_node(ast).root
+
+    assert (_summary(outline_subtree(compact).outline)
+            == _summary(outline_subtree(ast).outline))
+
+
+def test_node_counts():
+    ast = parse_markup_string(DOCUMENT)
+    outline = outline_subtree(ast).outline
+
+    def count(node):
+        return 1 + sum(count(c) for c in node[NodeField.CHILDREN])
+
+    for entry in outline:
+        assert entry.node_count == count(entry.node)
+
+
+def test_toc_and_subsections():
+    outline = outline_subtree(parse_markup_string(DOCUMENT)).outline
+    introduction = outline.find("introduction")
+
+    assert [e.title for e in outline.subsections(introduction)] == [
+        "Scope", "Scope", "Details"
+    ]
+    assert [e.number for e in outline.toc(max_level=1)] == ["1", "2", "3"]
+    assert [e.number for e in outline.toc(max_level=2, within=introduction)] \
+        == ["1.1", "1.2"]
+
+
+def test_anchors_of_duplicate_titles():
+    outline = Outline()
+    anchors = [
+        outline.add({'title': title}, 1).anchor
+        for title in ["A", "A", "A-2", "A", "a"]
+    ]
+    assert anchors == ["a", "a-2", "a-2-2", "a-3", "a-4"]
+    assert len(set(anchors)) == len(anchors)
+
+
+def test_cut():
+    ast = parse_markup_string(DOCUMENT)
+    outline = outline_subtree(ast).outline
+    introduction = outline.find("introduction")
+    count = introduction.node_count
+    cut = outline.find("scope")
+
+    outline.cut([cut])
+
+    assert _summary(outline) == [
+        ("Introduction", 1, "1", "introduction", 0, 3),
+        ("Scope", 2, "1.1", "scope", 1, 3),
+        ("Details", 3, "1.1.1", "details", 2, 3),
+        ("Usage & Examples!", 1, "2", "usage-examples", 3, 4),
+        ("", 1, "3", "section", 4, 5),
+    ]
+    assert introduction.node_count == count - cut.node_count
+    assert outline.find("scope-2") is None
+
+
+def test_cut_takes_subsections_too():
+    outline = outline_subtree(parse_markup_string(DOCUMENT)).outline
+
+    outline.cut([outline.find("introduction")])
+
+    assert [(e.title, e.number, e.end) for e in outline] == [
+        ("Usage & Examples!", "1", 1), ("", "2", 2)
+    ]
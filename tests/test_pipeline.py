@@ -0,0 +1,114 @@
+import asyncio
+import threading
+import time
+import types
+
+import pytest
+
+from maxdoc import db
+from maxdoc.build import Build
+from maxdoc.config import get_config
+from maxdoc.data import DataGatherError, gather_all_async
+from maxdoc.pipeline import load_concurrently
+from maxdoc.renderers.render_html_jinja2 import Jinja2HTMLRenderer
+
+from .building import PART, TEMPLATES, build, read, write
+from .test_data import BooksGatherer, FailingGatherer
+
+
+def _wait_for_threads(threads):
+    deadline = time.monotonic() + 5
+    while threading.active_count() > threads and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return threading.active_count()
+
+
+def _pipelined_build(n_workers):
+    """Returns (the Build, its exit status) of building doc.mdm to
+    pipelined.html, loading it and its data concurrently."""
+    config = get_config(['maxdoc', 'doc.mdm', 'pipelined.html'])
+    b = Build(config, None, Jinja2HTMLRenderer([TEMPLATES]), None)
+    try:
+        rc = b.run(load_concurrently(b, n_workers))
+    finally:
+        config.in_fp.close()
+        config.out_fp.close()
+    return b, rc
+
+
+@pytest.mark.parametrize('n_workers', [1, 2])
+def test_pipeline_matches_plain_build(workdir, n_workers):
+    write('part.mdm', PART + "\\include[path=nested.mdm]\n")
+    write('nested.mdm', "Nested, by \\Author[id=a1].\n")
+
+    b, rc = _pipelined_build(n_workers)
+    build('doc.mdm', 'plain.html')
+
+    assert rc == 0
+    assert read('pipelined.html') == read('plain.html')
+    assert 'Nested, by' in read('pipelined.html')
+    # both includes were loaded ahead of transformation
+    assert b.config.include_cache.primed == 2
+    assert b.config.include_cache.misses == 0
+
+
+def test_pipeline_leaves_missing_includes_to_transformation(workdir):
+    write('part.mdm', "\\include[path=missing.mdm]\n")
+
+    with pytest.raises(FileNotFoundError):
+        _pipelined_build(1)
+
+
+def test_gather_all_async():
+    _, DBSession = db.init_db()
+    session = DBSession()
+
+    class SomeBooks(BooksGatherer):
+        def iter_batches(self, config):
+            for i, batch in enumerate(super().iter_batches(config)):
+                if i == 40:
+                    break
+                yield batch
+
+    asyncio.run(gather_all_async([SomeBooks()], types.SimpleNamespace(),
+                                 session))
+
+    assert session.query(db.Book).count() == 40
+
+
+def test_gather_all_async_failure_stops_producers():
+    _, DBSession = db.init_db()
+    threads = threading.active_count()
+
+    with pytest.raises(DataGatherError, match="unreadable"):
+        asyncio.run(gather_all_async(
+            [BooksGatherer(), FailingGatherer()], types.SimpleNamespace(),
+            DBSession()
+        ))
+
+    assert _wait_for_threads(threads) == threads
+
+
+def test_cancelling_gather_all_async_stops_producers():
+    _, DBSession = db.init_db()
+    threads = threading.active_count()
+
+    class SlowBooks(BooksGatherer):
+        def iter_batches(self, config):
+            for batch in super().iter_batches(config):
+                time.sleep(0.01)
+                yield batch
+
+    async def gather_then_cancel():
+        task = asyncio.ensure_future(gather_all_async(
+            [SlowBooks()], types.SimpleNamespace(), DBSession()
+        ))
+        await asyncio.sleep(0.2)
+        task.cancel()
+        await task
+
+    with pytest.raises(asyncio.CancelledError):
+        asyncio.run(gather_then_cancel())
+
+    # (asyncio.run() waits for the executor's threads to finish)
+    assert _wait_for_threads(threads) == threads
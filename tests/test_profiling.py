@@ -0,0 +1,94 @@
+import json
+import sys
+import types
+
+from maxdoc.profiling import Profiler, stage, timed
+
+from .building import build
+
+
+def test_stages_accumulate():
+    profiler = Profiler()
+    events = []
+    profiler.subscribe(events.append)
+
+    for _ in range(2):
+        with profiler.stage('load'):
+            sum(range(1000))
+    with profiler.stage('render'):
+        pass
+
+    assert list(profiler.stages) == ['load', 'render']
+    load = profiler.stages['load']
+    assert load['wall'] == sum(e.wall for e in events if e.key == 'load')
+    assert load['cpu'] >= 0
+
+    assert [(e.kind, e.key) for e in events] == [
+        (Profiler.STAGE, 'load'), (Profiler.STAGE, 'load'),
+        (Profiler.STAGE, 'render'),
+    ]
+    assert profiler.totals[Profiler.STAGE]['load'].count == 2
+
+
+def test_totals_per_key():
+    profiler = Profiler()
+    profiler.record(Profiler.TEMPLATE, ('Book', 'post'), 0.5)
+    profiler.record(Profiler.TEMPLATE, ('Book', 'post'), 0.25)
+    profiler.record(Profiler.TEMPLATE, ('Para', 'pre'), 1.0)
+    profiler.record('custom', 'thing', 2.0)
+
+    book = profiler.totals[Profiler.TEMPLATE][('Book', 'post')]
+    assert (book.count, book.wall, book.max_wall) == (2, 0.75, 0.5)
+
+    report = json.loads(json.dumps(profiler.report()))
+    # slowest first, with template keys as in their file names
+    assert list(report[Profiler.TEMPLATE]) == ['Para_pre', 'Book_post']
+    assert report['custom'] == {
+        'thing': {'count': 1, 'wall': 2.0, 'max_wall': 2.0}
+    }
+
+    summary = profiler.summary(top=1)
+    assert 'Para_pre' in summary
+    assert 'Book_post' not in summary
+    assert '(1 more)' in summary
+
+
+def test_unsubscribe():
+    profiler = Profiler()
+    events = []
+    profiler.subscribe(events.append)
+    profiler.unsubscribe(events.append)
+
+    with profiler.timed(Profiler.INCLUDE, 'part.mdm'):
+        pass
+
+    assert events == []
+    assert profiler.totals[Profiler.INCLUDE]['part.mdm'].count == 1
+
+
+def test_without_profiler():
+    config = types.SimpleNamespace(profiler=None)
+
+    with stage(config, 'load'), timed(config, Profiler.INCLUDE, 'x'):
+        pass
+
+
+def test_profiled_build(workdir):
+    b, rc = build('doc.mdm', 'out.html',
+                  options=['--profile', 'profile.json'])
+    profiler = b.config.profiler
+
+    assert rc == 0
+    for name in ('gather', 'load', 'transform', 'prefetch', 'render'):
+        assert name in profiler.stages
+    assert 'include_ast' in profiler.totals[Profiler.TRANSFORM]
+    assert any(key.endswith('part.mdm')
+               for key in profiler.totals[Profiler.INCLUDE])
+    assert profiler.totals[Profiler.TEMPLATE]
+
+
+def test_report_without_resource(monkeypatch):
+    # as on Windows
+    monkeypatch.setitem(sys.modules, 'resource', None)
+
+    assert Profiler().report()['max_rss'] is None
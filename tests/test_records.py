@@ -0,0 +1,67 @@
+import logging
+
+import pytest
+
+from maxdoc import db
+from maxdoc.ast.markup import parse_markup_string
+from maxdoc.renderers.records import RecordMap
+
+from .building import build, write
+
+
+@pytest.fixture
+def db_session():
+    _, DBSession = db.init_db()
+    session = DBSession()
+    session.add_all([
+        db.Book(id='9780131103627', title="The C Programming Language"),
+        db.Book(id='b1', title="A Book"),
+        db.Author(id='a1', pen_name="An Author"),
+    ])
+    session.flush()
+    return session
+
+
+def test_prefetch(db_session):
+    ast = parse_markup_string(
+        "\\Book[id=b1] by \\Author[id=a1], and \\Book[id=b1] again"
+    )
+    records = RecordMap()
+
+    assert records.prefetch(db_session, ast) == []
+    assert records.get(db.Book, 'b1').title == "A Book"
+    assert records.get(db.Author, 'a1').pen_name == "An Author"
+    assert records.get(db.Author, 'b1') is None
+
+
+def test_numeric_ids(db_session):
+    # (markup loads ids that look like numbers as ints)
+    ast = parse_markup_string("\\Book[id=9780131103627] and \\Book[id=b1]")
+    records = RecordMap()
+
+    assert records.prefetch(db_session, ast) == []
+    record = records.get(db.Book, 9780131103627)
+    assert record.title == "The C Programming Language"
+    assert records.get(db.Book, '9780131103627') is record
+
+
+def test_missing_records(db_session):
+    ast = parse_markup_string(
+        "\\Book[id=nope], \\Book[id=42], \\Book[id=b1] and \\Author[id=a2]"
+    )
+    missing = RecordMap().prefetch(db_session, ast)
+
+    assert sorted((model.__name__, id_) for model, id_ in missing) == [
+        ('Author', 'a2'), ('Book', '42'), ('Book', 'nope'),
+    ]
+
+
+def test_missing_records_are_reported(workdir, caplog):
+    write('part.mdm', "\\Book[id=b2] and \\Author[id=a2]\n")
+
+    with caplog.at_level(logging.ERROR):
+        _, rc = build('doc.mdm', 'out.html')
+
+    assert rc == 20
+    assert "Book(id='b2')" in caplog.text
+    assert "Author(id='a2')" in caplog.text
@@ -0,0 +1,107 @@
+import types
+
+import jinja2
+import pytest
+
+from maxdoc import db
+from maxdoc.ast.ast import Node, NodeField
+from maxdoc.renderers.exceptions import RenderError
+from maxdoc.renderers.render_html_jinja2 import Jinja2HTMLRenderer
+from maxdoc.renderers.render_utf8 import UTF8Renderer
+
+
+def test_missing_record_raises_render_error():
+    _, DBSession = db.init_db()
+    config = types.SimpleNamespace(db_records=None, profiler=None)
+    node = Node({NodeField.NODE_TYPE: 'Book', 'id': 'nope'})
+
+    with pytest.raises(RenderError, match=r"Book\(id='nope'\)"):
+        UTF8Renderer()._get_ast_db_node(config, DBSession(), node)
+
+
+def _templates(tmp_path, templates):
+    dpath = tmp_path / 'templates'
+    dpath.mkdir()
+    for name, source in templates.items():
+        (dpath / name).write_text(source)
+    return str(dpath)
+
+
+def _render_config(**kwargs):
+    kwargs.setdefault('no_template_cache', False)
+    return types.SimpleNamespace(profiler=None, merge_row=None, **kwargs)
+
+
+def _render_pre(renderer, config):
+    node = Node({NodeField.NODE_TYPE: 'Para'})
+    return renderer._render_template(config, None, node, 'pre')
+
+
+def test_template_cache_dir(tmp_path):
+    templates = _templates(tmp_path, {'Para_pre.html.jinja2': '<p>'})
+    cache_dir = tmp_path / 'cache'
+    renderer = Jinja2HTMLRenderer([templates])
+    config = _render_config(template_cache_dir=str(cache_dir))
+
+    renderer.configure(config)
+    assert _render_pre(renderer, config) == '<p>'
+    assert list(cache_dir.iterdir())
+
+
+def test_no_template_cache(tmp_path):
+    templates = _templates(tmp_path, {'Para_pre.html.jinja2': '<p>'})
+    cache_dir = tmp_path / 'cache'
+    renderer = Jinja2HTMLRenderer([templates],
+                                  bytecode_cache_dir=str(cache_dir))
+    config = _render_config(template_cache_dir=str(cache_dir),
+                            no_template_cache=True)
+
+    renderer.configure(config)
+    assert _render_pre(renderer, config) == '<p>'
+    assert not cache_dir.exists()
+
+
+@pytest.mark.parametrize('cache_dir', ['file', 'file/below'])
+def test_unusable_template_cache_dir(tmp_path, caplog, cache_dir):
+    templates = _templates(tmp_path, {'Para_pre.html.jinja2': '<p>'})
+    # a file where the directory should be, or above it
+    (tmp_path / 'file').write_text('')
+    renderer = Jinja2HTMLRenderer([templates])
+    config = _render_config(template_cache_dir=str(tmp_path / cache_dir))
+
+    renderer.configure(config)
+    assert _render_pre(renderer, config) == '<p>'
+    assert "Not caching compiled templates" in caplog.text
+
+
+def test_template_cache_write_failure(tmp_path, caplog, monkeypatch):
+    def dump_bytecode(self, bucket):
+        raise PermissionError("read-only")
+
+    monkeypatch.setattr(jinja2.FileSystemBytecodeCache, 'dump_bytecode',
+                        dump_bytecode)
+    templates = _templates(tmp_path, {'Para_pre.html.jinja2': '<p>'})
+    renderer = Jinja2HTMLRenderer([templates])
+    config = _render_config(template_cache_dir=str(tmp_path / 'cache'))
+
+    renderer.configure(config)
+    assert _render_pre(renderer, config) == '<p>'
+    assert "read-only" in caplog.text
+
+
+def test_context_of_referenced_templates(tmp_path):
+    templates = _templates(tmp_path, {
+        'Para_pre.html.jinja2': '{% include "row.jinja2" %}',
+        'Head_pre.html.jinja2': '{% extends "base.jinja2" %}',
+        'Text_body.html.jinja2': '{% include ast_node.partial %}',
+        'Emph_pre.html.jinja2': '{% include "plain.jinja2" %}',
+        'row.jinja2': '{% include "nested.jinja2" %}',
+        'nested.jinja2': '{{ row.name }}',
+        'base.jinja2': '{{ config.heading_level }}',
+        'plain.jinja2': '<em>',
+    })
+    renderer = Jinja2HTMLRenderer([templates], bytecode_cache_dir=None)
+    renderer.configure(_render_config(template_cache_dir=None))
+
+    assert renderer.merge_node_types() == {'Para', 'Text'}
+    assert renderer.context_node_types() == {'Para', 'Head', 'Text'}
@@ -0,0 +1,133 @@
+import io
+import sys
+import types
+
+from maxdoc.ast.ast import Node, NodeField
+from maxdoc.renderers.base import Renderer
+from maxdoc.renderers.sinks import BufferedSink, StringSink, write_chunks
+
+
+class RecordingFile:
+    def __init__(self):
+        self.writes = []
+        self.flushes = 0
+
+    def write(self, block):
+        self.writes.append(block)
+
+    def flush(self):
+        self.flushes += 1
+
+
+def test_writes_in_blocks():
+    fp = RecordingFile()
+    sink = BufferedSink(fp, block_size=10)
+
+    for chunk in ['abcd', 'efgh', 'ijkl', 'mn']:
+        sink.write(chunk)
+    assert fp.writes == ['abcdefghijkl']
+
+    sink.flush()
+    assert fp.writes == ['abcdefghijkl', 'mn']
+    assert fp.flushes == 1
+
+    # nothing pending: just passes the flush on
+    sink.flush()
+    assert len(fp.writes) == 2
+    assert fp.flushes == 2
+
+
+def test_encoding():
+    fp = io.BytesIO()
+    with BufferedSink(fp, encoding='utf-8') as sink:
+        sink.write('café ')
+        sink.write('✓')
+
+    assert fp.getvalue() == 'café ✓'.encode('utf-8')
+
+
+def test_file_without_flush():
+    class Writer:
+        def __init__(self):
+            self.blocks = []
+
+        def write(self, block):
+            self.blocks.append(block)
+
+    fp = Writer()
+    with BufferedSink(fp) as sink:
+        sink.write('text')
+
+    assert fp.blocks == ['text']
+
+
+def test_string_sink():
+    sink = StringSink(block_size=4)
+    sink.write('ab')
+    sink.write('cdef')
+    sink.write('g')
+
+    assert sink.getvalue() == 'abcdefg'
+
+
+def test_write_chunks():
+    fp = RecordingFile()
+    chunks = (str(i) for i in range(5))
+
+    write_chunks(chunks, BufferedSink(fp))
+
+    assert fp.writes == ['01234']
+    assert fp.flushes == 1
+
+
+class TagRenderer(Renderer):
+    def _pre_render(self, config, db_session, ast_node):
+        return "<{}>".format(ast_node[NodeField.NODE_TYPE])
+
+    def _render_body(self, config, db_session, ast_node):
+        return ast_node.get('body')
+
+    def _post_render(self, config, db_session, ast_node):
+        return "</{}>".format(ast_node[NodeField.NODE_TYPE])
+
+
+def _node(node_type, *children, **fields):
+    fields[NodeField.NODE_TYPE] = node_type
+    fields[NodeField.CHILDREN] = list(children)
+    return Node(fields)
+
+
+def test_render_chunks():
+    ast = _node('P', _node('B', body='x'), _node('I', _node('U')))
+
+    chunks = TagRenderer().render_chunks(None, None, ast)
+
+    assert list(chunks) == [
+        '<P>', '<B>', 'x', '</B>', '<I>', '<U>', '</U>', '</I>', '</P>'
+    ]
+
+
+def test_render_chunks_with_holes():
+    hole = _node('I', _node('U'))
+    ast = _node('P', _node('B'), hole)
+
+    chunks = TagRenderer().render_chunks(
+        None, None, ast, holes=lambda n: n[NodeField.NODE_TYPE] == 'I'
+    )
+
+    assert list(chunks) == ['<P>', '<B>', '</B>', hole, '</P>']
+
+
+def test_render_deep_tree_to_sink():
+    depth = sys.getrecursionlimit() * 2
+    ast = node = _node('D')
+    for _ in range(depth - 1):
+        child = _node('D')
+        node[NodeField.CHILDREN].append(child)
+        node = child
+
+    config = types.SimpleNamespace(render_cache=None)
+    sink = StringSink(block_size=100)
+    TagRenderer().render(config, None, ast, sink=sink)
+
+    assert sink.getvalue() == '<D>' * depth + '</D>' * depth
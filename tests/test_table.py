@@ -0,0 +1,198 @@
+import pytest
+
+from maxdoc.ast.ast import Node, NodeField, NodeType
+from maxdoc.ast.exceptions import ASTError
+from maxdoc.ast.table import NO_NODE, NodeTable, NodeView
+
+
+YAML_DOC = {
+    'NODE_TYPE': 'AST_TRANSFORMATION',
+    'TRANSFORMATION': 'compute_heading_levels',
+    'CHILDREN': [
+        {'NODE_TYPE': 'Para', 'CHILDREN': [
+            {'NODE_TYPE': 'Text', 'body': 'one'},
+            {'NODE_TYPE': 'Text', 'body': 'two'},
+        ]},
+        {'NODE_TYPE': 'Book', 'id': 'b1'},
+    ],
+}
+
+
+def _types(children):
+    return [c[NodeField.NODE_TYPE] for c in children]
+
+
+def _table():
+    """A table holding Para(Text 'a', Text 'b', Text 'c')."""
+    table = NodeTable()
+    para = table.add_node('Para')
+    for body in 'abc':
+        table.add_node('Text', [('body', body)], parent=para)
+    return table
+
+
+def test_add_node_appends_children_in_order():
+    table = _table()
+    para = table.root
+
+    assert len(table) == 4
+    assert para[NodeField.NODE_TYPE] == 'Para'
+    assert para[NodeField.PARENT] is None
+    assert [c.body for c in para[NodeField.CHILDREN]] == ['a', 'b', 'c']
+    assert all(c[NodeField.PARENT] is para
+               for c in para[NodeField.CHILDREN])
+    assert list(table.iter_subtree()) == [0, 1, 2, 3]
+
+
+def test_views_are_shared():
+    table = _table()
+    first = table.root[NodeField.CHILDREN][0]
+
+    assert table.view(1) is first
+    assert first == NodeView(table, 1)
+    assert first != table.view(2)
+
+
+def test_interning():
+    table = NodeTable()
+    para = table.add_node('Para')
+    a = table.add_node('Text', [('body', ''.join(['sa', 'me']))], parent=para)
+    b = table.add_node('Text', [('body', ''.join(['s', 'ame']))], parent=para)
+
+    # one type entry per distinct type, and one copy of each string
+    assert table._types == ['Para', 'Text']
+    assert table.view(a).body is table.view(b).body
+
+
+def test_fields():
+    table = _table()
+    text = table.view(1)
+
+    text['style'] = 'bold'
+    assert 'style' in text
+    assert text.get('style') == 'bold'
+    assert text.style == 'bold'
+
+    del text['style']
+    assert 'style' not in text
+    assert text.get('style') is None
+    with pytest.raises(KeyError):
+        text['style']
+    with pytest.raises(ASTError):
+        del text[NodeField.CHILDREN]
+
+
+def test_child_list():
+    table = _table()
+    children = table.root[NodeField.CHILDREN]
+    a, b, c = list(children)
+
+    assert len(children) == 3
+    assert children[1] is b
+    assert children[-1] is c
+    assert children[1:] == [b, c]
+    assert children.index(c) == 2
+
+    children.remove(b)
+    assert list(children) == [a, c]
+    assert b[NodeField.PARENT] is None
+    with pytest.raises(ValueError):
+        children.index(b)
+
+    children.insert(1, b)
+    assert list(children) == [a, b, c]
+
+    children.append(Node({NodeField.NODE_TYPE: 'Text', 'body': 'd'}))
+    assert [x.body for x in children] == ['a', 'b', 'c', 'd']
+
+    assert children.retain(lambda x: x.body != 'a') == [b, c, children[2]]
+    assert [x.body for x in children] == ['b', 'c', 'd']
+    assert table.parent(a._idx) == NO_NODE
+
+
+def test_replace_child():
+    table = _table()
+    para = table.root
+    b = para[NodeField.CHILDREN][1]
+
+    new = para._replace_child(
+        b, Node({NodeField.NODE_TYPE: 'Emph', 'body': 'B'})
+    )
+
+    assert _types(para[NodeField.CHILDREN]) == ['Text', 'Emph', 'Text']
+    assert para[NodeField.CHILDREN][1] is new
+    assert b[NodeField.PARENT] is None
+
+
+def test_from_ast_yaml():
+    table = NodeTable.from_ast_yaml(YAML_DOC)
+    root = table.root
+
+    assert root[NodeField.NODE_TYPE] is NodeType.TRANSFORMATION
+    assert root[NodeField.AST_TRANSFORMATION] == 'compute_heading_levels'
+    assert _types(root[NodeField.CHILDREN]) == ['Para', 'Book']
+
+    para, book = root[NodeField.CHILDREN]
+    assert [t.body for t in para[NodeField.CHILDREN]] == ['one', 'two']
+    assert book.id == 'b1'
+    assert book[NodeField.PARENT] is root
+
+
+def test_from_ast_yaml_matches_node():
+    table = NodeTable.from_ast_yaml(YAML_DOC)
+    node = Node.from_ast_yaml(YAML_DOC)
+
+    assert NodeTable.from_node(node).to_bytes() == table.to_bytes()
+    assert (NodeTable.from_node(table.root.to_node()).to_bytes()
+            == table.to_bytes())
+
+
+def test_from_ast_yaml_rejects_non_nodes():
+    with pytest.raises(ASTError):
+        NodeTable.from_ast_yaml(['not', 'a', 'node'])
+
+
+def test_bytes_round_trip():
+    table = NodeTable.from_ast_yaml(YAML_DOC)
+    loaded = NodeTable.from_bytes(table.to_bytes())
+
+    assert loaded.to_bytes() == table.to_bytes()
+    assert loaded.root[NodeField.CHILDREN][1].id == 'b1'
+    with pytest.raises(ValueError):
+        NodeTable.from_bytes(b'not a table')
+
+
+def test_set_children_moves_only_the_nodes_given():
+    table = NodeTable()
+    root = table.add_node('Root')
+    target = table.add_node('Para', parent=root)
+    source = table.add_node('Para', parent=root)
+    for body in 'abc':
+        table.add_node('Text', [('body', body)], parent=source)
+    target, source = table.view(target), table.view(source)
+    a, b, c = list(source[NodeField.CHILDREN])
+
+    target._set_children([b, Node({NodeField.NODE_TYPE: 'Text',
+                                   'body': 'new'})])
+
+    assert [x.body for x in target[NodeField.CHILDREN]] == ['b', 'new']
+    assert b[NodeField.PARENT] is target
+    # the rest of b's old siblings stay where they were
+    assert list(source[NodeField.CHILDREN]) == [a, c]
+    assert a[NodeField.PARENT] is source
+
+
+def test_child_list_tracks_changes():
+    table = _table()
+    children = table.root[NodeField.CHILDREN]
+    a, b, c = list(children)
+    assert len(children) == 3
+
+    # changed through another view of the same children
+    table.root[NodeField.CHILDREN].remove(b)
+    assert len(children) == 2
+    assert children[1] is c
+
+    table.unlink(a._idx)
+    assert list(children) == [c]
+    assert children[0] is c
@@ -0,0 +1,123 @@
+import types
+
+import pytest
+
+from maxdoc.ast.ast import Node, NodeField, NodeType
+from maxdoc.ast.markup import parse_markup_string
+from maxdoc.ast.outline import HEADING_NUMBER
+from maxdoc.ast.table import NodeTable
+from maxdoc.ast.transforms import PRUNED, TransformScheduler
+
+
+NESTED_PRUNE = """\\document{
+    \\prune[max_level=1]{
+        \\head[title="Kept"]{
+            \\head[title="Cut"]{
+                \\prune[max_level=1]{
+                    \\head[title="Inner"]{
+                        \\head[title="Innermost"]
+                    }
+                }
+            }
+        }
+    }
+}
+"""
+
+
+def _config():
+    return types.SimpleNamespace(profiler=None, dump_ast_walk=False,
+                                 outline=None)
+
+
+def _document(markup):
+    """Parses markup, wrapped in compute_heading_levels as top level
+    documents are."""
+    ast = parse_markup_string(markup)
+    wrapper = Node({
+        NodeField.NODE_TYPE: NodeType.TRANSFORMATION,
+        NodeField.AST_TRANSFORMATION: 'compute_heading_levels',
+        NodeField.CHILDREN: [ast],
+    })
+    ast[NodeField.PARENT] = wrapper
+    return wrapper
+
+
+def _find(ast_node, title):
+    stack = [ast_node]
+    while stack:
+        node = stack.pop()
+        if node.get('title') == title:
+            return node
+        stack.extend(node[NodeField.CHILDREN])
+
+
+def _titles(ast_node):
+    titles = []
+    stack = [ast_node]
+    while stack:
+        node = stack.pop()
+        if 'title' in node:
+            titles.append(node['title'])
+        stack.extend(node[NodeField.CHILDREN])
+    return sorted(titles)
+
+
+@pytest.mark.parametrize('compact', [False, True])
+def test_nested_prune_region_in_cut_heading(compact):
+    ast = _document(NESTED_PRUNE)
+    if compact:
+        ast = NodeTable.from_node(ast).root
+
+    cut = _find(ast, "Cut")
+    inner_region = cut[NodeField.CHILDREN][0]
+
+    config = _config()
+    scheduler = TransformScheduler()
+    scheduler.schedule(ast)
+    scheduler.run(config, None)
+
+    assert _titles(ast) == ["Kept"]
+    # the cut heading is detached, rather than pointing back into the tree
+    assert cut.get(NodeField.PARENT) is None
+    # and the region in it is never applied to the detached subtree
+    assert scheduler.applied == 3
+    assert PRUNED not in inner_region
+    assert _titles(cut) == ["Cut", "Inner", "Innermost"]
+    # pruning takes the cut headings out of the outline
+    assert [e.title for e in config.outline] == ["Kept"]
+
+
+def test_prune_region_is_applied_once():
+    ast = _document(
+        "\\prune[max_level=1]{\\head[title=A]{\\prune[max_level=2]{"
+        "\\head[title=B]{\\head[title=C]}}}}"
+    )
+    inner_region = _find(ast, "A")[NodeField.CHILDREN][0]
+
+    scheduler = TransformScheduler()
+    scheduler.schedule(ast)
+    scheduler.run(_config(), None)
+
+    assert _titles(ast) == ["A"]
+    # the inner region is pruned as part of the outer one
+    assert PRUNED in inner_region
+
+
+def test_pruning_renumbers_the_outline():
+    ast = _document(
+        "\\head[title=A]{\\prune[max_level=0]{\\head[title=B]}}"
+        "\\head[title=C]{\\head[title=D]}"
+    )
+    d = _find(ast, "D")
+
+    config = _config()
+    scheduler = TransformScheduler()
+    scheduler.schedule(ast)
+    scheduler.run(config, None)
+
+    assert _titles(ast) == ["A", "C", "D"]
+    assert [(e.title, e.number, e.end) for e in config.outline] == [
+        ("A", "1", 1), ("C", "2", 3), ("D", "2.1", 3)
+    ]
+    assert d[HEADING_NUMBER] == "2.1"
@@ -0,0 +1,106 @@
+import sys
+
+import pytest
+
+from maxdoc.ast.ast import ASTVisitor, ASTWalker, Node, NodeField
+from maxdoc.ast.table import NodeTable
+
+
+class Recorder(ASTVisitor):
+    def __init__(self):
+        self.events = []
+
+    def pre_visit(self, ast_node, parents, context):
+        self.events.append(('pre', ast_node['name'],
+                            [p['name'] for p in parents]))
+
+    def post_visit(self, ast_node, parents, context):
+        self.events.append(('post', ast_node['name'],
+                            [p['name'] for p in parents]))
+
+
+def _node(name, *children):
+    node = Node({NodeField.NODE_TYPE: 'Para', 'name': name,
+                 NodeField.CHILDREN: list(children)})
+    for child in children:
+        child[NodeField.PARENT] = node
+    return node
+
+
+def _chain(depth):
+    """A tree of depth nodes, each the only child of the one before."""
+    root = node = _node(0)
+    for i in range(1, depth):
+        child = _node(i)
+        child[NodeField.PARENT] = node
+        node[NodeField.CHILDREN].append(child)
+        node = child
+    return root
+
+
+@pytest.mark.parametrize('compact', [False, True])
+def test_visit_order_and_parents(compact):
+    ast = _node('a', _node('b', _node('c')), _node('d'))
+    if compact:
+        ast = NodeTable.from_node(ast).root
+
+    visitor = Recorder()
+    ASTWalker().walk(visitor, ast)
+
+    assert visitor.events == [
+        ('pre', 'a', []),
+        ('pre', 'b', ['a']),
+        ('pre', 'c', ['a', 'b']),
+        ('post', 'c', ['a', 'b']),
+        ('post', 'b', ['a']),
+        ('pre', 'd', ['a']),
+        ('post', 'd', ['a']),
+        ('post', 'a', []),
+    ]
+
+
+def test_removing_the_child_being_visited():
+    class Remover(Recorder):
+        def post_visit(self, ast_node, parents, context):
+            super().post_visit(ast_node, parents, context)
+            if ast_node['name'] == 'b':
+                parents[-1][NodeField.CHILDREN].remove(ast_node)
+
+    ast = _node('a', _node('b'), _node('c'))
+    visitor = Remover()
+    ASTWalker().walk(visitor, ast)
+
+    assert [name for event, name, _ in visitor.events if event == 'pre'] \
+        == ['a', 'b', 'c']
+    assert [c['name'] for c in ast[NodeField.CHILDREN]] == ['c']
+
+
+def test_context_is_shared():
+    class Counter(ASTVisitor):
+        def pre_visit(self, ast_node, parents, context):
+            context['count'] = context.get('count', 0) + 1
+
+    context = {}
+    ASTWalker().walk(Counter(), _node('a', _node('b'), _node('c')),
+                     context=context)
+
+    assert context['count'] == 3
+
+
+@pytest.mark.parametrize('compact', [False, True])
+def test_deep_tree(compact):
+    depth = sys.getrecursionlimit() * 3
+    ast = _chain(depth)
+    if compact:
+        ast = NodeTable.from_node(ast).root
+
+    class Depth(ASTVisitor):
+        deepest = 0
+
+        def pre_visit(self, ast_node, parents, context):
+            self.deepest = max(self.deepest, len(parents))
+
+    visitor = Depth()
+    ASTWalker().walk(visitor, ast)
+
+    assert visitor.deepest == depth - 1
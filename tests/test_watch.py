@@ -0,0 +1,47 @@
+import os
+
+from .building import BOOKS, DOCUMENT, PART, build, read, write
+
+
+def _update(b, snapshot):
+    deps = b.config.deps
+    changes, current = deps.changes_since(snapshot)
+    assert changes
+    assert b.update(changes) == 0
+    return deps.snapshot(current)
+
+
+def test_watch_update_matches_fresh_build(workdir):
+    b, rc = build('doc.mdm', 'watched.html', incremental=True)
+    assert rc == 0
+    snapshot = b.config.deps.snapshot()
+
+    # an include, then data, then the document itself
+    write('part.mdm', PART.replace('A part', 'An edited part')
+          + "\\head[title=\"More\"]\n")
+    snapshot = _update(b, snapshot)
+    build('doc.mdm', 'fresh.html')
+    assert read('watched.html') == read('fresh.html')
+    assert 'An edited part' in read('watched.html')
+
+    write(os.path.join('data', 'books.yaml'),
+          BOOKS.replace('A Book', 'A Renamed Book'))
+    snapshot = _update(b, snapshot)
+    build('doc.mdm', 'fresh.html')
+    assert read('watched.html') == read('fresh.html')
+    assert 'A Renamed Book' in read('watched.html')
+
+    write('doc.mdm', DOCUMENT.replace('Read', 'Do read'))
+    _update(b, snapshot)
+    build('doc.mdm', 'fresh.html')
+    assert read('watched.html') == read('fresh.html')
+    assert 'Do read' in read('watched.html')
+
+
+def test_nothing_changed(workdir):
+    b, _ = build('doc.mdm', 'watched.html', incremental=True)
+    deps = b.config.deps
+
+    changes, _ = deps.changes_since(deps.snapshot())
+
+    assert not changes